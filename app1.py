@@ -2,6 +2,8 @@
 from bq_module import *
 from sql_module import *
 from gcs_module import *
+from pipeline_module import Pipeline
+from ingest_module import read_avro_rows
 
 
 
@@ -103,41 +105,68 @@ ON
   min_table.state = max_table.state'''
 
     write_disposition = 'WRITE_TRUNCATE'
-
-    # if the export to bg table went through
-    if export_to_table(json_key, sql, 'my_data', 'my_table', None,
-                       write_disposition):
-        # proceed with the export to GCS
-        export_to_gcs(json_key, 'my_data', 'my_table',
-                      ['gs://testweathernikos/app1.csv'])
-
-    bq_client = connect_client(json_key_file=json_key)
-    # Fetch table schema
-    table_schema = bq_client.get_table_schema('my_data', 'my_table')
-    # table_schema = [{u'type': u'FLOAT', u'name': u'max_celsius', u'mode': u'NULLABLE'}, {u'type': u'FLOAT', u'name': u'min_celsius', u'mode': u'NULLABLE'}, {u'type': u'STRING', u'name': u'state', u'mode': u'NULLABLE'}]
-    # statement: CREATE TABLE USING JSON table_schema
-    create_table_query = create_sql_from_json_schema(table_schema)
     # TODO Add operations code to test if ./cloudproxy is on.
     # TODO get credentials more securely and with argparse
     user = 'root'
     password =  '97103'
     database = 'demo'
-    # Check if table already exists
-    mysql_query_result = run_query(user, password, database, create_table_query)
-    print "Dropping table"
-    if mysql_query_result == 1050:
-        run_query(user, password, database, 'DROP TABLE temps')
-    # rerun the query
-    mysql_query_result = run_query(user, password, database, create_table_query)
-
-    # Call GCS client and download files (BigQuery result)
-    gcs_client = GCSClient()
     bucket_name = 'testweathernikos'
-    file_names = ['app1.csv']
-    for f_n in file_names:
-        gcs_client.download_file(bucket_name, f_n)
+    # Sharded Avro export, every shard is loaded as soon as it lands. Avro
+    # keeps the values typed, so floats are not turned into text and back
+    destination_prefix = 'gs://testweathernikos/app1'
+
+    # The query, schema, export and shards stages share the client from
+    # their own threads, give each one its own HTTP transport
+    bq_client = connect_client(json_key_file=json_key, pool_size=4)
+    gcs_client = GCSClient()
+
+    def run_bq_query():
+        job = bq_client.write_to_table(sql, 'my_data', 'my_table', None,
+                                       write_disposition)
+        return bq_client.wait_for_job(job, timeout=600)
+
+    def create_table(table_schema):
+        # statement: CREATE TABLE USING JSON table_schema. The shards are
+        # loaded into a shadow table, readers keep the previous temps
+        create_table_query = create_sql_from_json_schema(table_schema,
+                                                         TABLE_PLACEHOLDER)
+        return create_shadow_table(user, password, database, 'temps',
+                                   create_table_query)
+
+    def export(query_job):
+        return bq_client.export_sharded(destination_prefix, 'my_data',
+                                        'my_table', destination_format='AVRO')
+
+    def shards(export_job):
+        return iter_export_shards(bq_client, gcs_client, export_job)
+
+    def download(blobs):
+        # Call GCS client and download files (BigQuery result)
+        for blob in blobs:
+            yield gcs_client.download_file(bucket_name, blob.name)
+
+    def load(table_schema, shadow, paths):
+        # Stream the decoded rows into the table with LOAD DATA
+        for path in paths:
+            load_rows(user, password, database, shadow,
+                      read_avro_rows(path, table_schema))
 
+    def publish(_):
+        # Swap the loaded table in, the previous one is kept for rollback
+        publish_shadow_table(user, password, database, 'temps',
+                             keep_previous=True)
 
-    # Insert into DB with local data infile
-    load_data_query = "LOAD DATA LOCAL INFILE 'app1.csv' INTO TABLE temps CHARACTER SET 'utf8' FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '\"' IGNORE 1 LINES ; "
-    mysql_load_data_result = run_query(user, password, database, load_data_query)
+    # The table schema comes from a dry run of the query, so the MySQL table
+    # is created while the query runs
+    pipeline = Pipeline()
+    pipeline.add('query', run_bq_query)
+    pipeline.add('schema', lambda: bq_client.query_schema(sql))
+    pipeline.add('create_table', create_table, requires=['schema'])
+    pipeline.add('export', export, requires=['query'])
+    pipeline.add('shards', shards, requires=['export'], stream=True)
+    pipeline.add('download', download, requires=['shards'], stream=True)
+    pipeline.add('load', load,
+                 requires=['schema', 'create_table', 'download'])
+    pipeline.add('publish', publish, requires=['load'])
+    pipeline.run()
+    print pipeline.report()
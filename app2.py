@@ -4,6 +4,16 @@ import gzip
 import csv
 from sql_module import *
 from gcs_module import *
+from ingest_module import *
+
+# Field order of the `cities` table, region_id is missing from some lines
+CITIES_SCHEMA = [
+    {'name': 'id', 'type': 'INTEGER'},
+    {'name': 'country_id', 'type': 'INTEGER'},
+    {'name': 'region_id', 'type': 'INTEGER'},
+    {'name': 'name', 'type': 'STRING'},
+    {'name': 'iso_code', 'type': 'STRING'},
+]
 
 if __name__ == '__main__':
     json_key = 'My First Project-8a317759be48.json'
@@ -16,22 +26,8 @@ if __name__ == '__main__':
     #     filename, file_extension = os.path.splitext(f_n)
     #     gcs_client.download_file(bucket_name, f_n)
 
-    with gzip.open('cities.gz','r') as f:
-        with open('city.csv', 'wb') as csv_file:
-            writer = csv.writer(csv_file)
-            for line in f:
-                writer.writerow(eval(line).values())
-    f.close()
-
-    f = gzip.open('countries.gzip', 'rb')
-    file_content = f.read()
-    # print file_content
-    with open('countries.csv', 'wb') as outfile:
-        outfile.write(file_content)
-    f.close()
-
 
-    sql1 = '''CREATE TABLE `cities` (
+    sql1 = '''CREATE TABLE `{table}` (
         city_id INTEGER,
         country_id INTEGER,
         region_id INTEGER,
@@ -39,7 +35,7 @@ if __name__ == '__main__':
         iso_code VARCHAR(10)
         ) DEFAULT CHARSET=utf8;'''
 
-    sql2 = '''CREATE TABLE `countries` (
+    sql2 = '''CREATE TABLE `{table}` (
         country_id INTEGER,
         alpha2 VARCHAR(10),
         alpha3 VARCHAR(10),
@@ -48,48 +44,35 @@ if __name__ == '__main__':
         ) DEFAULT CHARSET=utf8;'''
 
 
-    sql3 = '''CREATE TABLE `regions` (
+    sql3 = '''CREATE TABLE `{table}` (
         region_id INTEGER,
         country_id  INTEGER,
         name VARCHAR(10),
         iso_code VARCHAR(10)
         ) DEFAULT CHARSET=utf8;'''
 
-    # CREATE TABLES
-    # Check if table already exists
-    mysql_query_result = run_query(user, password, database, sql1)
-    # print "Dropping table"
-    if mysql_query_result == 1050:
-        run_query(user, password, database, 'DROP TABLE cities')
-    # rerun the query
-    mysql_query_result = run_query(user, password, database, sql1)
-
-    # Check if table already exists
-    mysql_query_result = run_query(user, password, database, sql2)
-    # print "Dropping table"
-    if mysql_query_result == 1050:
-        run_query(user, password, database, 'DROP TABLE countries')
-    # rerun the query
-    mysql_query_result = run_query(user, password, database, sql2)
-
-    # Check if table already exists
-    mysql_query_result = run_query(user, password, database, sql3)
-    # print "Dropping table"
-    if mysql_query_result == 1050:
-        run_query(user, password, database, 'DROP TABLE regions')
-    # rerun the query
-    mysql_query_result = run_query(user, password, database, sql3)
-
-
+    # Every table is loaded into a shadow table and swapped in with a
+    # single RENAME TABLE, so the joins below never see a missing or half
+    # loaded table
    # Insert into DB with local data infile
-    load_data_query = "LOAD DATA LOCAL INFILE 'city.csv' INTO TABLE cities CHARACTER SET 'utf8' FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '\"' IGNORE 1 LINES ; "
-    mysql_load_data_result = run_query(user, password, database, load_data_query)
-
-    load_data_query = "LOAD DATA LOCAL INFILE 'countries.csv' INTO TABLE countries CHARACTER SET 'utf8' FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '\"' IGNORE 1 LINES ; "
-    mysql_load_data_result = run_query(user, password, database, load_data_query)
-
-    load_data_query = "LOAD DATA LOCAL INFILE 'regions.csv' INTO TABLE regions CHARACTER SET 'utf8' FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '\"' IGNORE 1 LINES ; "
+    # The gzip files are decompressed, decoded and loaded in one streaming
+    # pass, no CSV is staged on disk
+    mysql_load_data_result = atomic_load(
+        user, password, database, 'cities', sql1,
+        read_ndjson_rows('cities.gz', CITIES_SCHEMA))
+
+    with gzip.open('countries.gzip', 'rb') as f:
+        reader = csv.reader(f)
+        next(reader)  # header
+        mysql_load_data_result = atomic_load(user, password, database,
+                                             'countries', sql2, reader)
+
+    shadow = create_shadow_table(user, password, database, 'regions', sql3)
+    load_data_query = "LOAD DATA LOCAL INFILE 'regions.csv' INTO TABLE " + shadow + " CHARACTER SET 'utf8' FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '\"' IGNORE 1 LINES ; "
     mysql_load_data_result = run_query(user, password, database, load_data_query)
+    # run_query returns the error code of a failed load, keep the old regions
+    if not isinstance(mysql_load_data_result, int):
+        publish_shadow_table(user, password, database, 'regions')
 
 
     # SQL query to join tables is in sql2.sql
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""asyncio variant of bq_module.BigQueryClient (Python 3 only)."""
+import asyncio
+import json
+
+import aiohttp
+from httplib2 import Response
+from googleapiclient.errors import HttpError
+
+from bq_module import (
+    BaseBigQueryClient, BigQueryTimeoutException, BIGQUERY_SCOPE,
+    _credentials
+)
+from polling_module import get_polling_strategy, clip_to_deadline
+
+BIGQUERY_API_URL = 'https://bigquery.googleapis.com/bigquery/v2'
+
+# Refresh access tokens this many seconds before they expire
+TOKEN_EXPIRY_MARGIN = 60
+
+
+async def connect_async_client(json_key_file, session=None, limit=100,
+                               base_url=BIGQUERY_API_URL):
+    """Return an asyncio client connection to the BigQuery API.
+    A local JSON key file must be provided for authentication
+
+    Args:
+        json_key_file: A locally downloaded JSON file with connection
+        /authentication info
+        session: aiohttp.ClientSession to use, a new one is created and owned
+        by the client if not given
+        limit: Maximum number of simultaneous connections of a new session
+        base_url: Root URL of the BigQuery REST API
+
+    Returns:
+        client: An AsyncBigQueryClient object
+    """
+    with open(json_key_file, 'r') as key_file:
+        json_key = json.load(key_file)
+    credentials = _credentials().from_json_keyfile_dict(json_key,
+                                                        scopes=BIGQUERY_SCOPE)
+
+    return AsyncBigQueryClient(json_key['project_id'],
+                               token_provider=AccessTokenProvider(credentials),
+                               session=session, limit=limit,
+                               base_url=base_url)
+
+
+class AccessTokenProvider(object):
+    """Provide OAuth access tokens without blocking the event loop.
+
+    oauth2client refreshes tokens with blocking HTTP calls, so the refresh
+    runs in the default executor. Tokens are cached until shortly before
+    they expire and concurrent callers share a single refresh.
+    """
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self._token = None
+        self._expires_at = 0
+        self._lock = asyncio.Lock()
+
+    async def __call__(self):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            if self._token is None or loop.time() >= self._expires_at:
+                info = await loop.run_in_executor(
+                    None, self.credentials.get_access_token)
+                self._token = info.access_token
+                self._expires_at = loop.time() + \
+                    (info.expires_in or 0) - TOKEN_EXPIRY_MARGIN
+            return self._token
+
+
+class AsyncBigQueryClient(BaseBigQueryClient):
+    """BigQuery client whose API calls are coroutines.
+
+    It has the surface of bq_module.BigQueryClient, but talks to the REST
+    API with aiohttp and waits with ``asyncio.sleep``, so any number of jobs
+    can be in flight from a single event loop.
+
+    Args:
+        project_id: String, the BigQuery project
+        token_provider: coroutine function returning an OAuth access token,
+        or None for unauthenticated requests
+        session: aiohttp.ClientSession, created and owned if not given
+        limit: Maximum number of simultaneous connections of a new session
+        base_url: Root URL of the BigQuery REST API
+    """
+
+    def __init__(self, project_id, token_provider=None, session=None,
+                 limit=100, base_url=BIGQUERY_API_URL):
+        self.project_id = project_id
+        self.token_provider = token_provider
+        self.base_url = base_url.rstrip('/')
+        self._session = session
+        self._owns_session = session is None
+        self._limit = limit
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Close the HTTP session if it is owned by the client"""
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._limit))
+        return self._session
+
+    async def _request(self, method, path, body=None):
+        """Perform an API call and return the decoded JSON response
+
+        Raises:
+            HttpError: on non 2xx responses, like googleapiclient does
+        """
+        url = '{0}/projects/{1}/{2}'.format(self.base_url, self.project_id,
+                                             path)
+        headers = {}
+        if self.token_provider is not None:
+            headers['Authorization'] = 'Bearer {0}'.format(
+                await self.token_provider())
+
+        async with self.session.request(method, url, json=body,
+                                        headers=headers) as response:
+            content = await response.read()
+            if response.status >= 300:
+                resp = Response({'status': response.status})
+                resp.reason = response.reason
+                raise HttpError(resp, content, uri=url)
+            return json.loads(content.decode('utf-8'))
+
+    async def _submit_job(self, config):
+        """ Submit a job to BigQuery, see BigQueryClient._submit_job"""
+        return await self._request('POST', 'jobs', config)
+
+    async def write_to_table(self, query, dataset=None, table=None,
+                             external_udf_uris=None, write_disposition=None):
+        """
+        Write query result to table, see BigQueryClient.write_to_table
+
+        Returns:
+            BigQuery job resource as dict
+
+        Raises:
+
+            JobInsertException
+                On http/auth failures or error in result
+        """
+        body = self._query_job_body(query, dataset, table,
+                                    external_udf_uris, write_disposition)
+
+        job_resource = await self._submit_job(body)
+        self._raise_insert_exception_if_error(job_resource)
+        return job_resource
+
+    async def wait_for_job(self, job, interval=None, timeout=60,
+                           polling=None):
+        """
+        Waits until the job is done or has failed, without blocking the
+        event loop. See BigQueryClient.wait_for_job
+
+        Returns:
+
+            dict
+                Final state of the job resource
+
+        Raises:
+
+             JobExecutingException or BigQueryTimeoutException
+                On http/auth failures or timeout
+        """
+        loop = asyncio.get_running_loop()
+        job_id = self._job_id(job)
+        delays = get_polling_strategy(polling, interval).delays()
+
+        deadline = loop.time() + timeout
+        while True:
+            await asyncio.sleep(clip_to_deadline(next(delays), loop.time(),
+                                                 deadline))
+            job_resource = await self._request('GET', 'jobs/' + job_id)
+            self._raise_executing_exception_if_error(job_resource)
+            if job_resource.get('status').get('state') == u'DONE':
+                return job_resource
+            if loop.time() >= deadline:
+                raise BigQueryTimeoutException()
+
+    async def export_data_to_uris(self, destination_uris, dataset, table,
+                                  job=None, compression=None,
+                                  destination_format=None, print_header=None,
+                                  field_delimiter=None):
+        """
+        Export data from a BigQuery table to cloud storage, see
+        BigQueryClient.export_data_to_uris
+
+        Returns:
+                A BigQuery job resource
+
+        Raises:
+            JobInsertException
+                On http/auth failures or error in result
+        """
+        body = self._extract_job_body(
+            destination_uris, dataset, table, job, compression,
+            destination_format, print_header, field_delimiter)
+
+        job_resource = await self._submit_job(body)
+        self._raise_insert_exception_if_error(job_resource)
+        return job_resource
+
+    async def get_dataset(self, dataset_id):
+        """Retrieve a dataset if it exists, otherwise return an empty dict.
+        """
+        try:
+            return await self._request('GET', 'datasets/' + dataset_id)
+        except HttpError:
+            return {}
+
+    async def get_table_schema(self, dataset, table):
+        """Return the table schema, or None if the table doesn't exist.
+        """
+        try:
+            result = await self._request(
+                'GET', 'datasets/{0}/tables/{1}'.format(dataset, table))
+        except HttpError as e:
+            if int(e.resp['status']) == 404:
+                return None
+            raise
+
+        return result['schema']['fields']
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""Batched multi-row INSERT (sql_module.bulk_insert) vs LOAD DATA LOCAL
+INFILE, loading the bundled cities.gz and stations.gz.
+
+    python benchmarks/bench_bulk_insert.py --user U --password P \\
+        --database DB [--host HOST] [--max-bytes N ...]
+
+The tables ``bench_cities`` and ``bench_stations`` are dropped and created
+for every run. Without ``--database`` only the client side cost of
+building the INSERT statements is measured, no server is needed.
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+from time import time
+
+import pymysql
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sql_module  # noqa: E402
+
+TABLES = {
+    'bench_cities': (
+        ['id', 'country_id', 'region_id', 'name', 'iso_code'],
+        '''CREATE TABLE `bench_cities` (
+            id INTEGER, country_id INTEGER, region_id INTEGER,
+            name VARCHAR(64), iso_code VARCHAR(10)
+            ) DEFAULT CHARSET=utf8;'''),
+    'bench_stations': (
+        ['usaf', 'wban', 'name', 'country', 'state', 'call', 'lat', 'lon',
+         'elev', 'begin', 'end'],
+        '''CREATE TABLE `bench_stations` (
+            usaf VARCHAR(6), wban VARCHAR(5), name VARCHAR(64),
+            country VARCHAR(2), state VARCHAR(2), `call` VARCHAR(4),
+            lat VARCHAR(10), lon VARCHAR(10), elev VARCHAR(10),
+            `begin` VARCHAR(8), `end` VARCHAR(8)
+            ) DEFAULT CHARSET=utf8;'''),
+}
+
+
+def read_cities():
+    columns = TABLES['bench_cities'][0]
+    with gzip.open(os.path.join(ROOT, 'cities.gz'), 'rt') as f:
+        # region_id is missing from some rows
+        return [[row.get(c) for c in columns] for row in map(json.loads, f)]
+
+
+def read_stations():
+    with gzip.open(os.path.join(ROOT, 'stations.gz'), 'rt') as f:
+        reader = csv.reader(f)
+        next(reader)
+        return list(reader)
+
+
+def write_csv(rows):
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with io.open(fd, 'w', newline='', encoding='utf8') as f:
+        # \N is the NULL of LOAD DATA
+        csv.writer(f).writerows(
+            ['\\N' if value is None else value for value in row]
+            for row in rows)
+    return path
+
+
+def reset_table(args, pool, table):
+    sql_module.run_query(args.user, args.password, args.database,
+                         'DROP TABLE IF EXISTS `{0}`'.format(table), pool)
+    sql_module.run_query(args.user, args.password, args.database,
+                         TABLES[table][1], pool)
+
+
+def report(label, rows, seconds):
+    print('{:<44} {:>8.3f} s {:>10.0f} rows/s'.format(
+        label, seconds, rows / seconds))
+
+
+class EscapeOnly(object):
+    """Stands in for a connection when only building statements"""
+
+    def escape(self, value):
+        return pymysql.converters.escape_item(value, 'utf8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument('--database')
+    parser.add_argument('--max-bytes', type=int, nargs='+',
+                        default=[64 * 1024, 256 * 1024, 1024 * 1024])
+    parser.add_argument('--commit-every', type=int, default=10)
+    args = parser.parse_args()
+
+    datasets = [('bench_cities', read_cities()),
+                ('bench_stations', read_stations())]
+
+    if not args.database:
+        for table, rows in datasets:
+            for max_bytes in args.max_bytes:
+                start = time()
+                statements = list(sql_module.iter_insert_statements(
+                    EscapeOnly(), table, TABLES[table][0], rows, max_bytes))
+                report('{0} build {1} stmts <= {2} B'.format(
+                    table, len(statements), max_bytes), len(rows),
+                    time() - start)
+        return
+
+    pool = sql_module.ConnectionPool(args.user, args.password, args.database,
+                                     host=args.host, min_size=1, max_size=1)
+    try:
+        for table, rows in datasets:
+            path = write_csv(rows)
+            try:
+                reset_table(args, pool, table)
+                start = time()
+                sql_module.run_query(
+                    args.user, args.password, args.database,
+                    "LOAD DATA LOCAL INFILE '{0}' INTO TABLE `{1}` "
+                    "CHARACTER SET 'utf8' FIELDS TERMINATED BY ',' "
+                    "OPTIONALLY ENCLOSED BY '\"'".format(path, table), pool)
+                report('{0} LOAD DATA LOCAL INFILE'.format(table), len(rows),
+                       time() - start)
+            finally:
+                os.remove(path)
+
+            for max_bytes in args.max_bytes:
+                reset_table(args, pool, table)
+                start = time()
+                sql_module.bulk_insert(
+                    args.user, args.password, args.database, table,
+                    TABLES[table][0], rows, max_statement_bytes=max_bytes,
+                    commit_every=args.commit_every, pool=pool)
+                report('{0} bulk_insert {1} B'.format(table, max_bytes),
+                       len(rows), time() - start)
+
+            reset_table(args, pool, table)
+            start = time()
+            with pool.transaction() as connection:
+                with connection.cursor() as cursor:
+                    for row in rows[:2000]:
+                        cursor.execute(
+                            'INSERT INTO `{0}` VALUES ({1})'.format(
+                                table, ','.join(['%s'] * len(row))), row)
+            report('{0} row at a time (2000 rows)'.format(table), 2000,
+                   time() - start)
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Decode time and memory of dict rows vs columnar results.
+
+Decodes a synthetic 1M row result shaped like the output of query.sql
+(max_celsius FLOAT, min_celsius FLOAT, state STRING) in pages of 100k rows.
+Time is measured in a plain run, peak memory in a second, traced run.
+
+    python benchmarks/bench_columnar_results.py [rows]
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from results_module import (  # noqa: E402
+    decode_columns, make_row_decoder, _numpy
+)
+
+PAGE_SIZE = 100000
+FIELDS = [
+    {'name': 'max_celsius', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+    {'name': 'min_celsius', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+    {'name': 'state', 'type': 'STRING', 'mode': 'NULLABLE'},
+]
+STATES = ['AK', 'AL', 'AZ', 'CA', 'CO', 'NV', 'NY', 'TX', 'WA', None]
+
+
+def make_page(rng, size):
+    def cell(value):
+        return {'v': value}
+    return [{'f': [cell(None if rng.random() < 0.01 else
+                        repr(rng.uniform(-40, 50))),
+                   cell(repr(rng.uniform(-60, 30))),
+                   cell(rng.choice(STATES))]}
+            for _ in range(size)]
+
+
+def dict_rows(pages):
+    decode = make_row_decoder(FIELDS)
+    return [decode(row) for page in pages for row in page]
+
+
+def measure(label, func, pages):
+    start = time.time()
+    func(pages)
+    elapsed = time.time() - start
+
+    tracemalloc.start()
+    result = func(pages)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<22} {:>8.2f} s {:>10.1f} MB peak'.format(
+        label, elapsed, peak / 1e6))
+    return result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    page = make_page(random.Random(0), min(PAGE_SIZE, rows))
+    # The same page object is reused so the input is not part of the peak
+    pages = [page] * (rows // len(page))
+    print('{0} rows in {1} pages'.format(len(page) * len(pages), len(pages)))
+
+    measure('dict rows', dict_rows, pages)
+    measure('array.array columns',
+            lambda p: decode_columns(p, FIELDS, use_numpy=False), pages)
+    if _numpy() is not None:
+        measure('numpy columns',
+                lambda p: decode_columns(p, FIELDS, use_numpy=True), pages)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Cold vs warm construction time of connect_client.
+
+Credentials are faked so no key or network access is needed, service
+objects are built from real discovery documents.
+
+    python benchmarks/bench_connect_client.py [--network]
+
+``--network`` also measures the legacy path that fetches the discovery
+document over HTTPS on every call.
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bq_module  # noqa: E402
+
+REPEAT = 20
+
+
+class FakeCredentials(object):
+
+    @classmethod
+    def from_json_keyfile_dict(cls, json_key, scopes):
+        return cls()
+
+    def authorize(self, http):
+        return http
+
+
+def measure(label, func, repeat=REPEAT):
+    seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+    print('{:<40} {:>10.3f} ms'.format(label, seconds * 1000))
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    key_file = os.path.join(tmp_dir, 'key.json')
+    with open(key_file, 'w') as f:
+        json.dump({'project_id': 'bench'}, f)
+    cache_dir = os.path.join(tmp_dir, 'discovery')
+    bq_module._save_discovery_document(
+        'bigquery', 'v2', cache_dir,
+        json.loads(bq_module._load_discovery_document('bigquery', 'v2')))
+
+    def cold(**kwargs):
+        return lambda: bq_module.connect_client(key_file, use_cache=False,
+                                                **kwargs)
+
+    try:
+        with mock.patch.object(bq_module, '_credentials',
+                               return_value=FakeCredentials):
+            if '--network' in sys.argv:
+                with mock.patch.object(bq_module, '_load_discovery_document',
+                                       return_value=None):
+                    measure('cold, discovery fetched over network', cold(),
+                            repeat=3)
+            measure('cold, bundled discovery document', cold())
+            measure('cold, on-disk discovery cache',
+                    cold(discovery_cache_dir=cache_dir))
+            bq_module.connect_client(key_file)
+            measure('warm, cached service',
+                    lambda: bq_module.connect_client(key_file))
+    finally:
+        bq_module.clear_client_cache()
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
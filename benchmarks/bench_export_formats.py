@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""Size and typed decoding speed of CSV, Avro and Parquet export shards.
+
+    python benchmarks/bench_export_formats.py [--rows N]
+
+A shard of synthetic GSOD-like rows is written as BigQuery exports it:
+gzip CSV (floats and timestamps as text, NULL as an empty field), deflate
+Avro and snappy Parquet. Every shard is then decoded into typed rows: the
+CSV with csv.reader and a converter per column, Avro and Parquet with
+ingest_module. Formats whose library is not installed are skipped.
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import gzip
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+from datetime import date, datetime, timedelta, tzinfo
+from time import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ingest_module  # noqa: E402
+
+SCHEMA = [
+    {'name': 'stn', 'type': 'STRING', 'mode': 'NULLABLE'},
+    {'name': 'day', 'type': 'DATE', 'mode': 'NULLABLE'},
+    {'name': 'observed', 'type': 'TIMESTAMP', 'mode': 'NULLABLE'},
+    {'name': 'temp', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+    {'name': 'max', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+    {'name': 'min', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+    {'name': 'prcp', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+    {'name': 'count_temp', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+]
+
+AVRO_TYPES = {
+    'STRING': 'string',
+    'DATE': 'string',
+    'TIMESTAMP': {'type': 'long', 'logicalType': 'timestamp-micros'},
+    'FLOAT': 'double',
+    'INTEGER': 'long',
+}
+
+
+class UTC(tzinfo):
+
+    def utcoffset(self, dt):
+        return timedelta(0)
+
+    def dst(self, dt):
+        return timedelta(0)
+
+
+def make_records(count):
+    rng = random.Random(42)
+    start = datetime(1990, 1, 1, tzinfo=UTC())
+    records = []
+    for i in range(count):
+        observed = start + timedelta(minutes=37 * i)
+        records.append({
+            'stn': '{0:06d}'.format(rng.randint(0, 999999)),
+            'day': observed.date(),
+            'observed': observed,
+            'temp': round(rng.uniform(-40, 110), 1),
+            'max': round(rng.uniform(-40, 120), 1),
+            'min': round(rng.uniform(-60, 100), 1),
+            # Precipitation is often missing
+            'prcp': round(rng.uniform(0, 5), 2) if i % 3 else None,
+            'count_temp': rng.randint(4, 24),
+        })
+    return records
+
+
+def write_csv(path, records):
+    names = [field['name'] for field in SCHEMA]
+    with gzip.open(path, 'wt', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        for record in records:
+            row = []
+            for name in names:
+                value = record[name]
+                if value is None:
+                    value = ''
+                elif isinstance(value, datetime):
+                    value = value.strftime('%Y-%m-%d %H:%M:%S UTC')
+                row.append(value)
+            writer.writerow(row)
+
+
+def write_avro(path, records):
+    import fastavro
+    schema = {'type': 'record', 'name': 'Root', 'fields': [
+        {'name': field['name'],
+         'type': ['null', AVRO_TYPES[field['type']]]} for field in SCHEMA]}
+    records = [dict(record, day=record['day'].isoformat())
+               for record in records]
+    with open(path, 'wb') as f:
+        fastavro.writer(f, fastavro.parse_schema(schema), records,
+                        codec='deflate')
+
+
+def write_parquet(path, records):
+    import pyarrow
+    import pyarrow.parquet
+    table = pyarrow.Table.from_pylist(records, schema=pyarrow.schema([
+        ('stn', pyarrow.string()), ('day', pyarrow.date32()),
+        ('observed', pyarrow.timestamp('us', tz='UTC')),
+        ('temp', pyarrow.float64()), ('max', pyarrow.float64()),
+        ('min', pyarrow.float64()), ('prcp', pyarrow.float64()),
+        ('count_temp', pyarrow.int64())]))
+    pyarrow.parquet.write_table(table, path, compression='snappy')
+
+
+def read_csv(path):
+    converters = [ingest_module.NDJSON_CONVERTERS[field['type']]
+                  for field in SCHEMA]
+    with gzip.open(path, 'rt', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        return sum(1 for row in reader
+                   if [None if value == '' else convert(value)
+                       for convert, value in zip(converters, row)])
+
+
+def read_avro(path):
+    return sum(1 for _ in ingest_module.read_avro_rows(path, SCHEMA))
+
+
+def read_parquet(path):
+    return sum(1 for _ in ingest_module.read_parquet_rows(path, SCHEMA))
+
+
+FORMATS = [
+    ('CSV (gzip)', 'shard.csv.gz', write_csv, read_csv),
+    ('AVRO (deflate)', 'shard.avro', write_avro, read_avro),
+    ('PARQUET (snappy)', 'shard.parquet', write_parquet, read_parquet),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    records = make_records(args.rows)
+    print('{0} rows'.format(args.rows))
+    print('{:<18} {:>10} {:>9} {:>12}'.format('format', 'bytes', 'seconds',
+                                              'rows/s'))
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for label, name, write, read in FORMATS:
+            path = os.path.join(tmp_dir, name)
+            try:
+                write(path, records)
+            except ImportError as e:
+                print('{:<18} skipped, {}'.format(label, e))
+                continue
+            start = time()
+            rows = read(path)
+            seconds = time() - start
+            print('{:<18} {:>10} {:>9.3f} {:>12.0f}'.format(
+                label, os.path.getsize(path), seconds, rows / seconds))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Rows per second of decoding the bundled cities.gz NDJSON.
+
+    python benchmarks/bench_ndjson_ingest.py [--copies N]
+
+Compares the former ``eval`` of every line, ``json.loads`` of every line
+and ingest_module's batched decoding, with the stdlib decoder and with the
+fastest installed one. The decompressed lines are held in memory (repeated
+``--copies`` times) so only decoding is measured.
+"""
+from __future__ import print_function
+
+import argparse
+import gzip
+import json
+import os
+import sys
+from time import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ingest_module  # noqa: E402
+
+CITIES_SCHEMA = [
+    {'name': 'id', 'type': 'INTEGER'},
+    {'name': 'country_id', 'type': 'INTEGER'},
+    {'name': 'region_id', 'type': 'INTEGER'},
+    {'name': 'name', 'type': 'STRING'},
+    {'name': 'iso_code', 'type': 'STRING'},
+]
+COLUMNS = [field['name'] for field in CITIES_SCHEMA]
+
+
+def per_line_eval(lines):
+    return [list(eval(line).values()) for line in lines]
+
+
+def per_line_json(lines):
+    rows = []
+    for line in lines:
+        obj = json.loads(line)
+        rows.append((int(obj['id']), int(obj['country_id']),
+                     int(obj['region_id']) if 'region_id' in obj else None,
+                     obj['name'], obj['iso_code']))
+    return rows
+
+
+def batched(loads):
+    def run(lines):
+        return list(ingest_module.iter_ndjson_rows(lines, CITIES_SCHEMA,
+                                                   loads=loads))
+    return run
+
+
+def measure(label, func, lines, repeat=3):
+    seconds = min(_timed(func, lines) for _ in range(repeat))
+    print('{:<36} {:>8.3f} s {:>12.0f} rows/s'.format(
+        label, seconds, len(lines) / seconds))
+
+
+def _timed(func, lines):
+    start = time()
+    func(lines)
+    return time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--copies', type=int, default=4)
+    args = parser.parse_args()
+
+    with gzip.open(os.path.join(ROOT, 'cities.gz'), 'rb') as f:
+        lines = [line for line in f if line.strip()] * args.copies
+    print('{0} lines'.format(len(lines)))
+
+    measure('eval per line', per_line_eval, lines)
+    measure('json.loads per line', per_line_json, lines)
+    measure('batched, json', batched(json.loads), lines)
+    fastest = ingest_module._json_loads()
+    measure('batched, {0}'.format(fastest.__module__), batched(fastest),
+            lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Serial vs multi-process decoding of gzip shards.
+
+    python benchmarks/bench_parallel_ingest.py [--shards N] [--processes P]
+
+The bundled cities.gz (NDJSON) is copied into ``--shards`` shards, as a
+sharded BigQuery export would be, and decoded by one process, then by
+ingest_module.iter_parallel_rows with 1 to ``--processes`` workers.
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from time import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ingest_module  # noqa: E402
+
+CITIES_SCHEMA = [
+    {'name': 'id', 'type': 'INTEGER'},
+    {'name': 'country_id', 'type': 'INTEGER'},
+    {'name': 'region_id', 'type': 'INTEGER'},
+    {'name': 'name', 'type': 'STRING'},
+    {'name': 'iso_code', 'type': 'STRING'},
+]
+
+
+def report(label, rows, seconds):
+    print('{:<28} {:>8.3f} s {:>12.0f} rows/s'.format(label, seconds,
+                                                       rows / seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        paths = []
+        for shard in range(args.shards):
+            path = os.path.join(tmp_dir, 'cities-{0:012d}.json.gz'.format(
+                shard))
+            shutil.copyfile(os.path.join(ROOT, 'cities.gz'), path)
+            paths.append(path)
+        print('{0} shards, {1} CPUs'.format(args.shards,
+                                            multiprocessing.cpu_count()))
+
+        start = time()
+        rows = sum(1 for path in paths
+                   for _ in ingest_module.read_ndjson_rows(path,
+                                                           CITIES_SCHEMA))
+        report('serial', rows, time() - start)
+
+        decoder = ingest_module.NdjsonDecoder(CITIES_SCHEMA)
+        for processes in range(1, args.processes + 1):
+            start = time()
+            rows = sum(1 for _ in ingest_module.iter_parallel_rows(
+                paths, decoder, processes=processes))
+            report('{0} processes'.format(processes), rows, time() - start)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
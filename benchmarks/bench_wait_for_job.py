@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Latency-to-detect-DONE of BigQueryClient.wait_for_job per polling strategy.
+
+Runs against a fake ``jobs()`` service on a virtual clock, so the whole
+benchmark takes milliseconds while simulating minutes of waiting.
+
+    python benchmarks/bench_wait_for_job.py
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+
+import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bq_module  # noqa: E402
+from bq_module import BigQueryClient  # noqa: E402
+from polling_module import (  # noqa: E402
+    ExponentialBackoffPolling, FixedIntervalPolling
+)
+
+JOB_DURATIONS = [0.3, 1.2, 2.7, 6.4, 13.1, 31.9, 64.5, 127.3]
+TIMEOUT = 600
+
+
+class VirtualClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeJobsService(object):
+    """Minimal stand-in for ``bigquery.jobs()`` finishing after ``duration``"""
+
+    def __init__(self, clock, duration):
+        self.clock = clock
+        self.done_at = clock.time() + duration
+        self.calls = 0
+
+    def jobs(self):
+        return self
+
+    def get(self, projectId, jobId):
+        return self
+
+    def execute(self):
+        self.calls += 1
+        state = u'DONE' if self.clock.time() >= self.done_at else u'RUNNING'
+        return {'status': {'state': state}}
+
+
+class LegacyPolling(FixedIntervalPolling):
+    """The pre-backoff behaviour: sleep 5 s before every check"""
+
+    def __init__(self):
+        super(LegacyPolling, self).__init__(5, immediate=False)
+
+
+STRATEGIES = [
+    ('legacy fixed 5s', LegacyPolling),
+    ('fixed 5s immediate', lambda: FixedIntervalPolling(5)),
+    ('backoff (default)',
+     lambda: ExponentialBackoffPolling(rng=random.Random(0))),
+]
+
+
+def measure(make_polling, duration):
+    clock = VirtualClock()
+    service = FakeJobsService(clock, duration)
+    client = BigQueryClient(service, 'project')
+    with mock.patch.object(bq_module, 'sleep', clock.sleep), \
+            mock.patch.object(bq_module, 'time', clock.time):
+        client.wait_for_job('job', timeout=TIMEOUT, polling=make_polling())
+    return clock.time() - duration, service.calls
+
+
+def main():
+    header = '{:>9} | '.format('job (s)') + ' | '.join(
+        '{:>24}'.format(name) for name, _ in STRATEGIES)
+    print('latency to detect DONE in seconds (number of jobs.get calls)')
+    print(header)
+    print('-' * len(header))
+    for duration in JOB_DURATIONS:
+        cells = []
+        for _, make_polling in STRATEGIES:
+            latency, calls = measure(make_polling, duration)
+            cells.append('{:>17.2f} ({:>4d})'.format(latency, calls))
+        print('{:>9} | '.format(duration) + ' | '.join(cells))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,170 @@
 #!/usr/bin/env python
 
+import os
 import json
 import six
+import threading
+import warnings
+from collections import OrderedDict
 from time import sleep, time
 from httplib2 import Http
 from hashlib import sha256
 
-from googleapiclient.discovery import build, DISCOVERY_URI
+from googleapiclient.discovery import (
+    build, build_from_document, DISCOVERY_URI
+)
 from googleapiclient.errors import HttpError
 
+from polling_module import get_polling_strategy, clip_to_deadline
+from cache_module import LRUCache, query_cache_key
+from results_module import make_row_decoder, iter_pages, decode_columns
+from transport_module import HttpPool
 
-def connect_client(json_key_file):
+# Maximum number of calls in a single HTTP batch request
+BATCH_REQUEST_LIMIT = 1000
+
+
+BIGQUERY_SCOPE = 'https://www.googleapis.com/auth/bigquery'
+
+# Table bytes per wildcard URI of a sharded export. BigQuery writes at most
+# 1 GB per file, and the files of every URI are written in parallel
+EXPORT_BYTES_PER_URI = 1024 ** 3
+MAX_EXPORT_URIS = 32
+
+# Compression of sharded exports when not given, per destination format
+DEFAULT_EXPORT_COMPRESSION = {
+    'CSV': 'GZIP',
+    'NEWLINE_DELIMITED_JSON': 'GZIP',
+    # Avro and Parquet blocks are compressed inside the files
+    'AVRO': 'DEFLATE',
+    'PARQUET': 'SNAPPY',
+}
+
+EXPORT_EXTENSIONS = {
+    'CSV': '.csv',
+    'NEWLINE_DELIMITED_JSON': '.json',
+    'AVRO': '.avro',
+    'PARQUET': '.parquet',
+}
+
+# Caches shared by every client built in this process, see get_service
+_cache_lock = threading.RLock()
+_json_keys = {}
+_credentials_cache = {}
+_services = {}
+
+
+def connect_client(json_key_file, discovery_cache_dir=None, use_cache=True,
+                   pool_size=None, query_cache=None):
     """Return a client connection to the BigQuery API.
     A local JSON key file must be provided for authentication
 
+    Parsed keys, credentials and built service objects are cached per
+    (key file, scope), so connecting again with the same key is free.
+
     Args:
         json_file: A locally downloaded JSON file with connection
         /authentication info
+        discovery_cache_dir: Directory holding cached discovery documents,
+        see get_service
+        use_cache: If False, always build a new service object
+        pool_size: If given, requests go through a thread-safe pool of that
+        many HTTP transports, so the client can be shared between threads
+        query_cache: Optional cache_module.QueryResultCache used by
+        write_to_table
 
     Returns:
         client: A BQ client object
 
     Raises:
     """
+    bq_service, project_id = get_service(json_key_file, BIGQUERY_SCOPE,
+                                         'bigquery', 'v2',
+                                         discovery_cache_dir=discovery_cache_dir,
+                                         use_cache=use_cache,
+                                         pool_size=pool_size)
+
+    return BigQueryClient(bq_service, project_id, query_cache=query_cache)
+
+
+def get_service(json_key_file, scope, api, version, discovery_cache_dir=None,
+                use_cache=True, pool_size=None):
+    """Return an authorized Google API service object and its project id.
 
-    # TODO check if json_key_file exists
-    if json_key_file:
-        with open(json_key_file, 'r') as key_file:
-            json_key = json.load(key_file)
+    The discovery document is read from ``discovery_cache_dir`` (or the
+    ``BQ_DISCOVERY_CACHE_DIR`` environment variable) when it holds a copy,
+    else from the documents bundled with googleapiclient, and only fetched
+    over the network as a last resort. A fetched document is written to the
+    cache directory so the next process starts without any discovery fetch.
+
+    Args:
+        json_key_file: A locally downloaded JSON key file
+        scope: String, OAuth scope requested for the credentials
+        api: String, API name, e.g. bigquery
+        version: String, API version, e.g. v2
+        discovery_cache_dir: String, optional directory of cached documents
+        use_cache: If False, bypass the in process caches
+        pool_size: int, optional size of a transport_module.HttpPool to send
+        the requests through, default is a single ``Http``
+
+    Returns:
+        tuple: (service, project_id)
+    """
+    assert json_key_file, 'Must provide a JSON key file'
+    key_path = os.path.abspath(json_key_file)
+    cache_key = (key_path, scope, api, version, pool_size)
+
+    with _cache_lock:
+        if use_cache and cache_key in _services:
+            return _services[cache_key]
+
+        json_key = get_json_key(key_path, use_cache)
+
+        credentials = _credentials_cache.get((key_path, scope)) \
+            if use_cache else None
+        if credentials is None:
             credentials = _credentials().from_json_keyfile_dict(json_key,
-                        scopes='https://www.googleapis.com/auth/bigquery')
-            project_id = json_key['project_id']
+                                                                scopes=scope)
+            if use_cache:
+                _credentials_cache[(key_path, scope)] = credentials
 
-    bq_service = _get_bq_service(credentials=credentials,
-                                 service_url=DISCOVERY_URI)
+        service = _build_service(api, version, credentials,
+                                 discovery_cache_dir or
+                                 os.environ.get('BQ_DISCOVERY_CACHE_DIR'),
+                                 pool_size)
+        result = (service, json_key['project_id'])
+        if use_cache:
+            _services[cache_key] = result
+        return result
 
-    return BigQueryClient(bq_service, project_id)
+
+def get_json_key(json_key_file, use_cache=True):
+    """Return the parsed content of a JSON key file, read once per path.
+
+    Args:
+        json_key_file: A locally downloaded JSON key file
+        use_cache: If False, read the file without caching it
+
+    Returns:
+        dict
+    """
+    key_path = os.path.abspath(json_key_file)
+    with _cache_lock:
+        json_key = _json_keys.get(key_path) if use_cache else None
+        if json_key is None:
+            with open(key_path, 'r') as key_file:
+                json_key = json.load(key_file)
+            if use_cache:
+                _json_keys[key_path] = json_key
+        return json_key
+
+
+def clear_client_cache():
+    """Forget every cached key, credentials and service object"""
+    with _cache_lock:
+        _json_keys.clear()
+        _credentials_cache.clear()
+        _services.clear()
 
 
 def _credentials():
@@ -45,23 +174,228 @@ def _credentials():
     return ServiceAccountCredentials
 
 
-def _get_bq_service(credentials=None, service_url=None):
-    """Construct an authorized BigQuery service object."""
+def _build_service(api, version, credentials, discovery_cache_dir=None,
+                   pool_size=None):
+    """Construct an authorized service object, preferring a local
+    discovery document over a network fetch."""
 
     assert credentials, 'Must provide ServiceAccountCredentials'
 
-    http = credentials.authorize(Http())
-    service = build('bigquery', 'v2', http=http,
-                    discoveryServiceUrl=service_url)
-
+    if pool_size:
+        http = HttpPool(lambda: credentials.authorize(Http()), pool_size,
+                        credentials)
+    else:
+        http = credentials.authorize(Http())
+    document = _load_discovery_document(api, version, discovery_cache_dir)
+    if document is not None:
+        return build_from_document(document, http=http)
+
+    service = build(api, version, http=http, discoveryServiceUrl=DISCOVERY_URI)
+    if discovery_cache_dir and getattr(service, '_rootDesc', None):
+        _save_discovery_document(api, version, discovery_cache_dir,
+                                 service._rootDesc)
     return service
 
 
-class BigQueryClient(object):
+def _discovery_document_path(api, version, discovery_cache_dir):
+    return os.path.join(discovery_cache_dir,
+                        '{0}.{1}.json'.format(api, version))
+
+
+def _load_discovery_document(api, version, discovery_cache_dir=None):
+    """Return a locally available discovery document, or None"""
+    if discovery_cache_dir:
+        path = _discovery_document_path(api, version, discovery_cache_dir)
+        if os.path.exists(path):
+            with open(path, 'r') as document_file:
+                return document_file.read()
+    try:
+        # Bundled with googleapiclient >= 2.0
+        from googleapiclient.discovery_cache import get_static_doc
+    except ImportError:
+        return None
+    return get_static_doc(api, version)
+
+
+def _save_discovery_document(api, version, discovery_cache_dir, document):
+    """Atomically write a discovery document to the cache directory"""
+    if not os.path.isdir(discovery_cache_dir):
+        os.makedirs(discovery_cache_dir)
+    path = _discovery_document_path(api, version, discovery_cache_dir)
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as document_file:
+        json.dump(document, document_file)
+    os.rename(tmp_path, path)
+
+
+class BaseBigQueryClient(object):
+    """Job building and error checking shared by the BigQuery clients.
+
+    Subclasses provide ``project_id`` and the transport.
+    """
+
+    def _query_job_body(self, query, dataset=None, table=None,
+                        external_udf_uris=None, write_disposition=None):
+        """Return the body of a query job, see write_to_table"""
+        configuration = {
+            "query": query,
+        }
+
+        if dataset and table:
+            configuration['destinationTable'] = {
+                "projectId": self.project_id,
+                "tableId": table,
+                "datasetId": dataset
+            }
+
+        if external_udf_uris:
+            configuration['userDefinedFunctionResources'] = \
+                [{'resourceUri': u} for u in external_udf_uris]
+
+        if write_disposition:
+            configuration['writeDisposition'] = write_disposition
 
-    def __init__(self, bq_service, project_id):
+        body = {
+            "configuration": {
+                'query': configuration
+            }
+        }
+
+        return body
+
+    def _extract_job_body(self, destination_uris, dataset, table, job=None,
+                          compression=None, destination_format=None,
+                          print_header=None, field_delimiter=None):
+        """Return the body of an extract job, see export_data_to_uris"""
+        destination_uris = destination_uris \
+            if isinstance(destination_uris, list) else [destination_uris]
+
+        configuration = {
+            "sourceTable": {
+                "projectId": self.project_id,
+                "tableId": table,
+                "datasetId": dataset
+            },
+            "destinationUris": destination_uris,
+        }
+
+        if compression:
+            configuration['compression'] = compression
+
+        if destination_format:
+            configuration['destinationFormat'] = destination_format
+
+        if print_header is not None:
+            configuration['printHeader'] = print_header
+
+        if field_delimiter:
+            configuration['fieldDelimiter'] = field_delimiter
+
+        if not job:
+            hex = self._generate_hex_for_uris(destination_uris)
+            job = "{dataset}-{table}-{digest}".format(
+                dataset=dataset,
+                table=table,
+                digest=hex
+            )
+
+        body = {
+            "configuration": {
+                'extract': configuration
+            },
+            "jobReference": {
+                "projectId": self.project_id,
+                "jobId": job
+            }
+        }
+
+        return body
+
+    def _sharded_export_uris(self, destination_prefix, num_bytes,
+                             destination_format, compression,
+                             bytes_per_uri=EXPORT_BYTES_PER_URI):
+        """Return the wildcard URIs of a sharded export of ``num_bytes``
+
+        One URI per ``bytes_per_uri`` table bytes, at most MAX_EXPORT_URIS,
+        e.g. ``gs://bucket/app1-*.csv.gz`` or ``gs://bucket/app1-0-*.csv.gz``
+        to ``gs://bucket/app1-2-*.csv.gz``.
+        """
+        extension = EXPORT_EXTENSIONS.get(destination_format, '')
+        if compression == 'GZIP':
+            extension += '.gz'
+        count = min(MAX_EXPORT_URIS,
+                    max(1, -(-int(num_bytes) // bytes_per_uri)))
+        if count == 1:
+            return ['{0}-*{1}'.format(destination_prefix, extension)]
+        return ['{0}-{1}-*{2}'.format(destination_prefix, index, extension)
+                for index in range(count)]
+
+    def _job_id(self, job):
+        """Return the job id of a job resource or of a job id"""
+        return str(job if isinstance(job,
+                                     (six.binary_type, six.text_type, int))
+                   else job['jobReference']['jobId'])
+
+    def _generate_hex_for_uris(self, uris):
+        """Given uris, generate and return hex version of it
+
+        Parameters
+        ----------
+        uris : list
+            Containing all uris
+
+        Returns
+        -------
+        str
+            Hexed uris
+        """
+        return sha256((":".join(uris) + str(time())).encode()).hexdigest()
+
+    # HTTP/REST API errors
+    def _raise_insert_exception_if_error(self, job):
+        error_http = job.get('error')
+        if error_http:
+            raise JobInsertException(
+                "Error in export job API request: {0}".format(error_http))
+        # handle errorResult - API request is successful but error in result
+        error_result = job.get('status').get('errorResult')
+        if error_result:
+            raise JobInsertException(
+                "Reason:{reason}. Message:{message}".format(**error_result))
+
+    def _raise_executing_exception_if_error(self, job):
+        error_http = job.get('error')
+        if error_http:
+            raise JobExecutingException(
+                "Error in export job API request: {0}".format(error_http))
+        # handle errorResult - API request is successful but error in result
+        error_result = job.get('status').get('errorResult')
+        if error_result:
+            raise JobExecutingException(
+                "Reason:{reason}. Message:{message}".format(**error_result))
+
+
+class BigQueryClient(BaseBigQueryClient):
+
+    def __init__(self, bq_service, project_id, query_cache=None,
+                 estimate_cache=None):
         self.bigquery = bq_service
         self.project_id = project_id
+        self.query_cache = query_cache
+        self.estimate_cache = estimate_cache if estimate_cache is not None \
+            else LRUCache(max_entries=1024, ttl=3600)
+        # job id -> query cache key of the submitted, not yet finished jobs
+        self._pending_cache_keys = {}
+
+    def transport_stats(self):
+        """Return the connection reuse statistics of the HTTP transport.
+
+        Returns:
+            dict: see HttpPool.stats, or None if the client does not use a
+            pooled transport
+        """
+        http = getattr(self.bigquery, '_http', None)
+        return http.stats() if isinstance(http, HttpPool) else None
 
     def _submit_job(self, config):
         """ Submit a job to BigQuery
@@ -93,11 +427,19 @@ class BigQueryClient(object):
             table=None,
             external_udf_uris=None,
             write_disposition=None,
+            use_cache=True,
+            bytes_budget=None,
+            budget_action='raise',
     ):
         """
         Write query result to table. If dataset or table is not provided,
         bq will write the result to temporary table.
 
+        If the client has a ``query_cache`` and the same query (same
+        normalized SQL, UDF URIs and destination) already ran, the finished
+        job resource is returned without submitting a job. Appending queries
+        are never cached.
+
 
         Args:
             query : string
@@ -111,6 +453,15 @@ class BigQueryClient(object):
                 Storage and have .js extensions.
             write_disposition : configuration parameter,
                 see API (example WRITE_TRUNCATE)
+            use_cache : bool, optional
+                Set to False to bypass the client's query_cache
+            bytes_budget : int, optional
+                Maximum number of bytes the query may process. The query is
+                dry run first, see dry_run
+            budget_action : str, optional
+                'raise' (default) to refuse queries over the budget, which is
+                then also enforced by BigQuery as maximumBytesBilled, or
+                'warn' to only issue a warning
 
 
         Returns:
@@ -120,48 +471,209 @@ class BigQueryClient(object):
 
             JobInsertException
                 On http/auth failures or error in result
+
+            BytesBudgetExceededException
+                If the query would process more than ``bytes_budget``
         """
+        assert budget_action in ('raise', 'warn'), \
+            "budget_action must be 'raise' or 'warn'"
+
+        cache_key = None
+        if self.query_cache is not None and use_cache and \
+                write_disposition != 'WRITE_APPEND':
+            destination = (self.project_id, dataset, table) \
+                if dataset and table else None
+            cache_key = query_cache_key(query, external_udf_uris, destination)
+            cached = self.query_cache.get(cache_key)
+            if cached is not None:
+                if self._cached_result_is_valid(cached):
+                    return cached
+                self.query_cache.invalidate(cache_key)
+
+        body = self._query_job_body(query, dataset, table,
+                                    external_udf_uris, write_disposition)
+
+        if bytes_budget is not None:
+            self._check_bytes_budget(query, external_udf_uris, bytes_budget,
+                                     budget_action)
+            if budget_action == 'raise':
+                body['configuration']['query']['maximumBytesBilled'] = \
+                    str(bytes_budget)
 
-        configuration = {
-            "query": query,
-        }
+        job_resource = self._submit_job(body)
+        self._raise_insert_exception_if_error(job_resource)
+        if cache_key is not None:
+            self._pending_cache_keys[self._job_id(job_resource)] = cache_key
+        return job_resource
 
-        if dataset and table:
-            configuration['destinationTable'] = {
-                "projectId": self.project_id,
-                "tableId": table,
-                "datasetId": dataset
-            }
+    def dry_run(self, query, external_udf_uris=None, use_cache=True):
+        """Estimate the cost of a query without running it.
 
-        if external_udf_uris:
-            configuration['userDefinedFunctionResources'] = \
-                [{'resourceUri': u} for u in external_udf_uris]
+        Estimates are memoized in the client's ``estimate_cache``, keyed by
+        the hash of the normalized SQL and UDF URIs.
 
-        if write_disposition:
-            configuration['writeDisposition'] = write_disposition
+        Args:
+            query : string
+                BigQuery query string
+            external_udf_uris : list(string), optional
+                Contains external UDF URIs, see write_to_table
+            use_cache : bool, optional
+                Set to False to always ask BigQuery
 
-        body = {
-            "configuration": {
-                'query': configuration
-            }
+        Returns:
+            dict
+                ``totalBytesProcessed`` as an int and ``referencedTables``, a
+                list of table references
+
+        Raises:
+
+            JobInsertException
+                On http/auth failures or if the query is invalid
+        """
+        cache_key = query_cache_key(query, external_udf_uris)
+        if use_cache:
+            estimate = self.estimate_cache.get(cache_key)
+            if estimate is not None:
+                return estimate
+
+        body = self._query_job_body(query,
+                                    external_udf_uris=external_udf_uris)
+        body['configuration']['dryRun'] = True
+        job_resource = self._submit_job(body)
+        self._raise_insert_exception_if_error(job_resource)
+
+        statistics = job_resource.get('statistics', {})
+        estimate = {
+            'totalBytesProcessed': int(statistics.get('totalBytesProcessed',
+                                                      0)),
+            'referencedTables': statistics.get('query', {}).get(
+                'referencedTables', []),
         }
+        self.estimate_cache.put(cache_key, estimate)
+        return estimate
+
+    def query_schema(self, query, external_udf_uris=None):
+        """Return the schema of the result of a query, without running it.
+
+        The schema comes from a dry run, so it is known, e.g. to create the
+        MySQL table, while the query itself is still running.
+
+        Args:
+            query : string
+                BigQuery query string
+            external_udf_uris : list(string), optional
+                Contains external UDF URIs, see write_to_table
 
+        Returns:
+            list
+                Schema fields, as returned by get_table_schema
+
+        Raises:
+
+            JobInsertException
+                On http/auth failures or if the query is invalid
+        """
+        body = self._query_job_body(query,
+                                    external_udf_uris=external_udf_uris)
+        body['configuration']['dryRun'] = True
         job_resource = self._submit_job(body)
         self._raise_insert_exception_if_error(job_resource)
+        return job_resource.get('statistics', {}).get('query', {}).get(
+            'schema', {}).get('fields', [])
+
+    def get_job(self, job):
+        """Return the current state of a job, without waiting for it.
+
+        Args:
+            job : Union[dict, str]
+                BigQuery job resource or job id
+
+        Returns:
+
+            dict
+                The job resource
+
+        Raises:
+
+            JobExecutingException
+                On http/auth failures or if the job failed
+        """
+        job_resource = self.bigquery.jobs().get(
+            projectId=self.project_id, jobId=self._job_id(job)).execute()
+        self._raise_executing_exception_if_error(job_resource)
         return job_resource
 
-    def wait_for_job(self, job, interval=5, timeout=60):
+    def _check_bytes_budget(self, query, external_udf_uris, bytes_budget,
+                            budget_action):
+        """Dry run a query and raise or warn if it is over budget"""
+        estimate = self.dry_run(query, external_udf_uris)
+        processed = estimate['totalBytesProcessed']
+        if processed <= bytes_budget:
+            return
+        message = "Query would process {0} bytes, over the budget of " \
+            "{1} bytes".format(processed, bytes_budget)
+        if budget_action == 'raise':
+            raise BytesBudgetExceededException(message)
+        warnings.warn(message)
+
+    def _cached_result_is_valid(self, job_resource):
+        """Check a cached query job against the tables it involves.
+
+        Only done if the cache asks for validation. The result is valid if
+        its destination table still exists and none of the referenced source
+        tables was modified after the job started.
+        """
+        if not self.query_cache.validate:
+            return True
+
+        sources = job_resource.get('statistics', {}).get('query', {}).get(
+            'referencedTables', [])
+        destination = job_resource['configuration']['query'].get(
+            'destinationTable')
+        tables = list(sources) + ([destination] if destination else [])
+        responses = self._execute_batched(
+            (index, self.bigquery.tables().get(projectId=ref['projectId'],
+                                               datasetId=ref['datasetId'],
+                                               tableId=ref['tableId']))
+            for index, ref in enumerate(tables))
+
+        started = int(job_resource['statistics']['startTime'])
+        for index in range(len(tables)):
+            table, exception = responses[index]
+            if exception is not None:
+                return False
+            if index < len(sources) and \
+                    int(table['lastModifiedTime']) > started:
+                return False
+        return True
+
+    def _remember_query_result(self, job_id, job_resource):
+        """Store a successfully finished query job in the query cache"""
+        cache_key = self._pending_cache_keys.pop(job_id, None)
+        if cache_key is not None:
+            self.query_cache.put(cache_key, job_resource)
+
+    def wait_for_job(self, job, interval=None, timeout=60, polling=None):
         """
         Waits until the job indicated by job_resource is done or has failed
 
+        The first status check is made immediately. Subsequent checks are
+        spaced by the polling strategy, and the last sleep is shortened so
+        the wait never overshoots ``timeout``. A job resource already in the
+        DONE state, e.g. from the query cache, is returned as is.
+
         Args:
             job : Union[dict, str]
                 ``dict`` representing a BigQuery job resource, or a ``str``
                 representing the BigQuery job id
             interval : float, optional
-                Polling interval in seconds, default = 5
+                Fixed polling interval in seconds. Ignored if ``polling`` is
+                given, default is exponential backoff
             timeout : float, optional
                 Timeout in seconds, default = 60
+            polling : PollingStrategy, optional
+                Strategy producing the delays between status checks, see
+                polling_module
 
         Returns:
 
@@ -173,28 +685,124 @@ class BigQueryClient(object):
              JobExecutingException or BigQueryTimeoutException
                 On http/auth failures or timeout
         """
-        complete = False
-        job_id = str(job if isinstance(job,
-                                       (six.binary_type, six.text_type, int))
-                     else job['jobReference']['jobId'])
-        job_resource = None
+        if isinstance(job, dict) and \
+                job.get('status', {}).get('state') == u'DONE':
+            self._raise_executing_exception_if_error(job)
+            return job
 
-        start_time = time()
-        elapsed_time = 0
-        while not (complete or elapsed_time > timeout):
-            sleep(interval)
+        job_id = self._job_id(job)
+        delays = get_polling_strategy(polling, interval).delays()
+
+        deadline = time() + timeout
+        while True:
+            sleep(clip_to_deadline(next(delays), time(), deadline))
             request = self.bigquery.jobs().get(projectId=self.project_id,
                                                jobId=job_id)
             job_resource = request.execute()
             self._raise_executing_exception_if_error(job_resource)
-            complete = job_resource.get('status').get('state') == u'DONE'
-            elapsed_time = time() - start_time
+            if job_resource.get('status').get('state') == u'DONE':
+                self._remember_query_result(job_id, job_resource)
+                return job_resource
+            if time() >= deadline:
+                raise BigQueryTimeoutException()
 
-        # raise exceptions if timeout
-        if not complete:
-            raise BigQueryTimeoutException()
+    def wait_for_jobs(self, jobs, interval=None, timeout=60, polling=None):
+        """
+        Waits for several jobs at once, yielding each one as it is done
 
-        return job_resource
+        All pending jobs are checked together with one batched HTTP request
+        per tick, so the total wait is the one of the longest job instead of
+        the sum of all waits.
+
+        Args:
+            jobs : list
+                Job resources (``dict``) or job ids (``str``)
+            interval : float, optional
+                Fixed polling interval in seconds. Ignored if ``polling`` is
+                given, default is exponential backoff
+            timeout : Union[float, dict], optional
+                Timeout in seconds for every job, or a ``dict`` mapping job
+                ids to their own timeout (missing ids default to 60)
+            polling : PollingStrategy, optional
+                Strategy producing the delays between status checks
+
+        Yields:
+
+            dict
+                Final state of every successfully completed job, in order of
+                completion
+
+        Raises:
+
+            MultipleJobsException
+                Once all jobs are settled, if any of them failed or timed out.
+                The per job exceptions are available in its ``errors``
+        """
+        start_time = time()
+        pending = OrderedDict()
+        for job in jobs:
+            job_id = self._job_id(job)
+            job_timeout = timeout.get(job_id, 60) \
+                if isinstance(timeout, dict) else timeout
+            pending[job_id] = start_time + job_timeout
+
+        errors = OrderedDict()
+        delays = get_polling_strategy(polling, interval).delays()
+        while pending:
+            sleep(clip_to_deadline(next(delays), time(),
+                                   min(pending.values())))
+            responses = self._execute_batched(
+                (job_id, self.bigquery.jobs().get(projectId=self.project_id,
+                                                  jobId=job_id))
+                for job_id in pending)
+            now = time()
+            for job_id in list(pending):
+                job_resource, exception = responses[job_id]
+                try:
+                    if exception is not None:
+                        raise JobExecutingException(
+                            "Error in job API request: {0}".format(exception))
+                    self._raise_executing_exception_if_error(job_resource)
+                except JobExecutingException as e:
+                    errors[job_id] = e
+                    del pending[job_id]
+                    continue
+                if job_resource.get('status').get('state') == u'DONE':
+                    del pending[job_id]
+                    self._remember_query_result(job_id, job_resource)
+                    yield job_resource
+                elif now >= pending[job_id]:
+                    errors[job_id] = BigQueryTimeoutException(
+                        "Timeout waiting for job {0}".format(job_id))
+                    del pending[job_id]
+
+        if errors:
+            raise MultipleJobsException(errors)
+
+    def _execute_batched(self, requests):
+        """Execute API requests in as few HTTP batch requests as possible
+
+        Args:
+            requests: iterable of (key, HttpRequest) tuples, keys are unique
+
+        Returns:
+            dict: key -> (response, exception) where exception is None on
+            success, else the ``HttpError`` of that single call
+        """
+        results = {}
+        requests = list(requests)
+
+        def callback(request_id, response, exception):
+            results[requests[int(request_id)][0]] = (response, exception)
+
+        for offset in range(0, len(requests), BATCH_REQUEST_LIMIT):
+            batch = self.bigquery.new_batch_http_request(callback=callback)
+            chunk = requests[offset:offset + BATCH_REQUEST_LIMIT]
+            for index, (_, request) in enumerate(chunk, offset):
+                batch.add(request, request_id=str(index))
+            batch.execute()
+
+        return results
 
     def export_data_to_uris(
                 self,
@@ -237,66 +845,66 @@ class BigQueryClient(object):
                 JobInsertException
                     On http/auth failures or error in result
             """
-            destination_uris = destination_uris \
-                if isinstance(destination_uris, list) else [destination_uris]
-
-            configuration = {
-                "sourceTable": {
-                    "projectId": self.project_id,
-                    "tableId": table,
-                    "datasetId": dataset
-                },
-                "destinationUris": destination_uris,
-            }
-
-            if compression:
-                configuration['compression'] = compression
-
-            if destination_format:
-                configuration['destinationFormat'] = destination_format
-
-            if print_header is not None:
-                configuration['printHeader'] = print_header
-
-            if field_delimiter:
-                configuration['fieldDelimiter'] = field_delimiter
-
-            if not job:
-                hex = self._generate_hex_for_uris(destination_uris)
-                job = "{dataset}-{table}-{digest}".format(
-                    dataset=dataset,
-                    table=table,
-                    digest=hex
-                )
-
-            body = {
-                "configuration": {
-                    'extract': configuration
-                },
-                "jobReference": {
-                    "projectId": self.project_id,
-                    "jobId": job
-                }
-            }
+            body = self._extract_job_body(
+                destination_uris, dataset, table, job, compression,
+                destination_format, print_header, field_delimiter)
 
             job_resource = self._submit_job(body)
             self._raise_insert_exception_if_error(job_resource)
             return job_resource
 
-    def _generate_hex_for_uris(self, uris):
-        """Given uris, generate and return hex version of it
+    def export_sharded(self, destination_prefix, dataset, table,
+                       destination_format='CSV', compression=None,
+                       bytes_per_uri=EXPORT_BYTES_PER_URI, job=None,
+                       print_header=None, field_delimiter=None):
+        """
+        Export a table to as many wildcard URIs as its size requires.
 
-        Parameters
-        ----------
-        uris : list
-            Containing all uris
+        The table size (``numBytes`` of its metadata) gives the number of
+        wildcard URIs, one per ``bytes_per_uri``, so tables over the 1 GB
+        limit of a single file export and large tables are written in
+        parallel. The shards are compressed by default.
 
-        Returns
-        -------
-        str
-            Hexed uris
+        Args:
+            destination_prefix : str
+                URI prefix of the shards, e.g. ``gs://bucket/exports/app1``
+            dataset : str
+                String id of the dataset
+            table : str
+                String id of the table
+            destination_format : str, optional
+                CSV (default), NEWLINE_DELIMITED_JSON, AVRO or PARQUET
+            compression : str, optional
+                Defaults to DEFAULT_EXPORT_COMPRESSION of the format, pass
+                'NONE' for uncompressed shards
+            bytes_per_uri : int, optional
+                Table bytes per wildcard URI
+            job, print_header, field_delimiter : optional
+                See export_data_to_uris
+
+        Returns:
+                A BigQuery job resource, its destinationUris are the
+                wildcard URIs, see gcs_module.export_manifest
+
+        Raises:
+            TableNotFoundException
+                If the table does not exist
+            JobInsertException
+                On http/auth failures or error in result
         """
-        return sha256((":".join(uris) + str(time())).encode()).hexdigest()
+        table_resource = self.get_tables([(dataset, table)])[(dataset, table)]
+        if table_resource is None:
+            raise TableNotFoundException(
+                "Table {0}.{1} not found".format(dataset, table))
+        if compression is None:
+            compression = DEFAULT_EXPORT_COMPRESSION.get(destination_format)
+        destination_uris = self._sharded_export_uris(
+            destination_prefix, table_resource.get('numBytes', 0),
+            destination_format, compression, bytes_per_uri)
+        return self.export_data_to_uris(
+            destination_uris, dataset, table, job,
+            None if compression == 'NONE' else compression,
+            destination_format, print_header, field_delimiter)
 
     def get_dataset(self, dataset_id):
         """Retrieve a dataset if it exists, otherwise return an empty dict.
@@ -347,28 +955,264 @@ class BigQueryClient(object):
 
         return result['schema']['fields']
 
-    # HTTP/REST API errors
-    def _raise_insert_exception_if_error(self, job):
-        error_http = job.get('error')
-        if error_http:
-            raise JobInsertException(
-                "Error in export job API request: {0}".format(error_http))
-        # handle errorResult - API request is successful but error in result
-        error_result = job.get('status').get('errorResult')
-        if error_result:
-            raise JobInsertException(
-                "Reason:{reason}. Message:{message}".format(**error_result))
+    def get_datasets(self, dataset_ids):
+        """Retrieve several datasets with batched HTTP requests.
 
-    def _raise_executing_exception_if_error(self, job):
-        error_http = job.get('error')
-        if error_http:
-            raise JobExecutingException(
-                "Error in export job API request: {0}".format(error_http))
-        # handle errorResult - API request is successful but error in result
-        error_result = job.get('status').get('errorResult')
-        if error_result:
-            raise JobExecutingException(
-                "Reason:{reason}. Message:{message}".format(**error_result))
+        Parameters
+        ----------
+        dataset_ids : list
+            Dataset unique ids
+
+        Returns
+        -------
+        dict
+            Maps every dataset id to its dataset object, or to an empty dict
+            if it could not be retrieved, as ``get_dataset`` does
+        """
+        responses = self._execute_batched(
+            (dataset_id, self.bigquery.datasets().get(
+                projectId=self.project_id, datasetId=dataset_id))
+            for dataset_id in dataset_ids)
+
+        return dict((dataset_id, response if exception is None else {})
+                    for dataset_id, (response, exception)
+                    in responses.items())
+
+    def get_tables(self, tables):
+        """Return the metadata of several tables with batched HTTP requests.
+
+        Args:
+
+            tables : list
+                ``(dataset, table)`` tuples
+
+        Returns:
+            dict:
+                Maps every ``(dataset, table)`` tuple to its table resource,
+                or to None if the table doesn't exist.
+
+        Raises:
+            HttpError
+                On any other http failure
+        """
+        responses = self._execute_batched(
+            ((dataset, table), self.bigquery.tables().get(
+                projectId=self.project_id, tableId=table, datasetId=dataset))
+            for dataset, table in tables)
+
+        results = {}
+        for key, (response, exception) in responses.items():
+            if exception is not None:
+                if int(exception.resp['status']) != 404:
+                    raise exception
+                response = None
+            results[key] = response
+        return results
+
+    def get_table_schemas(self, tables):
+        """Return the schemas of several tables with batched HTTP requests.
+
+        Args:
+
+            tables : list
+                ``(dataset, table)`` tuples
+
+        Returns:
+            dict:
+                Maps every ``(dataset, table)`` tuple to its schema as returned
+                by ``get_table_schema``, or to None if the table doesn't exist.
+        """
+        return dict((key, table['schema']['fields'] if table else None)
+                    for key, table in self.get_tables(tables).items())
+
+    def read_table_rows(self, dataset, table, page_size=None,
+                        start_index=None, prefetch=True):
+        """Iterate over the rows of a table.
+
+        Rows are read with ``tabledata.list`` page by page. With
+        ``prefetch`` the next page is fetched in a background thread while
+        the current one is consumed; build the client with ``pool_size`` if
+        other threads use it at the same time.
+
+        Args:
+
+            dataset : str
+                The dataset containing the `table`.
+            table : str
+                The table to read
+            page_size : int, optional
+                Maximum number of rows per API call
+            start_index : int, optional
+                Zero based index of the first row to read
+            prefetch : bool, optional
+                Fetch the next page in the background, default True
+
+        Yields:
+            dict
+                Every row, mapping field names to typed Python values
+
+        Raises:
+            TableNotFoundException
+                If the table doesn't exist
+        """
+        fields, pages = self._table_pages(dataset, table, page_size,
+                                          start_index, prefetch)
+        decode = make_row_decoder(fields)
+        for page in pages:
+            for row in page:
+                yield decode(row)
+
+    def read_table_columns(self, dataset, table, page_size=None,
+                           use_numpy=None, prefetch=True):
+        """Read a whole table into one array per column.
+
+        Much cheaper than read_table_rows for wide numeric results: each page
+        is converted column by column, see results_module.decode_columns.
+
+        Args:
+
+            dataset : str
+                The dataset containing the `table`.
+            table : str
+                The table to read
+            page_size : int, optional
+                Maximum number of rows per API call
+            use_numpy : bool, optional
+                Build numpy arrays (default if numpy is installed) or
+                ``array.array`` objects
+            prefetch : bool, optional
+                Fetch the next page in the background, default True
+
+        Returns:
+            OrderedDict
+                Field name -> Column(values, mask), mask flags NULL cells
+
+        Raises:
+            TableNotFoundException
+                If the table doesn't exist
+        """
+        fields, pages = self._table_pages(dataset, table, page_size, None,
+                                          prefetch)
+        return decode_columns(pages, fields, use_numpy)
+
+    def _table_pages(self, dataset, table, page_size, start_index, prefetch):
+        """Return the schema fields and an iterator over the raw row pages
+        of a table"""
+        fields = self.get_table_schema(dataset, table)
+        if fields is None:
+            raise TableNotFoundException(
+                "Table {0}.{1} not found".format(dataset, table))
+
+        def fetch_page(page_token):
+            response = self.bigquery.tabledata().list(
+                projectId=self.project_id,
+                datasetId=dataset,
+                tableId=table,
+                maxResults=page_size,
+                startIndex=start_index if page_token is None else None,
+                pageToken=page_token).execute()
+            return response.get('rows', []), response.get('pageToken')
+
+        return fields, iter_pages(fetch_page, prefetch)
+
+    def read_query_rows(self, job, page_size=None, timeout=60,
+                        prefetch=True):
+        """Iterate over the result rows of a query job.
+
+        Waits for the job, then reads the results with
+        ``jobs.getQueryResults`` page by page, see read_table_rows.
+
+        Args:
+            job : Union[dict, str]
+                Query job resource or job id
+            page_size : int, optional
+                Maximum number of rows per API call
+            timeout : float, optional
+                Timeout in seconds of the wait for the job, default = 60
+            prefetch : bool, optional
+                Fetch the next page in the background, default True
+
+        Yields:
+            dict
+                Every row, mapping field names to typed Python values
+
+        Raises:
+            JobExecutingException or BigQueryTimeoutException
+                If the job failed or did not finish in time
+        """
+        fields, pages = self._query_pages(job, page_size, timeout, prefetch)
+        decode = make_row_decoder(fields)
+        for page in pages:
+            for row in page:
+                yield decode(row)
+
+    def read_query_columns(self, job, page_size=None, timeout=60,
+                           use_numpy=None, prefetch=True):
+        """Read the results of a query job into one array per column.
+
+        See read_query_rows and read_table_columns.
+
+        Returns:
+            OrderedDict
+                Field name -> Column(values, mask), mask flags NULL cells
+        """
+        fields, pages = self._query_pages(job, page_size, timeout, prefetch)
+        return decode_columns(pages, fields, use_numpy)
+
+    def _query_pages(self, job, page_size, timeout, prefetch):
+        """Wait for a query job, then return its schema fields and an
+        iterator over the raw row pages of its results"""
+        job_id = self._job_id(job)
+        self.wait_for_job(job_id, timeout=timeout)
+
+        def fetch_page(page_token):
+            response = self.bigquery.jobs().getQueryResults(
+                projectId=self.project_id,
+                jobId=job_id,
+                maxResults=page_size,
+                pageToken=page_token).execute()
+            return response, response.get('pageToken')
+
+        responses = iter_pages(fetch_page, prefetch)
+        first = next(responses)
+
+        def pages():
+            yield first.get('rows', [])
+            for response in responses:
+                yield response.get('rows', [])
+
+        return first['schema']['fields'], pages()
+
+    def query_rows(self, query, external_udf_uris=None, page_size=None,
+                   timeout=60, prefetch=True, use_cache=True):
+        """Run a query and iterate over its result rows.
+
+        The job is submitted right away, its results are read lazily, see
+        read_query_rows.
+
+        Args:
+            query : string
+                BigQuery query string
+            external_udf_uris : list(string), optional
+                Contains external UDF URIs, see write_to_table
+            page_size, timeout, prefetch :
+                See read_query_rows
+            use_cache : bool, optional
+                Set to False to bypass the client's query_cache, see
+                write_to_table
+
+        Returns:
+            generator
+                Of the result rows as ``dict`` objects
+
+        Raises:
+            JobInsertException
+                On http/auth failures or error in result
+        """
+        job = self.write_to_table(query, external_udf_uris=external_udf_uris,
+                                  use_cache=use_cache)
+        return self.read_query_rows(job, page_size=page_size,
+                                    timeout=timeout, prefetch=prefetch)
 
 
 # Some query classes
@@ -384,5 +1228,27 @@ class JobInsertException(Exception):
     pass
 
 
+class BytesBudgetExceededException(JobInsertException):
+    pass
+
+
+class TableNotFoundException(Exception):
+    pass
+
+
 class JobExecutingException(Exception):
     pass
+
+
+class MultipleJobsException(JobExecutingException):
+    """Raised by wait_for_jobs when some of the jobs failed or timed out.
+
+    Attributes:
+        errors: OrderedDict of job id -> exception raised for that job
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(MultipleJobsException, self).__init__(
+            "{0} job(s) failed: {1}".format(len(errors), "; ".join(
+                "{0}: {1}".format(job_id, e) for job_id, e in errors.items())))
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+import os
+import re
+import json
+import glob
+import threading
+from time import time
+from hashlib import sha256
+from collections import OrderedDict
+
+import six
+
+# Comments that change how BigQuery parses the query and must be kept
+_DIRECTIVE = re.compile(r'#\s*(standard|legacy)SQL\b', re.IGNORECASE)
+
+# String literals and quoted identifiers are copied verbatim
+_TOKENS = re.compile(r"""
+    (?P<quoted>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`(?:[^`\\]|\\.)*`)
+  | (?P<comment>(?:--|\#)[^\n]*|/\*.*?\*/)
+  | (?P<space>\s+)
+""", re.VERBOSE | re.DOTALL)
+
+
+def normalize_sql(sql):
+    """Return ``sql`` with comments removed and whitespace collapsed.
+
+    Quoted strings and identifiers are left untouched, as are the
+    ``#standardSQL``/``#legacySQL`` directives, so two queries normalize to
+    the same text only if BigQuery would run them the same way.
+
+    Args:
+        sql: String, the query
+
+    Returns:
+        String, the normalized query
+    """
+    directive = None
+    pieces = []
+    position = 0
+    for match in _TOKENS.finditer(sql):
+        if match.start() > position:
+            pieces.append(sql[position:match.start()])
+        position = match.end()
+        if match.group('quoted'):
+            pieces.append(match.group('quoted'))
+            continue
+        if match.group('comment') and directive is None:
+            found = _DIRECTIVE.match(match.group('comment'))
+            if found:
+                directive = found.group(1).lower()
+        if pieces and pieces[-1] != ' ':
+            pieces.append(' ')
+    pieces.append(sql[position:])
+
+    body = ''.join(pieces).strip()
+    if directive:
+        body = '#{0}SQL {1}'.format(directive, body)
+    return body
+
+
+def query_cache_key(sql, external_udf_uris=None, destination=None):
+    """Return the cache key of a query.
+
+    Args:
+        sql: String, the query, it is normalized with normalize_sql
+        external_udf_uris: list of UDF resource URIs
+        destination: tuple (project, dataset, table) or None
+
+    Returns:
+        String, hex digest
+    """
+    key = json.dumps([normalize_sql(sql), sorted(external_udf_uris or []),
+                      list(destination) if destination else None])
+    return sha256(key.encode('utf-8')).hexdigest()
+
+
+class LRUCache(object):
+    """Thread-safe LRU cache of JSON serializable values, with a time to
+    live.
+
+    The cache lives in memory and, if ``path`` is given, is persisted to
+    that JSON file so it survives across runs.
+
+    Args:
+        max_entries: int, least recently used entries are evicted beyond
+        ttl: float, seconds an entry stays valid, None for no expiry
+        path: String, optional JSON file persisting the cache
+    """
+
+    def __init__(self, max_entries=128, ttl=24 * 3600, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r') as cache_file:
+                for key, entry in json.load(cache_file):
+                    self._entries[key] = entry
+
+    def get(self, key):
+        """Return the value cached under ``key``, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and \
+                    time() - entry['stored'] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._move_to_end(key)
+            return entry['value']
+
+    def put(self, key, value):
+        """Cache ``value`` under ``key``"""
+        with self._lock:
+            self._entries[key] = {'value': value, 'stored': time()}
+            self._move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def invalidate(self, key):
+        """Forget the entry cached under ``key``"""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save()
+
+    def clear(self):
+        """Forget every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._save()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _move_to_end(self, key):
+        if six.PY2:
+            self._entries[key] = self._entries.pop(key)
+        else:
+            self._entries.move_to_end(key)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as cache_file:
+            json.dump(list(self._entries.items()), cache_file)
+        os.rename(tmp_path, self.path)
+
+
+class QueryResultCache(LRUCache):
+    """LRU cache of finished query jobs, with a time to live.
+
+    Entries map a query_cache_key to the final job resource, which holds the
+    destination table reference of the results.
+
+    Args:
+        max_entries, ttl, path: see LRUCache
+        validate: bool, ask clients to check that the source tables were not
+        modified since the cached job ran before using an entry
+    """
+
+    def __init__(self, max_entries=128, ttl=24 * 3600, path=None,
+                 validate=False):
+        super(QueryResultCache, self).__init__(max_entries, ttl, path)
+        self.validate = validate
+
+
+class BlobCache(object):
+    """Thread-safe on-disk cache of GCS blob contents, keyed by bucket, blob
+    name and generation.
+
+    A generation is immutable, so a cached file stays valid until the blob is
+    rewritten; caching a new generation drops the older ones. The least
+    recently used files are evicted once the cache grows beyond ``max_bytes``.
+    The index is persisted in ``index.json`` inside ``directory`` by put and
+    clear; hits only update the LRU order in memory, which is saved with the
+    next put.
+
+    Args:
+        directory: String, directory holding the cached files
+        max_bytes: int, size cap of the cache, None for no cap
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, directory, max_bytes=10 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        index_path = os.path.join(directory, self.INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as index_file:
+                for key, entry in json.load(index_file):
+                    if os.path.exists(self._file_path(key)):
+                        self._entries[key] = entry
+
+    @staticmethod
+    def _blob_key(bucket_name, blob_name):
+        return sha256(u'{0}/{1}'.format(bucket_name, blob_name)
+                      .encode('utf-8')).hexdigest()
+
+    def _key(self, bucket_name, blob_name, generation):
+        return '{0}-{1}'.format(self._blob_key(bucket_name, blob_name),
+                                generation)
+
+    def _file_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def partial_path(self, bucket_name, blob_name, generation):
+        """Return the path an unfinished download of a generation is kept
+        in, so that it can be resumed"""
+        return self._file_path(
+            self._key(bucket_name, blob_name, generation) + '.partial')
+
+    def get(self, bucket_name, blob_name, generation):
+        """Return the path of the cached content, or None"""
+        key = self._key(bucket_name, blob_name, generation)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries[key]['used'] = time()
+            self._move_to_end(key)
+            return self._file_path(key)
+
+    def put(self, bucket_name, blob_name, generation, source_path):
+        """Move the downloaded file ``source_path`` into the cache.
+
+        Returns:
+            String, the path of the cached content
+        """
+        key = self._key(bucket_name, blob_name, generation)
+        prefix = self._blob_key(bucket_name, blob_name) + '-'
+        with self._lock:
+            # Older generations of the blob are stale
+            for stale in [k for k in self._entries
+                          if k.startswith(prefix) and k != key]:
+                self._remove(stale)
+            os.rename(source_path, self._file_path(key))
+            for partial in glob.glob(self._file_path(prefix + '*.partial')):
+                os.remove(partial)
+            self._entries[key] = {'size': os.path.getsize(self._file_path(key)),
+                                  'used': time()}
+            self._move_to_end(key)
+            self._evict(keep=key)
+            self._save()
+            return self._file_path(key)
+
+    def clear(self):
+        """Delete every cached file"""
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+            self._save()
+
+    @property
+    def size(self):
+        """Total bytes of the cached files"""
+        return sum(entry['size'] for entry in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, keep):
+        if self.max_bytes is None:
+            return
+        total = self.size
+        for key in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                total -= self._entries[key]['size']
+                self._remove(key)
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        try:
+            os.remove(self._file_path(key))
+        except OSError:
+            pass
+
+    def _move_to_end(self, key):
+        if six.PY2:
+            self._entries[key] = self._entries.pop(key)
+        else:
+            self._entries.move_to_end(key)
+
+    def _save(self):
+        index_path = os.path.join(self.directory, self.INDEX_FILE)
+        tmp_path = '{0}.{1}.tmp'.format(index_path, os.getpid())
+        with open(tmp_path, 'w') as index_file:
+            json.dump(list(self._entries.items()), index_file)
+        os.rename(tmp_path, index_path)
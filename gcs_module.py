@@ -1,10 +1,54 @@
 #!/usr/bin/env python
+import io
+import os
+import copy
+import gzip
+import zlib
+import base64
+import shutil
+import fnmatch
+import hashlib
+import calendar
+import threading
+from time import sleep, time
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+import six
+
 from bq_module import *
+from cache_module import LRUCache
+from polling_module import clip_to_deadline, get_polling_strategy
+from results_module import iter_pages
 from google.cloud import storage
+from google.cloud.exceptions import NotFound
+from google.oauth2 import service_account
 
 
 READ_ONLY_SCOPE = 'https://www.googleapis.com/auth/devstorage.read_only'
 
+# Blobs at least this large are downloaded as parallel ranged reads
+PARALLEL_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+
+WILDCARD_CHARACTERS = '*?['
+
+# Bytes per ranged read of a streamed blob
+STREAM_CHUNK_SIZE = 8 * 1024 * 1024
+
+# wbits of zlib.decompressobj for the gzip container
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Seconds bucket and blob metadata are cached by GCSClient
+METADATA_TTL = 300
+
+# Bytes read at a time when checksumming or copying a local file
+_FILE_BLOCK_SIZE = 1024 * 1024
+
+# Storage clients shared by get_storage_client, keyed by key file and scope
+_storage_clients_lock = threading.Lock()
+_storage_clients = {}
+
 
 def export_to_table(json_key,
                     sql,
@@ -55,7 +99,7 @@ def export_to_table(json_key,
         job_resource = client.wait_for_job(job, timeout=60)
         return job_resource
     except BigQueryTimeoutException:
-        print "Timeout"
+        print("Timeout")
         return None
 
 
@@ -92,77 +136,734 @@ def export_to_gcs(json_key,
                                      table_name)
     try:
         job_resource = client.wait_for_job(job, timeout=60)
-        print job_resource
+        print(job_resource)
     except BigQueryTimeoutException:
-        print "Timeout"
+        print("Timeout")
+
+
+def _job_created(job_resource):
+    """Creation time of a job in whole seconds since the epoch"""
+    return int(job_resource['statistics']['creationTime']) // 1000
+
 
+def _written_since(blob, created):
+    """Whether a blob was written at or after ``created``, see
+    _job_created"""
+    return blob.time_created is not None and \
+        calendar.timegm(blob.time_created.utctimetuple()) >= created
+
+
+def iter_export_shards(bq_client, gcs_client, job, destination_uri=None,
+                       interval=None, timeout=3600, polling=None):
+    """Yield the shards of an export job as they land in GCS.
+
+    While the extract job runs, the bucket is listed on every poll of the
+    job, so each shard can be downloaded and loaded while BigQuery still
+    writes the next ones. GCS objects are only listed once fully written,
+    and objects created before the job are ignored.
+
+    Args:
+        bq_client: BigQueryClient of the export job
+        gcs_client: GCSClient
+        job: the extract job resource or job id, see export_data_to_uris
+        destination_uri: String or list, the URIs given to the export job,
+        e.g. ``gs://bucket/app1-*.csv``, read from the job by default
+        interval, polling: see BigQueryClient.wait_for_job
+        timeout: float, seconds to wait for the job
+
+    Yields:
+        google.cloud.storage.Blob, every shard once
+
+    Raises:
+        JobExecutingException: if the job fails
+        BigQueryTimeoutException: on timeout
+    """
+    if destination_uri is None:
+        job_resource = job if isinstance(job, dict) and \
+            'configuration' in job else bq_client.get_job(job)
+        destination_uri = job_resource['configuration']['extract'][
+            'destinationUris']
+    elif isinstance(destination_uri, six.string_types):
+        destination_uri = [destination_uri]
+    patterns = [split_gcs_uri(uri) for uri in destination_uri]
+    seen = set()
+    delays = get_polling_strategy(polling, interval).delays()
+    deadline = time() + timeout
+    while True:
+        sleep(clip_to_deadline(next(delays), time(), deadline))
+        # The job state is read before listing, so no shard of a job found
+        # done can be missed
+        job_resource = bq_client.get_job(job)
+        done = job_resource['status']['state'] == u'DONE'
+        # Shards of a previous export to the same URI are left out
+        created = _job_created(job_resource)
+        for bucket_name, pattern in patterns:
+            for blob in gcs_client.list_blobs(bucket_name, pattern):
+                if blob.name not in seen and _written_since(blob, created):
+                    seen.add(blob.name)
+                    yield blob
+        if done:
+            return
+        if time() >= deadline:
+            raise BigQueryTimeoutException()
+
+
+class ExportManifestException(Exception):
+    pass
+
+
+class ExportShard(namedtuple('ExportShard', ['bucket', 'name', 'size'])):
+    """A file written by an export job"""
+    __slots__ = ()
+
+    @property
+    def uri(self):
+        return 'gs://{0}/{1}'.format(self.bucket, self.name)
+
+
+class ExportManifest(namedtuple('ExportManifest',
+                                ['job_id', 'destination_format',
+                                 'compression', 'shards'])):
+    """The shards of an export job, sorted by name"""
+    __slots__ = ()
+
+    @property
+    def total_bytes(self):
+        return sum(shard.size for shard in self.shards)
+
+
+def export_manifest(gcs_client, job_resource):
+    """List the shards written by a finished export job.
+
+    Args:
+        gcs_client: GCSClient
+        job_resource: the job resource of a finished extract job
 
-def connect_gcs_client(json_key_file):
+    Blobs matching the destination URIs that were written before the job,
+    by earlier exports to the same prefix, are left out.
+
+    Returns:
+        ExportManifest
+
+    Raises:
+        ExportManifestException: if the number of shards of a URI differs
+        from the destinationUriFileCounts of the job
+    """
+    extract = job_resource['configuration']['extract']
+    created = _job_created(job_resource)
+    counts = job_resource['statistics'].get('extract', {}).get(
+        'destinationUriFileCounts')
+    shards = []
+    for i, uri in enumerate(extract['destinationUris']):
+        bucket_name, pattern = split_gcs_uri(uri)
+        uri_shards = [ExportShard(bucket_name, blob.name, blob.size)
+                      for blob in gcs_client.list_blobs(bucket_name, pattern)
+                      if _written_since(blob, created)]
+        if counts and len(uri_shards) != int(counts[i]):
+            raise ExportManifestException(
+                'Found {0} shards of {1}, the job wrote {2}'.format(
+                    len(uri_shards), uri, counts[i]))
+        shards.extend(uri_shards)
+    return ExportManifest(job_resource['jobReference']['jobId'],
+                          extract.get('destinationFormat', 'CSV'),
+                          extract.get('compression', 'NONE'),
+                          sorted(shards, key=lambda shard: shard.name))
+
+
+def export_sharded(bq_client, gcs_client, destination_prefix, dataset, table,
+                   timeout=600, **kwargs):
+    """Export a table to compressed shards sized from the table, wait for
+    the job and list the shards.
+
+    Args:
+        bq_client: BigQueryClient
+        gcs_client: GCSClient
+        destination_prefix: String, URI prefix of the shards, e.g.
+        ``gs://bucket/exports/app1``
+        dataset: String, the dataset
+        table: String, the table
+        timeout: float, seconds to wait for the export job
+        **kwargs: see BigQueryClient.export_sharded
+
+    Returns:
+        ExportManifest, e.g. for GCSClient.download_files with the names of
+        its shards
+
+    Raises:
+        JobExecutingException or BigQueryTimeoutException
+    """
+    job = bq_client.export_sharded(destination_prefix, dataset, table,
+                                   **kwargs)
+    return export_manifest(gcs_client,
+                           bq_client.wait_for_job(job, timeout=timeout))
+
+
+def get_storage_client(json_key_file, scope=READ_ONLY_SCOPE,
+                       use_cache=True):
+    """Return a google.cloud.storage.Client authorized with a JSON key.
+
+    Like bq_module.get_service, the key file is parsed once (see
+    get_json_key) and one client is shared per (key file, scope).
+
+    Args:
+        json_key_file: A locally downloaded JSON key file
+        scope: String, OAuth scope requested for the credentials
+        use_cache: If False, build a new client without caching it
+
+    Returns:
+        google.cloud.storage.Client
+    """
+    cache_key = (os.path.abspath(json_key_file), scope)
+    with _storage_clients_lock:
+        if use_cache and cache_key in _storage_clients:
+            return _storage_clients[cache_key]
+        json_key = get_json_key(json_key_file, use_cache)
+        credentials = service_account.Credentials.from_service_account_info(
+            json_key, scopes=[scope])
+        storage_client = storage.Client(project=json_key['project_id'],
+                                        credentials=credentials)
+        if use_cache:
+            _storage_clients[cache_key] = storage_client
+        return storage_client
+
+
+def clear_storage_clients():
+    """Forget every storage client shared by get_storage_client"""
+    with _storage_clients_lock:
+        _storage_clients.clear()
+
+
+def connect_gcs_client(json_key_file, blob_cache=None, use_cache=True):
     """Return a client connection to the GCS API.
     A local JSON key file must be provided for authentication
 
+    The storage client is shared with every other client built from the
+    same key file, see get_storage_client
+
     Args:
         json_file: A locally downloaded JSON file with connection
         /authentication info
+        blob_cache: cache_module.BlobCache, see GCSClient
+        use_cache: If False, always build a new storage client
 
     Returns:
-        client: A GCS client object
+        client: A GCSClient object
 
     Raises:
     """
+    return GCSClient(gcs_client=get_storage_client(json_key_file,
+                                                   use_cache=use_cache),
+                     blob_cache=blob_cache)
 
-    # TODO check if json_key_file exists
-    if json_key_file:
-        with open(json_key_file, 'r') as key_file:
-            json_key = json.load(key_file)
-            credentials = _credentials().from_json_keyfile_dict(json_key,
-                        scopes=READ_ONLY_SCOPE)
-            project_id = json_key['project_id']
 
-    gcs_service = _get_gcs_service(credentials=credentials,
-                                 service_url=DISCOVERY_URI)
-    return GCSClient(gcs_service, project_id)
+class DownloadReport(namedtuple('DownloadReport',
+                                  ['files', 'bytes', 'seconds'])):
+    """Summary of a batch of downloads: number of files, total bytes and
+    wall clock seconds"""
 
+    @property
+    def throughput(self):
+        """Aggregate throughput in bytes per second"""
+        return self.bytes / self.seconds if self.seconds else float('inf')
 
-def _credentials():
-    """Import and return SignedJwtAssertionCredentials class"""
-    from oauth2client.service_account import ServiceAccountCredentials
 
-    return ServiceAccountCredentials
+def split_gcs_uri(uri):
+    """Split ``gs://bucket/name`` into ``(bucket, name)``"""
+    assert uri.startswith('gs://'), 'Not a GCS URI: {0}'.format(uri)
+    bucket_name, _, blob_name = uri[len('gs://'):].partition('/')
+    return bucket_name, blob_name
 
 
-def _get_gcs_service(credentials=None, service_url=None):
-    """Construct an authorized BigQuery service object."""
+def _wildcard_prefix(pattern):
+    """Return the literal prefix of a blob name pattern"""
+    indexes = [pattern.find(c) for c in WILDCARD_CHARACTERS
+               if c in pattern]
+    return pattern[:min(indexes)] if indexes else pattern
 
-    assert credentials, 'Must provide ServiceAccountCredentials'
 
-    http = credentials.authorize(Http())
-    service = build('storage', 'v1', http=http,
-                    discoveryServiceUrl=service_url)
+def _byte_ranges(size, chunk_size):
+    """Split ``size`` bytes into inclusive (start, end) ranges"""
+    return [(start, min(start + chunk_size, size) - 1)
+            for start in range(0, size, chunk_size)]
 
-    return service
+
+def _crc32c():
+    """Import and return google_crc32c, or None if it is not installed"""
+    try:
+        import google_crc32c
+    except ImportError:
+        return None
+    return google_crc32c
+
+
+def file_checksums(path):
+    """Return the base64 encoded CRC32C and MD5 of a local file, in the
+    format of the ``crc32c`` and ``md5Hash`` blob metadata. The CRC32C is
+    None if google_crc32c is not installed."""
+    crc32c = _crc32c()
+    crc = crc32c.Checksum() if crc32c is not None else None
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_FILE_BLOCK_SIZE), b''):
+            md5.update(block)
+            if crc is not None:
+                crc.update(block)
+    return (base64.b64encode(crc.digest()).decode('ascii')
+            if crc is not None else None,
+            base64.b64encode(md5.digest()).decode('ascii'))
+
+
+def verify_download(path, crc32c=None, md5_hash=None):
+    """Check a downloaded file against the checksums of the blob metadata.
+
+    Composite objects have no MD5, so both checksums are compared when they
+    are available.
+
+    Args:
+        path: String, the local file
+        crc32c: String, base64 encoded CRC32C of the blob, or None
+        md5_hash: String, base64 encoded MD5 of the blob, or None
+
+    Raises:
+        ChecksumMismatchException
+    """
+    actual_crc32c, actual_md5 = file_checksums(path)
+    if crc32c and actual_crc32c and crc32c != actual_crc32c:
+        raise ChecksumMismatchException(
+            'CRC32C mismatch for {0}: expected {1}, got {2}'.format(
+                path, crc32c, actual_crc32c))
+    if md5_hash and md5_hash != actual_md5:
+        raise ChecksumMismatchException(
+            'MD5 mismatch for {0}: expected {1}, got {2}'.format(
+                path, md5_hash, actual_md5))
+
+
+def is_gzip_blob(blob):
+    """Return True if the content of ``blob`` is gzip compressed, either
+    because of its Content-Encoding or of a ``.gz`` name as given to
+    compressed BigQuery exports"""
+    return blob.content_encoding == 'gzip' or blob.name.endswith('.gz')
+
+
+def gunzip_chunks(chunks, max_chunk_size=STREAM_CHUNK_SIZE):
+    """Decompress an iterable of gzip compressed byte chunks.
+
+    Concatenated gzip members are decompressed one after the other, and no
+    decompressed chunk is larger than ``max_chunk_size`` whatever the
+    compression ratio.
+
+    Args:
+        chunks: iterable of bytes, a gzip stream
+        max_chunk_size: int, maximum size of the yielded chunks
+
+    Yields:
+        bytes, the decompressed data
+    """
+    decompressor = zlib.decompressobj(_GZIP_WBITS)
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk, max_chunk_size)
+            if data:
+                yield data
+            chunk = decompressor.unconsumed_tail
+            if not chunk and decompressor.unused_data:
+                # Start of the next gzip member
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(_GZIP_WBITS)
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+class ChunkReader(io.RawIOBase):
+    """Read-only binary file object over an iterable of byte chunks.
+
+    Closing the reader closes the underlying generator, which stops any
+    read-ahead in progress.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = b''
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._offset >= len(self._chunk):
+            try:
+                self._chunk = next(self._chunks)
+            except StopIteration:
+                return 0
+            self._offset = 0
+        size = min(len(buffer), len(self._chunk) - self._offset)
+        buffer[:size] = self._chunk[self._offset:self._offset + size]
+        self._offset += size
+        return size
+
+    def close(self):
+        if not self.closed and hasattr(self._chunks, 'close'):
+            self._chunks.close()
+        super(ChunkReader, self).close()
+
+
+class ChecksumMismatchException(Exception):
+    pass
+
+
+class BucketNotFoundException(Exception):
+    pass
+
+
+class BlobNotFoundException(Exception):
+    pass
 
 
 class GCSClient(object):
+    """Client of Google Cloud Storage.
 
-    def __init__(self):
-        self.gcs_client = storage.Client()
+    Bucket handles and blob metadata are cached for ``metadata_ttl``
+    seconds, so pulling many files from a bucket costs one metadata request
+    per blob and none per bucket. Operations on blobs use bucket references
+    (see bucket) that need no request at all.
+
+    Args:
+        gcs_client: google.cloud.storage.Client, a default one if not given
+        blob_cache: cache_module.BlobCache, local cache of downloaded blobs
+        used by download_file, or None
+        metadata_ttl: float, seconds bucket and blob metadata are cached
+        max_cached_blobs: int, maximum number of cached blob metadata
+    """
+
+    def __init__(self, gcs_client=None, blob_cache=None,
+                 metadata_ttl=METADATA_TTL, max_cached_blobs=10000):
+        self.gcs_client = gcs_client or storage.Client()
+        self.blob_cache = blob_cache
+        self._buckets = LRUCache(max_entries=1024, ttl=metadata_ttl)
+        self._blob_metadata = LRUCache(max_entries=max_cached_blobs,
+                                       ttl=metadata_ttl)
+
+    def bucket(self, bucket_name):
+        """Return a reference to a bucket, without any request"""
+        return self.gcs_client.bucket(bucket_name)
+
+    def blob(self, bucket_name, blob_name):
+        """Return a reference to a blob, without any request. Its metadata
+        is not loaded, see get_blob"""
+        return self.bucket(bucket_name).blob(blob_name)
 
     def get_bucket(self, bucket_name):
-        try:
-            bucket = self.gcs_client.get_bucket(bucket_name)
-        # except google.cloud.exceptions.NotFound: #need to check this exception
-        except:
-            print('Sorry, that bucket does not exist')
+        """Return a bucket with its metadata, cached for metadata_ttl.
+
+        Returns:
+            google.cloud.storage.Bucket
+
+        Raises:
+            BucketNotFoundException: if the bucket does not exist
+        """
+        bucket = self._buckets.get(bucket_name)
+        if bucket is None:
+            try:
+                bucket = self.gcs_client.get_bucket(bucket_name)
+            except NotFound:
+                raise BucketNotFoundException(
+                    'Bucket {0} does not exist'.format(bucket_name))
+            self._buckets.put(bucket_name, bucket)
         return bucket
 
+    def get_blob(self, bucket_name, blob_name):
+        """Return a blob with its metadata, cached for metadata_ttl.
+
+        Every call returns a new Blob object, as downloads update the
+        properties of a blob from the response headers.
+
+        Returns:
+            google.cloud.storage.Blob, or None if it does not exist
+        """
+        key = u'{0}/{1}'.format(bucket_name, blob_name)
+        properties = self._blob_metadata.get(key)
+        if properties is None:
+            blob = self.bucket(bucket_name).get_blob(blob_name)
+            if blob is None:
+                return None
+            properties = blob._properties
+            self._blob_metadata.put(key, copy.deepcopy(properties))
+        blob = self.blob(bucket_name, blob_name)
+        blob._set_properties(copy.deepcopy(properties))
+        return blob
+
+    def invalidate(self, bucket_name, blob_name=None):
+        """Forget the cached metadata of a bucket, or of one of its blobs"""
+        if blob_name is None:
+            self._buckets.invalidate(bucket_name)
+        else:
+            self._blob_metadata.invalidate(
+                u'{0}/{1}'.format(bucket_name, blob_name))
+
+    def cache_stats(self):
+        """Return the hit and miss counters of the metadata caches"""
+        return dict((name, {'hits': cache.hits, 'misses': cache.misses,
+                            'entries': len(cache)})
+                    for name, cache in (('buckets', self._buckets),
+                                        ('blobs', self._blob_metadata)))
+
     def download_file(self, bucket_name, blob_name, destination_file=None):
+        """Download a blob to a local file, verified against its checksums.
+
+        The content is first written to a partial file named after the blob
+        generation. If the download fails, the partial file is kept and the
+        next call resumes it with a byte range request. With a blob_cache,
+        a generation that was already downloaded is copied from the cache
+        without any download.
+
+        Args:
+            bucket_name: String, the bucket
+            blob_name: String, the blob
+            destination_file: String, local path, the blob name if not given
+
+        Returns:
+            String, the path of the downloaded file
+
+        Raises:
+            BlobNotFoundException: if the blob does not exist
+            ChecksumMismatchException: the partial file is deleted, so the
+            next call downloads the blob from the start
+        """
+        destination_file = destination_file or blob_name
+        blob = self.get_blob(bucket_name, blob_name)
+        if blob is None:
+            raise BlobNotFoundException('gs://{0}/{1} does not exist'.format(
+                bucket_name, blob_name))
+
+        # Downloads update the blob properties from the response headers
+        generation = blob.generation
+        gzip_encoded = blob.content_encoding == 'gzip'
+
+        cache = self.blob_cache
+        path = None
+        if cache is not None:
+            path = cache.get(bucket_name, blob_name, generation)
+            partial = cache.partial_path(bucket_name, blob_name, generation)
+        else:
+            partial = '{0}.{1}.partial'.format(destination_file, generation)
+        if path is None:
+            self._resume_download(blob, partial)
+            path = partial
+            if cache is not None:
+                path = cache.put(bucket_name, blob_name, generation, partial)
+
+        # Checksums are those of the stored bytes, gzip encoded blobs are
+        # served decompressed by download_to_filename
+        if gzip_encoded:
+            with gzip.open(path, 'rb') as source, \
+                    open(destination_file, 'wb') as destination:
+                shutil.copyfileobj(source, destination, _FILE_BLOCK_SIZE)
+            if cache is None:
+                os.remove(path)
+        elif cache is not None:
+            shutil.copyfile(path, destination_file)
+        else:
+            os.rename(path, destination_file)
+        return destination_file
+
+    def _resume_download(self, blob, partial):
+        """Download the missing tail of ``partial`` and verify it"""
+        size, crc32c, md5_hash = blob.size, blob.crc32c, blob.md5_hash
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        mode = 'ab' if 0 < offset <= size else 'wb'
+        with open(partial, mode) as f:
+            if mode == 'ab' and offset < size:
+                blob.download_to_file(f, start=offset, raw_download=True,
+                                      checksum=None)
+            elif mode == 'wb' and size:
+                blob.download_to_file(f, raw_download=True, checksum=None)
+        try:
+            verify_download(partial, crc32c, md5_hash)
+        except ChecksumMismatchException:
+            os.remove(partial)
+            raise
+
+    def list_blobs(self, bucket_name, pattern=''):
+        """List the blobs of a bucket matching a prefix or a wildcard.
+
+        Args:
+            bucket_name: String, the bucket
+            pattern: String, a name prefix, or a pattern with ``*``, ``?`` or
+            ``[...]`` wildcards such as the sharded URIs of BigQuery exports
+            (``app1-*.csv``)
+
+        Returns:
+            list of google.cloud.storage.Blob, with their metadata
+        """
+        prefix = _wildcard_prefix(pattern)
+        blobs = self.bucket(bucket_name).list_blobs(prefix=prefix or None)
+        if prefix != pattern:
+            blobs = [blob for blob in blobs
+                     if fnmatch.fnmatchcase(blob.name, pattern)]
+        blobs = list(blobs)
+        for blob in blobs:
+            self._blob_metadata.put(u'{0}/{1}'.format(bucket_name, blob.name),
+                                    copy.deepcopy(blob._properties))
+        return blobs
+
+    def download_prefix(self, bucket_name, pattern, destination_dir='.',
+                        **kwargs):
+        """Download every blob matching a prefix or a wildcard pattern.
+
+        See list_blobs and download_files.
+
+        Returns:
+            DownloadReport
+        """
+        return self.download_files(bucket_name,
+                                   self.list_blobs(bucket_name, pattern),
+                                   destination_dir, **kwargs)
+
+    def download_files(self, bucket_name, blobs, destination_dir='.',
+                       max_workers=8, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                       parallel_threshold=PARALLEL_DOWNLOAD_THRESHOLD):
+        """Download blobs concurrently with a bounded thread pool.
+
+        Blobs of at least ``parallel_threshold`` bytes are split into
+        ``chunk_size`` ranges that are read in parallel and written in place
+        into the destination file.
+
+        Args:
+            bucket_name: String, the bucket
+            blobs: list of blob names or of Blob objects (e.g. from
+            list_blobs, which saves a metadata request per blob)
+            destination_dir: String, local directory, blob names are used as
+            relative paths inside it
+            max_workers: int, maximum number of concurrent requests
+            chunk_size: int, bytes per ranged read of a large blob
+            parallel_threshold: int, size from which a blob is split
+
+        Returns:
+            DownloadReport
+        """
+        start_time = time()
+        pool = ThreadPool(max_workers)
+        try:
+            blobs = pool.map(
+                lambda blob: self._blob_with_metadata(bucket_name, blob),
+                blobs)
+            tasks = []
+            for blob in blobs:
+                path = os.path.join(destination_dir, blob.name)
+                directory = os.path.dirname(path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                if blob.size >= parallel_threshold and \
+                        blob.content_encoding != 'gzip':
+                    # Preallocate the file so ranges are written in place
+                    with open(path, 'wb') as f:
+                        f.truncate(blob.size)
+                    tasks.extend((blob, path, byte_range) for byte_range
+                                 in _byte_ranges(blob.size, chunk_size))
+                else:
+                    tasks.append((blob, path, None))
+            total_bytes = sum(pool.imap_unordered(self._download_task, tasks))
+        finally:
+            pool.close()
+            pool.join()
+
+        return DownloadReport(len(blobs), total_bytes, time() - start_time)
+
+    def iter_chunks(self, bucket_name, blob, chunk_size=STREAM_CHUNK_SIZE,
+                    read_ahead=2, decompress=None):
+        """Stream the content of a blob without writing it to disk.
+
+        The blob is read in ``chunk_size`` ranges of the generation found
+        when the stream starts. A background thread fetches up to
+        ``read_ahead`` ranges ahead of the consumer, so memory stays bounded
+        by about ``(read_ahead + 1) * chunk_size`` bytes.
+
+        Args:
+            bucket_name: String, the bucket
+            blob: String or Blob, the blob to read
+            chunk_size: int, bytes per ranged read
+            read_ahead: int, ranges fetched ahead, 0 to read synchronously
+            decompress: bool, gunzip the content (``None``: if is_gzip_blob)
+
+        Yields:
+            bytes
+        """
+        blob = self._blob_with_metadata(bucket_name, blob)
+        if decompress is None:
+            decompress = is_gzip_blob(blob)
+        if not blob.size:
+            return
+
+        def fetch_chunk(start):
+            start = start or 0
+            end = min(start + chunk_size, blob.size) - 1
+            # Raw bytes, as stored: ranges of a transcoded gzip blob would
+            # not line up
+            data = blob.download_as_bytes(start=start, end=end,
+                                          raw_download=True)
+            return data, end + 1 if end + 1 < blob.size else None
+
+        chunks = iter_pages(fetch_chunk, prefetch=read_ahead > 0,
+                            read_ahead=read_ahead)
         try:
-            bucket = self.get_bucket(bucket_name)
-            blob = bucket.blob(blob_name)
-            if destination_file:
-                blob.download_to_filename(destination_file)
+            if decompress:
+                for data in gunzip_chunks(chunks, chunk_size):
+                    yield data
             else:
-                blob.download_to_filename(blob_name)
-        except:
-            print('Sorry, that file does not exist')
+                for data in chunks:
+                    yield data
+        finally:
+            chunks.close()
+
+    def open_blob(self, bucket_name, blob, mode='rb', encoding='utf-8',
+                  newline=None, **kwargs):
+        """Open a blob as a streaming, read-only file object.
+
+        Compressed export shards can be handed straight to ``csv.reader`` or
+        to a loader, e.g.::
+
+            with client.open_blob('bucket', 'app1-000.csv.gz', 'r',
+                                  newline='') as f:
+                for row in csv.reader(f):
+                    ...
+
+        Args:
+            bucket_name: String, the bucket
+            blob: String or Blob, the blob to read
+            mode: String, ``'rb'`` for bytes or ``'r'`` for text
+            encoding: String, encoding of the text mode
+            newline: see io.TextIOWrapper
+            **kwargs: passed to iter_chunks
+
+        Returns:
+            io.BufferedReader in binary mode, io.TextIOWrapper in text mode
+        """
+        if mode not in ('r', 'rb'):
+            raise ValueError('Unsupported mode: {0}'.format(mode))
+        reader = io.BufferedReader(
+            ChunkReader(self.iter_chunks(bucket_name, blob, **kwargs)))
+        if mode == 'rb':
+            return reader
+        return io.TextIOWrapper(reader, encoding=encoding, newline=newline)
+
+    def _blob_with_metadata(self, bucket_name, blob):
+        """Return a Blob with its size, fetching metadata only if needed"""
+        if isinstance(blob, six.string_types):
+            blob = self.get_blob(bucket_name, blob)
+        elif blob.size is None:
+            blob.reload()
+        return blob
+
+    def _download_task(self, task):
+        """Download a whole blob or one byte range of it, return the size"""
+        blob, path, byte_range = task
+        if byte_range is None:
+            blob.download_to_filename(path)
+            return os.path.getsize(path)
+
+        start, end = byte_range
+        with open(path, 'r+b') as f:
+            f.seek(start)
+            blob.download_to_file(f, start=start, end=end)
+        return end - start + 1
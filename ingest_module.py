@@ -0,0 +1,558 @@
+#!/usr/bin/env python
+import io
+import csv
+import gzip
+import json
+import multiprocessing
+from datetime import datetime
+
+import six
+from six.moves import queue
+
+from results_module import CONVERTERS, _parse_bool
+
+# Lines parsed by a single JSON decoder call
+DEFAULT_BATCH_SIZE = 2000
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+# Batches waiting in the queue between the decoding processes and the
+# consumer
+DEFAULT_QUEUE_SIZE = 16
+
+# Seconds between two checks of the workers by a consumer waiting for a
+# batch
+_WORKER_POLL = 0.1
+
+# Distinct DATE or TIME strings whose conversion is kept per column
+_MAX_MEMOIZED_VALUES = 65536
+
+
+def _json_loads():
+    """Return the fastest installed JSON decoder among orjson, ujson,
+    simplejson and json"""
+    for name in ('orjson', 'ujson', 'simplejson'):
+        try:
+            return __import__(name).loads
+        except ImportError:
+            pass
+    return json.loads
+
+
+def _parse_export_timestamp(value):
+    """NDJSON exports write TIMESTAMP as ``YYYY-MM-DD HH:MM:SS[.ffffff] UTC``
+    """
+    value = value[:-4] if value.endswith(' UTC') else value
+    if '.' in value:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+
+def _parse_json_bool(value):
+    return value if isinstance(value, bool) else _parse_bool(value)
+
+
+# BigQuery type -> converter of NDJSON export values, which are JSON
+# strings for most types but may be native JSON numbers and booleans
+NDJSON_CONVERTERS = dict(CONVERTERS, TIMESTAMP=_parse_export_timestamp,
+                         BOOLEAN=_parse_json_bool, BOOL=_parse_json_bool)
+
+
+def _field_spec(field):
+    """Return ``(name, converter)`` of a field given as a schema field or
+    as a plain name (values kept as decoded)"""
+    if isinstance(field, six.string_types):
+        return field, None
+    if field.get('mode') == 'REPEATED' or \
+            field['type'] in ('RECORD', 'STRUCT'):
+        return field['name'], None
+    convert = NDJSON_CONVERTERS.get(field['type'])
+    return field['name'], None if convert is six.text_type else convert
+
+
+def iter_ndjson_batches(lines, fields, batch_size=DEFAULT_BATCH_SIZE,
+                        loads=None):
+    """Decode newline delimited JSON into batches of rows.
+
+    Every batch of lines is decoded by a single call of the JSON decoder,
+    as one JSON array. Rows are projected in the order of ``fields``, and
+    values are converted column by column, with the converter of each
+    field resolved once. Missing keys and nulls become None.
+
+    Args:
+        lines: iterable of JSON objects, one per line, as bytes or text
+        fields: list of schema fields as returned by get_table_schema, or
+        of field names to keep values as decoded
+        batch_size: int, lines decoded at once
+        loads: JSON decoder, the fastest installed one by default
+
+    Yields:
+        list of tuples, one per line, in the order of ``fields``
+    """
+    loads = loads or _json_loads()
+    specs = [_field_spec(field) for field in fields]
+    batch = []
+    for line in lines:
+        if line.strip():
+            batch.append(line)
+        if len(batch) >= batch_size:
+            yield _decode_batch(batch, specs, loads)
+            batch = []
+    if batch:
+        yield _decode_batch(batch, specs, loads)
+
+
+def _decode_batch(lines, specs, loads):
+    if isinstance(lines[0], bytes):
+        objects = loads(b'[' + b','.join(lines) + b']')
+    else:
+        objects = loads(u'[' + u','.join(lines) + u']')
+    columns = []
+    for name, convert in specs:
+        values = [obj.get(name) for obj in objects]
+        if convert is not None:
+            values = [None if value is None else convert(value)
+                      for value in values]
+        columns.append(values)
+    return list(zip(*columns))
+
+
+def iter_ndjson_rows(lines, fields, batch_size=DEFAULT_BATCH_SIZE,
+                     loads=None):
+    """Decode newline delimited JSON into rows, see iter_ndjson_batches"""
+    for batch in iter_ndjson_batches(lines, fields, batch_size, loads):
+        for row in batch:
+            yield row
+
+
+def open_maybe_gzip(path):
+    """Open a file for binary reading, decompressing gzip content whatever
+    its extension (``.gz``, ``.gzip``, none)"""
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == _GZIP_MAGIC:
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_ndjson_rows(path, fields, batch_size=DEFAULT_BATCH_SIZE):
+    """Stream the rows of a local, possibly gzip compressed, NDJSON file such
+    as a BigQuery export with ``destination_format='NEWLINE_DELIMITED_JSON'``
+
+    Args:
+        path: String, the file
+        fields: see iter_ndjson_batches
+        batch_size: int, lines decoded at once
+
+    Yields:
+        tuples, in the order of ``fields``
+    """
+    with open_maybe_gzip(path) as f:
+        for row in iter_ndjson_rows(f, fields, batch_size):
+            yield row
+
+
+def ndjson_to_csv(path, csv_path, fields, header=True,
+                  batch_size=DEFAULT_BATCH_SIZE):
+    """Convert a, possibly gzip compressed, NDJSON file to CSV.
+
+    The CSV columns are in the order of ``fields`` and, with ``header``,
+    the first line holds their names, as expected by
+    ``LOAD DATA ... IGNORE 1 LINES``.
+
+    Returns:
+        int, number of rows written
+    """
+    names = [_field_spec(field)[0] for field in fields]
+    written = 0
+    with open_maybe_gzip(path) as source:
+        if six.PY2:
+            destination = open(csv_path, 'wb')
+        else:
+            destination = io.open(csv_path, 'w', newline='', encoding='utf8')
+        with destination:
+            writer = csv.writer(destination)
+            if header:
+                writer.writerow(names)
+            for batch in iter_ndjson_batches(source, fields, batch_size):
+                writer.writerows(batch)
+                written += len(batch)
+    return written
+
+
+def _fastavro():
+    """Import and return fastavro"""
+    try:
+        import fastavro
+    except ImportError:
+        raise ImportError('fastavro is required to decode Avro files')
+    return fastavro
+
+
+def _parquet():
+    """Import and return pyarrow.parquet"""
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('pyarrow is required to decode Parquet files')
+    return pyarrow.parquet
+
+
+def _naive_utc(value):
+    """Avro and Parquet TIMESTAMP are timezone aware, NDJSON and CSV ones
+    naive UTC"""
+    if value.tzinfo is None:
+        return value
+    return (value - value.utcoffset()).replace(tzinfo=None)
+
+
+def _typed_datetime(value):
+    return _naive_utc(value) if isinstance(value, datetime) else \
+        NDJSON_CONVERTERS['DATETIME'](value)
+
+
+def _typed_timestamp(value):
+    return _naive_utc(value) if isinstance(value, datetime) else \
+        _parse_export_timestamp(value)
+
+
+def _typed_value(convert):
+    """Convert values exported as strings, keep typed ones.
+
+    Conversions are memoized: a column of dates holds few distinct values,
+    and strptime costs more than the rest of the decoding.
+    """
+    cache = {}
+
+    def typed(value):
+        if not isinstance(value, six.string_types):
+            return value
+        try:
+            return cache[value]
+        except KeyError:
+            if len(cache) >= _MAX_MEMOIZED_VALUES:
+                cache.clear()
+            converted = cache[value] = convert(value)
+            return converted
+    return typed
+
+
+def _json_text(value):
+    """JSON text of a REPEATED or RECORD value, JSON values are exported as
+    text already"""
+    if isinstance(value, six.string_types):
+        return value
+    return json.dumps(value, default=six.text_type)
+
+
+def _typed_converter(field):
+    """Return the converter of the values of a field decoded from Avro or
+    Parquet, None to keep them.
+
+    Numbers, booleans, bytes and NUMERIC (Decimal) values are typed
+    already. Without logical types, BigQuery exports DATE, TIME and
+    DATETIME as strings. REPEATED and JSON values become JSON text, as
+    expected by the JSON columns of schema_module.
+    """
+    if field.get('mode') == 'REPEATED' or \
+            field['type'] in ('RECORD', 'STRUCT', 'JSON'):
+        return _json_text
+    if field['type'] == 'TIMESTAMP':
+        return _typed_timestamp
+    if field['type'] == 'DATETIME':
+        return _typed_datetime
+    if field['type'] in ('DATE', 'TIME'):
+        return _typed_value(NDJSON_CONVERTERS[field['type']])
+    return None
+
+
+def _typed_columns(fields, prefix=()):
+    """Return ``(path, converter)`` per column, RECORD fields flattened like
+    schema_module.flatten_schema"""
+    columns = []
+    for field in fields:
+        if isinstance(field, six.string_types):
+            columns.append((prefix + (field,), None))
+        elif field['type'] in ('RECORD', 'STRUCT') and \
+                field.get('mode') != 'REPEATED':
+            columns.extend(_typed_columns(field['fields'],
+                                          prefix + (field['name'],)))
+        else:
+            columns.append((prefix + (field['name'],),
+                            _typed_converter(field)))
+    return columns
+
+
+def _lookup(record, path):
+    for name in path:
+        if record is None:
+            return None
+        record = record.get(name)
+    return record
+
+
+def _project_records(records, columns):
+    """Turn decoded records (dicts) into tuples of converted columns"""
+    values = []
+    for path, convert in columns:
+        if len(path) == 1:
+            column = [record.get(path[0]) for record in records]
+        else:
+            column = [_lookup(record, path) for record in records]
+        if convert is not None:
+            column = [None if value is None else convert(value)
+                      for value in column]
+        values.append(column)
+    return list(zip(*values))
+
+
+def iter_avro_batches(f, fields=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Decode an Avro file, such as a BigQuery export with
+    ``destination_format='AVRO'``, into batches of typed rows.
+
+    Values keep their Avro types (int, float, Decimal, datetime, bytes),
+    so numbers are not formatted as text and parsed back, and NULL stays
+    distinct from the empty string.
+
+    Args:
+        f: binary file object
+        fields: list of schema fields as returned by get_table_schema,
+        RECORD fields are flattened into one column per leaf field, see
+        schema_module.flatten_schema. By default, the top level fields of the
+        Avro schema, kept as decoded
+        batch_size: int, rows per batch
+
+    Yields:
+        list of tuples, in the order of the flattened ``fields``
+    """
+    reader = _fastavro().reader(f)
+    if fields is None:
+        fields = [field['name'] for field in reader.writer_schema['fields']]
+    columns = _typed_columns(fields)
+    batch = []
+    for record in reader:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield _project_records(batch, columns)
+            batch = []
+    if batch:
+        yield _project_records(batch, columns)
+
+
+def iter_parquet_batches(f, fields=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Decode a Parquet file, such as a BigQuery export with
+    ``destination_format='PARQUET'``, into batches of typed rows.
+
+    Only the top level columns of ``fields`` are read from the file.
+
+    Args:
+        f: binary, seekable, file object
+        fields: see iter_avro_batches
+        batch_size: int, rows per batch
+
+    Yields:
+        list of tuples, in the order of the flattened ``fields``
+    """
+    parquet_file = _parquet().ParquetFile(f)
+    if fields is None:
+        fields = list(parquet_file.schema_arrow.names)
+    columns = _typed_columns(fields)
+    names = []
+    for path, _ in columns:
+        if path[0] not in names:
+            names.append(path[0])
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size,
+                                                  columns=names):
+        yield _project_records(record_batch.to_pylist(), columns)
+
+
+def read_avro_rows(path, fields=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Stream the typed rows of a local Avro file, see iter_avro_batches"""
+    with open(path, 'rb') as f:
+        for batch in iter_avro_batches(f, fields, batch_size):
+            for row in batch:
+                yield row
+
+
+def read_parquet_rows(path, fields=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Stream the typed rows of a local Parquet file, see
+    iter_parquet_batches"""
+    with open(path, 'rb') as f:
+        for batch in iter_parquet_batches(f, fields, batch_size):
+            for row in batch:
+                yield row
+
+
+def read_export_rows(path, destination_format, fields=None,
+                     batch_size=DEFAULT_BATCH_SIZE):
+    """Stream the rows of a downloaded export shard of any typed format.
+
+    Args:
+        path: String, the file
+        destination_format: String, AVRO, PARQUET or
+        NEWLINE_DELIMITED_JSON (possibly gzip compressed)
+        fields: see iter_avro_batches, required for NEWLINE_DELIMITED_JSON
+        batch_size: int, rows decoded at once
+
+    Yields:
+        tuples, e.g. for sql_module.load_rows
+    """
+    if destination_format == 'AVRO':
+        return read_avro_rows(path, fields, batch_size)
+    if destination_format == 'PARQUET':
+        return read_parquet_rows(path, fields, batch_size)
+    if destination_format == 'NEWLINE_DELIMITED_JSON':
+        return read_ndjson_rows(path, fields, batch_size)
+    raise ValueError('Unsupported destination format {0}'.format(
+        destination_format))
+
+
+class NdjsonDecoder(object):
+    """Picklable decoder of NDJSON files for iter_parallel_batches
+
+    Args:
+        fields: see iter_ndjson_batches
+        batch_size: int, rows per batch
+    """
+
+    def __init__(self, fields, batch_size=DEFAULT_BATCH_SIZE):
+        self.fields = fields
+        self.batch_size = batch_size
+
+    def __call__(self, f):
+        return iter_ndjson_batches(f, self.fields, self.batch_size)
+
+
+class AvroDecoder(object):
+    """Picklable decoder of Avro files for iter_parallel_batches
+
+    Args:
+        fields: see iter_avro_batches
+        batch_size: int, rows per batch
+    """
+
+    def __init__(self, fields=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.fields = fields
+        self.batch_size = batch_size
+
+    def __call__(self, f):
+        return iter_avro_batches(f, self.fields, self.batch_size)
+
+
+class ParquetDecoder(AvroDecoder):
+    """Picklable decoder of Parquet files for iter_parallel_batches"""
+
+    def __call__(self, f):
+        return iter_parquet_batches(f, self.fields, self.batch_size)
+
+
+class CsvDecoder(object):
+    """Picklable decoder of CSV files for iter_parallel_batches
+
+    Args:
+        header: bool, skip the first line
+        batch_size: int, rows per batch
+        **fmtparams: csv.reader format parameters
+    """
+
+    def __init__(self, header=True, batch_size=DEFAULT_BATCH_SIZE,
+                 **fmtparams):
+        self.header = header
+        self.batch_size = batch_size
+        self.fmtparams = fmtparams
+
+    def __call__(self, f):
+        if not six.PY2:
+            f = io.TextIOWrapper(f, encoding='utf8', newline='')
+        reader = csv.reader(f, **self.fmtparams)
+        if self.header:
+            next(reader, None)
+        batch = []
+        for row in reader:
+            batch.append(tuple(row))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+# Queue of a decoding process, set by _init_worker
+_batches = None
+
+
+def _init_worker(batches):
+    global _batches
+    _batches = batches
+
+
+def _decode_file(index, path, decoder):
+    """Decode one file in a worker process, its batches are queued in
+    order, followed by an end marker"""
+    with open_maybe_gzip(path) as f:
+        for batch in decoder(f):
+            _batches.put((index, batch))
+    _batches.put((index, None))
+
+
+def iter_parallel_batches(paths, decoder, processes=None,
+                          queue_size=DEFAULT_QUEUE_SIZE):
+    """Decompress and decode files in parallel worker processes.
+
+    Every file is handled by one worker, so N files or export shards are
+    decoded by up to ``processes`` cores at once. Batches reach the
+    consumer through a queue of at most ``queue_size`` batches: workers
+    wait when the consumer, e.g. a loader, falls behind.
+
+    Args:
+        paths: list of local files, possibly gzip compressed
+        decoder: picklable callable taking a binary file object and
+        yielding lists of rows, such as NdjsonDecoder or CsvDecoder
+        processes: int, number of workers, the number of CPUs by default
+        queue_size: int, maximum number of batches waiting in the queue
+
+    Yields:
+        ``(path, batch)`` tuples. Batches of different files interleave,
+        but the batches of each file come in order.
+
+    Raises:
+        The exception raised by a worker
+    """
+    paths = list(paths)
+    if not paths:
+        return
+    batches = multiprocessing.Queue(maxsize=queue_size)
+    pool = multiprocessing.Pool(processes or min(len(paths),
+                                                 multiprocessing.cpu_count()),
+                                initializer=_init_worker,
+                                initargs=(batches,))
+    try:
+        results = [pool.apply_async(_decode_file, (index, path, decoder))
+                   for index, path in enumerate(paths)]
+        pending = len(paths)
+        while pending:
+            try:
+                index, batch = batches.get(timeout=_WORKER_POLL)
+            except queue.Empty:
+                for result in results:
+                    if result.ready() and not result.successful():
+                        result.get()
+                continue
+            if batch is None:
+                pending -= 1
+            else:
+                yield paths[index], batch
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def iter_parallel_rows(paths, decoder, processes=None,
+                       queue_size=DEFAULT_QUEUE_SIZE):
+    """Rows of the files decoded by iter_parallel_batches, in the order of
+    each file"""
+    for _, batch in iter_parallel_batches(paths, decoder, processes,
+                                          queue_size):
+        for row in batch:
+            yield row
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""Run the stages of a BigQuery -> GCS -> MySQL transfer as a DAG.
+
+Stages declare the stages they depend on and run in their own thread as
+soon as those are done, so independent stages (e.g. the BigQuery query and
+the CREATE TABLE) overlap. A streaming stage returns an iterable whose
+items are handed to its dependents one by one through a bounded channel:
+they start with it, e.g. a shard is loaded while the next one downloads.
+"""
+from __future__ import print_function
+
+import threading
+from collections import OrderedDict, namedtuple
+from multiprocessing.pool import ThreadPool
+from time import time
+
+from six.moves import queue
+
+# Items waiting in a channel between a streaming stage and a dependent
+DEFAULT_CHANNEL_SIZE = 4
+
+# Seconds between two checks of a closed channel by a blocked producer
+_CHANNEL_POLL = 0.1
+
+_END = object()
+
+
+class StageTiming(namedtuple('StageTiming',
+                             ['stage', 'started', 'seconds', 'items'])):
+    """Timing of a stage, ``started`` is relative to the pipeline start and
+    ``items`` the number of items of a streaming stage (None otherwise)"""
+    __slots__ = ()
+
+
+class Channel(object):
+    """Bounded queue of the items of a streaming stage, read by one
+    dependent. Iterating it raises StageCancelledException if the producer
+    failed."""
+
+    def __init__(self, maxsize=DEFAULT_CHANNEL_SIZE):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._closed = threading.Event()
+
+    def put(self, item):
+        """Queue an item, return False if the consumer is gone"""
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=_CHANNEL_POLL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def close(self):
+        """Stop accepting items, called when the consumer is done"""
+        self._closed.set()
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise StageCancelledException(
+                    'Stage {0} failed'.format(item.stage))
+            yield item
+
+
+class _Failure(object):
+
+    def __init__(self, stage):
+        self.stage = stage
+
+
+class Pipeline(object):
+    """DAG of stages.
+
+    Example::
+
+        pipeline = Pipeline()
+        pipeline.add('query', run_query_job)
+        pipeline.add('create', create_table)
+        pipeline.add('shards', list_shards, requires=['query'], stream=True)
+        pipeline.add('load', load_shards, requires=['create', 'shards'])
+        results = pipeline.run()
+
+    Args:
+        channel_size: int, items buffered between a streaming stage and each
+        of its dependents
+    """
+
+    def __init__(self, channel_size=DEFAULT_CHANNEL_SIZE):
+        self.channel_size = channel_size
+        self._stages = OrderedDict()
+        self.timings = OrderedDict()
+
+    def add(self, name, func, requires=(), stream=False):
+        """Declare a stage.
+
+        Args:
+            name: String, unique name of the stage
+            func: callable, called with the results of ``requires`` as
+            positional arguments, in order. The result of a streaming
+            dependency is a Channel to iterate
+            requires: list of names of previously added stages
+            stream: bool, ``func`` returns an iterable whose items are
+            streamed to the dependents, which start with the stage
+
+        Returns:
+            self, to chain calls
+        """
+        if name in self._stages:
+            raise ValueError('Duplicate stage {0}'.format(name))
+        for dependency in requires:
+            if dependency not in self._stages:
+                raise ValueError('Unknown stage {0}'.format(dependency))
+        self._stages[name] = (func, list(requires), stream)
+        return self
+
+    def run(self):
+        """Run every stage, each in its own thread.
+
+        A stage whose dependency failed does not run.
+
+        Returns:
+            dict: stage name -> result, the number of items for streaming
+            stages. ``self.timings`` holds the StageTiming of every stage
+            that ran
+
+        Raises:
+            PipelineException: if any stage failed, once all are settled
+        """
+        self.timings = OrderedDict()
+        channels = dict((name, []) for name in self._stages)
+        inputs = {}
+        for name, (_, requires, _) in self._stages.items():
+            inputs[name] = []
+            for dependency in requires:
+                if self._stages[dependency][2]:
+                    channel = Channel(self.channel_size)
+                    channels[dependency].append(channel)
+                    inputs[name].append(channel)
+                else:
+                    inputs[name].append(None)
+
+        done = dict((name, threading.Event()) for name in self._stages)
+        results = {}
+        errors = OrderedDict()
+        start = time()
+
+        def run_stage(name):
+            func, requires, stream = self._stages[name]
+            try:
+                for dependency in requires:
+                    if not self._stages[dependency][2]:
+                        done[dependency].wait()
+                if any(dependency not in results
+                       for dependency in requires
+                       if not self._stages[dependency][2]):
+                    return
+                args = [results[dependency] if channel is None else channel
+                        for dependency, channel in zip(requires,
+                                                       inputs[name])]
+                started = time()
+                items = None
+                try:
+                    result = func(*args)
+                    if stream:
+                        items = result = _pump(result, channels[name])
+                    results[name] = result
+                except StageCancelledException:
+                    # The failed streaming dependency is the one reported
+                    pass
+                except Exception as e:
+                    errors[name] = e
+                finally:
+                    self.timings[name] = StageTiming(
+                        name, started - start, time() - started, items)
+            finally:
+                for channel in inputs[name]:
+                    if channel is not None:
+                        channel.close()
+                if name not in results:
+                    # Dependents of a stage that failed or did not run
+                    for channel in channels[name]:
+                        channel.put(_Failure(name))
+                done[name].set()
+
+        pool = ThreadPool(len(self._stages) or 1)
+        try:
+            pool.map(run_stage, list(self._stages))
+        finally:
+            pool.close()
+            pool.join()
+
+        if errors:
+            raise PipelineException(errors)
+        return results
+
+    def report(self):
+        """Return the stage timings as a printable table"""
+        lines = ['{0:<20} {1:>9} {2:>9} {3:>7}'.format(
+            'stage', 'start (s)', 'time (s)', 'items')]
+        for timing in self.timings.values():
+            lines.append('{0:<20} {1:>9.2f} {2:>9.2f} {3:>7}'.format(
+                timing.stage, timing.started, timing.seconds,
+                '' if timing.items is None else timing.items))
+        return '\n'.join(lines)
+
+
+def _pump(items, channels):
+    """Copy items to the channels, return the number of items"""
+    count = 0
+    open_channels = list(channels)
+    iterator = iter(items)
+    for item in iterator:
+        count += 1
+        open_channels = [channel for channel in open_channels
+                         if channel.put(item)]
+        if channels and not open_channels:
+            # Every dependent is gone
+            getattr(iterator, 'close', lambda: None)()
+            break
+    for channel in open_channels:
+        channel.put(_END)
+    return count
+
+
+class StageCancelledException(Exception):
+    pass
+
+
+class PipelineException(Exception):
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(PipelineException, self).__init__(
+            "{0} stage(s) failed: {1}".format(
+                len(errors),
+                ", ".join("{0}: {1}".format(name, error)
+                          for name, error in errors.items())))
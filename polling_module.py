@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+import abc
+import random
+
+import six
+
+
+@six.add_metaclass(abc.ABCMeta)
+class PollingStrategy(object):
+    """Abstract base class for job polling strategies.
+
+    A strategy produces the successive delays (in seconds) to sleep before
+    each status check of a job. The caller is responsible for clipping the
+    delays against its own deadline, see ``clip_to_deadline``. Subclasses
+    must implement ``delays``.
+    """
+
+    @abc.abstractmethod
+    def delays(self):
+        """Return an iterator over the delays to sleep before each poll."""
+
+
+class FixedIntervalPolling(PollingStrategy):
+    """Poll at a fixed interval.
+
+    Args:
+        interval: float, seconds between two status checks
+        immediate: bool, if True the first check is made without sleeping
+    """
+
+    def __init__(self, interval=5, immediate=True):
+        self.interval = interval
+        self.immediate = immediate
+
+    def delays(self):
+        if self.immediate:
+            yield 0
+        while True:
+            yield self.interval
+
+
+class ExponentialBackoffPolling(PollingStrategy):
+    """Poll with exponentially growing, jittered delays up to a cap.
+
+    The first check is made immediately, so short jobs are detected as soon
+    as they finish, while long running jobs are polled less and less often.
+
+    Args:
+        initial: float, delay before the second check in seconds
+        multiplier: float, growth factor applied after every check
+        maximum: float, upper bound of a single delay in seconds
+        jitter: float, relative jitter in [0, 1) applied to every delay
+        rng: random.Random, optional source of randomness for the jitter
+    """
+
+    def __init__(self, initial=0.25, multiplier=2.0, maximum=10.0, jitter=0.1,
+                 rng=None):
+        assert initial > 0, 'initial delay must be positive'
+        assert multiplier >= 1, 'multiplier must be at least 1'
+        assert 0 <= jitter < 1, 'jitter must be in [0, 1)'
+        self.initial = initial
+        self.multiplier = multiplier
+        self.maximum = maximum
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+
+    def delays(self):
+        yield 0
+        delay = self.initial
+        while True:
+            yield self._jittered(min(delay, self.maximum))
+            delay *= self.multiplier
+
+    def _jittered(self, delay):
+        if not self.jitter:
+            return delay
+        return delay * self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+def get_polling_strategy(polling=None, interval=None):
+    """Resolve the polling strategy to use for a wait.
+
+    Args:
+        polling: PollingStrategy, explicitly requested strategy
+        interval: float, legacy fixed polling interval in seconds
+
+    Returns:
+        PollingStrategy: ``polling`` if given, a ``FixedIntervalPolling`` if
+        only ``interval`` is given, else the default exponential backoff
+    """
+    if polling is not None:
+        return polling
+    if interval is not None:
+        return FixedIntervalPolling(interval)
+    return ExponentialBackoffPolling()
+
+
+def clip_to_deadline(delay, now, deadline):
+    """Return ``delay`` shortened so that sleeping it never passes ``deadline``.
+
+    Args:
+        delay: float, the delay proposed by the strategy
+        now: float, current time as returned by ``time.time``
+        deadline: float, absolute deadline, or None for no deadline
+
+    Returns:
+        float: the delay to actually sleep, never negative
+    """
+    if deadline is not None:
+        delay = min(delay, deadline - now)
+    return max(delay, 0)
+
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+import sys
+import base64
+import threading
+from array import array
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import six
+from six.moves import queue
+
+EPOCH = datetime(1970, 1, 1)
+
+# Seconds between two checks of the stop flag by a blocked prefetch thread
+_PREFETCH_POLL = 0.1
+
+
+def _parse_timestamp(value):
+    """BigQuery returns TIMESTAMP as a float string of epoch seconds"""
+    return EPOCH + timedelta(microseconds=int(round(float(value) * 1e6)))
+
+
+def _parse_datetime(value):
+    value = value.replace(' ', 'T')
+    if '.' in value:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _parse_time(value):
+    if '.' in value:
+        return datetime.strptime(value, '%H:%M:%S.%f').time()
+    return datetime.strptime(value, '%H:%M:%S').time()
+
+
+def _parse_bool(value):
+    return value.lower() == 'true'
+
+
+def _parse_bytes(value):
+    return base64.b64decode(value)
+
+
+# BigQuery type -> converter of the JSON string value
+CONVERTERS = {
+    'STRING': six.text_type,
+    'BYTES': _parse_bytes,
+    'INTEGER': int,
+    'INT64': int,
+    'FLOAT': float,
+    'FLOAT64': float,
+    'NUMERIC': Decimal,
+    'BIGNUMERIC': Decimal,
+    'BOOLEAN': _parse_bool,
+    'BOOL': _parse_bool,
+    'TIMESTAMP': _parse_timestamp,
+    'DATETIME': _parse_datetime,
+    'DATE': _parse_date,
+    'TIME': _parse_time,
+}
+
+
+def _field_converter(field):
+    """Return a function converting the ``v`` of a cell of ``field``"""
+    if field['type'] in ('RECORD', 'STRUCT'):
+        # A RECORD value is itself an f/v row
+        convert = make_row_decoder(field['fields'])
+    else:
+        convert = CONVERTERS.get(field['type'], six.text_type)
+
+    if field.get('mode') == 'REPEATED':
+        def convert_repeated(values, convert=convert):
+            return [None if item['v'] is None else convert(item['v'])
+                    for item in values]
+        return convert_repeated
+    return convert
+
+
+def make_row_decoder(fields):
+    """Return a function decoding an ``f``/``v`` row into a dict.
+
+    Converters are resolved once from the schema, so decoding a row is a
+    single pass over its cells.
+
+    Args:
+        fields: list of schema fields as returned by get_table_schema
+
+    Returns:
+        function: takes a row ``{'f': [{'v': ...}, ...]}`` and returns a
+        ``dict`` mapping field names to typed Python values (None for NULL)
+    """
+    names = [field['name'] for field in fields]
+    converters = [_field_converter(field) for field in fields]
+    columns = list(zip(names, converters))
+
+    def decode(row):
+        return dict((name, None if cell['v'] is None else convert(cell['v']))
+                    for (name, convert), cell in zip(columns, row['f']))
+    return decode
+
+
+def decode_rows(rows, fields):
+    """Decode a list of ``f``/``v`` rows, see make_row_decoder"""
+    decode = make_row_decoder(fields)
+    return [decode(row) for row in rows]
+
+
+def iter_pages(fetch_page, prefetch=True, read_ahead=1):
+    """Iterate over the pages of a paged API call.
+
+    With ``prefetch`` the next pages are fetched by a background thread
+    while the caller consumes the current one. At most ``read_ahead`` pages
+    wait ahead of the one being consumed, so memory stays bounded whatever
+    the result size.
+
+    Args:
+        fetch_page: callable taking a page token (None for the first page)
+        and returning a ``(page, next_page_token)`` tuple
+        prefetch: bool, fetch pages in a background thread
+        read_ahead: int, maximum number of pages fetched ahead
+
+    Yields:
+        Every page, in order. Exceptions raised while fetching are re-raised
+        in the caller.
+    """
+    if not prefetch:
+        page_token = None
+        while True:
+            page, page_token = fetch_page(page_token)
+            yield page
+            if not page_token:
+                return
+
+    pages = queue.Queue(maxsize=max(read_ahead, 1))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=_PREFETCH_POLL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            page_token = None
+            while True:
+                page, page_token = fetch_page(page_token)
+                if not put(('page', page)):
+                    return
+                if not page_token:
+                    break
+            put(('end', None))
+        except Exception:
+            put(('error', sys.exc_info()))
+
+    thread = threading.Thread(target=worker, name='bq-page-prefetch')
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            kind, value = pages.get()
+            if kind == 'page':
+                yield value
+            elif kind == 'end':
+                return
+            else:
+                six.reraise(*value)
+    finally:
+        stop.set()
+
+
+# Column of a columnar result: ``values`` is a numpy array or an
+# ``array.array`` (a list for non numeric types), ``mask`` flags NULL cells
+Column = namedtuple('Column', ['values', 'mask'])
+
+try:
+    array('q')
+    _INT64_TYPECODE = 'q'
+except ValueError:  # Python 2
+    _INT64_TYPECODE = 'l'
+
+# BigQuery type -> array.array typecode of numeric columns
+ARRAY_TYPECODES = {
+    'INTEGER': _INT64_TYPECODE, 'INT64': _INT64_TYPECODE,
+    'FLOAT': 'd', 'FLOAT64': 'd',
+    'BOOLEAN': 'b', 'BOOL': 'b',
+}
+
+# BigQuery type -> numpy dtype, other types are kept as object arrays
+NUMPY_DTYPES = {
+    'INTEGER': 'int64', 'INT64': 'int64',
+    'FLOAT': 'float64', 'FLOAT64': 'float64',
+    'BOOLEAN': 'bool', 'BOOL': 'bool',
+    'TIMESTAMP': 'datetime64[us]',
+    'DATETIME': 'datetime64[us]',
+    'DATE': 'datetime64[D]',
+}
+
+# Placeholder parsed in place of NULL cells, masked afterwards
+_NULL_FILLERS = {'int64': '0', 'float64': 'nan', 'bool': 'false',
+                 'datetime64[us]': '0', 'datetime64[D]': '1970-01-01'}
+
+
+def _numpy():
+    """Import and return numpy, or None if it is not installed"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _numpy_column(np, field, cells):
+    """Convert the raw cells of one column of a page with numpy"""
+    raw = np.array(cells, dtype=object)
+    mask = np.equal(raw, None)
+    dtype = NUMPY_DTYPES.get(field['type'])
+    if field['type'] == 'STRING' and field.get('mode') != 'REPEATED':
+        # JSON values already are text
+        return raw, mask
+    if dtype is None or field.get('mode') == 'REPEATED':
+        convert = _field_converter(field)
+        values = np.array([None if v is None else convert(v) for v in cells],
+                          dtype=object)
+        return values, mask
+
+    raw[mask] = _NULL_FILLERS[dtype]
+    if dtype == 'bool':
+        values = raw.astype('U') == 'true'
+    elif field['type'] == 'TIMESTAMP':
+        values = np.round(raw.astype('float64') * 1e6).astype(dtype)
+    elif field['type'] == 'DATETIME':
+        values = np.char.replace(raw.astype('U'), ' ', 'T').astype(dtype)
+    else:
+        values = raw.astype(dtype)
+    return values, mask
+
+
+def _array_column(field, cells):
+    """Convert the raw cells of one column of a page to array.array"""
+    mask = array('b', [v is None for v in cells])
+    typecode = ARRAY_TYPECODES.get(field['type'])
+    if field['type'] == 'STRING' and field.get('mode') != 'REPEATED':
+        return list(cells), mask
+    if typecode is None or field.get('mode') == 'REPEATED':
+        convert = _field_converter(field)
+        return [None if v is None else convert(v) for v in cells], mask
+
+    filler = {'d': 'nan', 'b': 'false'}.get(typecode, '0')
+    filled = [filler if v is None else v for v in cells]
+    if typecode == 'd':
+        values = array('d', map(float, filled))
+    elif typecode == _INT64_TYPECODE:
+        values = array(typecode, map(int, filled))
+    else:
+        values = array('b', [v == 'true' for v in filled])
+    return values, mask
+
+
+def decode_columns(pages, fields, use_numpy=None):
+    """Materialize ``f``/``v`` rows straight into one array per column.
+
+    The cells of every column of a page are gathered in one pass and
+    converted in a single vectorized call, instead of building a dict per
+    row.
+
+    Args:
+        pages: iterable of lists of ``f``/``v`` rows
+        fields: list of schema fields as returned by get_table_schema
+        use_numpy: bool, build numpy arrays (``None``: if numpy is installed)
+        or ``array.array`` objects
+
+    Returns:
+        OrderedDict: field name -> Column(values, mask). Numeric, boolean
+        and time columns are typed arrays whose NULL cells hold a
+        placeholder flagged in ``mask``; other columns hold Python objects
+    """
+    np = _numpy() if use_numpy in (None, True) else None
+    if use_numpy and np is None:
+        raise ImportError('numpy is required for use_numpy=True')
+
+    chunks = [([], []) for _ in fields]
+    for rows in pages:
+        if not rows:
+            continue
+        for index, (field, (values, masks)) in enumerate(zip(fields,
+                                                              chunks)):
+            column = [row['f'][index]['v'] for row in rows]
+            if np is not None:
+                page_values, page_mask = _numpy_column(np, field, column)
+            else:
+                page_values, page_mask = _array_column(field, column)
+            values.append(page_values)
+            masks.append(page_mask)
+
+    columns = OrderedDict()
+    for field, (values, masks) in zip(fields, chunks):
+        if np is not None:
+            dtype = NUMPY_DTYPES.get(field['type'], object) \
+                if field.get('mode') != 'REPEATED' else object
+            columns[field['name']] = Column(
+                np.concatenate(values) if values else np.array([], dtype),
+                np.concatenate(masks) if masks else np.array([], bool))
+        else:
+            column_values = values[0][:0] if values else []
+            for chunk in values:
+                column_values += chunk
+            column_mask = array('b')
+            for chunk in masks:
+                column_mask += chunk
+            columns[field['name']] = Column(column_values, column_mask)
+    return columns
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""Translation of BigQuery table schemas to MySQL DDL."""
+from collections import OrderedDict
+
+import six
+
+# VARCHAR length of STRING columns without sampled sizes. 255 characters
+# of utf8 fit the 767 bytes index key prefix of older InnoDB versions
+DEFAULT_VARCHAR_LENGTH = 255
+
+# Longest VARCHAR, in characters, whatever the charset (65535 bytes of a
+# row / 4 bytes per utf8mb4 character); longer strings are stored as TEXT
+MAX_VARCHAR_LENGTH = 16383
+
+# Characters of TEXT and BLOB columns indexed by secondary indexes
+INDEX_PREFIX_LENGTH = 255
+
+# BigQuery type -> MySQL column type, STRING is sized separately.
+# TIMESTAMP is stored as a UTC DATETIME: MySQL TIMESTAMP ends in 2038
+MYSQL_TYPES = {
+    'INTEGER': 'BIGINT',
+    'INT64': 'BIGINT',
+    'FLOAT': 'DOUBLE',
+    'FLOAT64': 'DOUBLE',
+    'NUMERIC': 'DECIMAL(38, 9)',
+    # Largest DECIMAL of MySQL, BIGNUMERIC values beyond are out of range
+    'BIGNUMERIC': 'DECIMAL(65, 30)',
+    'BOOLEAN': 'TINYINT(1)',
+    'BOOL': 'TINYINT(1)',
+    'TIMESTAMP': 'DATETIME(6)',
+    'DATETIME': 'DATETIME(6)',
+    'DATE': 'DATE',
+    'TIME': 'TIME(6)',
+    'BYTES': 'LONGBLOB',
+    'GEOGRAPHY': 'TEXT',
+    'JSON': 'JSON',
+}
+
+
+def quote_identifier(name):
+    """Quote a table, column or index name with backticks"""
+    return u'`{0}`'.format(name.replace(u'`', u'``'))
+
+
+def flatten_schema(fields, separator='_', prefix=''):
+    """Flatten RECORD fields into one column per leaf field.
+
+    A non repeated RECORD ``address`` with a field ``city`` becomes the
+    column ``address_city``. REPEATED fields, records included, cannot be
+    spread over a single row and are kept whole (as JSON columns).
+
+    Args:
+        fields: list of schema fields as returned by get_table_schema
+        separator: String, joins the names of nested fields
+        prefix: String, prepended to the column names
+
+    Returns:
+        list of ``(column name, field)`` tuples, where ``field`` is the
+        schema field of the column. A column nested in a NULLABLE record is
+        NULLABLE whatever the mode of its field.
+    """
+    columns = []
+    for field in fields:
+        name = prefix + field['name']
+        if field['type'] in ('RECORD', 'STRUCT') and \
+                field.get('mode') != 'REPEATED':
+            for column, nested in flatten_schema(field['fields'], separator,
+                                                 name + separator):
+                if field.get('mode') != 'REQUIRED':
+                    nested = dict(nested, mode='NULLABLE')
+                columns.append((column, nested))
+        else:
+            columns.append((name, field))
+    return columns
+
+
+def _flatten_row(row, fields, separator, prefix=''):
+    """Flatten a decoded row (nested dicts for records) like flatten_schema
+    """
+    values = {}
+    for field in fields:
+        name = prefix + field['name']
+        value = row.get(field['name']) if row is not None else None
+        if field['type'] in ('RECORD', 'STRUCT') and \
+                field.get('mode') != 'REPEATED':
+            values.update(_flatten_row(value, field['fields'], separator,
+                                       name + separator))
+        else:
+            values[name] = value
+    return values
+
+
+def _varchar_length(length, headroom):
+    """Round a sampled length up to a power of two, after headroom"""
+    target = max(1, int(length * headroom + 0.5))
+    size = 8
+    while size < target:
+        size *= 2
+    return size
+
+
+def sample_varchar_sizes(rows, fields, headroom=1.5, separator='_'):
+    """Size the VARCHAR columns of a schema from sampled rows.
+
+    The longest sampled value of every STRING column, times ``headroom``,
+    is rounded up to a power of two, e.g. 9 characters give VARCHAR(16).
+
+    Args:
+        rows: iterable of decoded rows, dicts as returned by
+        BigQueryClient.read_table_rows (nested dicts for records)
+        fields: list of schema fields
+        headroom: float, margin for values longer than the sampled ones
+        separator: String, see flatten_schema
+
+    Returns:
+        dict: column name -> VARCHAR length, for the STRING columns
+    """
+    columns = [name for name, field in flatten_schema(fields, separator)
+               if field['type'] == 'STRING' and
+               field.get('mode') != 'REPEATED']
+    longest = dict((name, 0) for name in columns)
+    for row in rows:
+        values = _flatten_row(row, fields, separator)
+        for name in columns:
+            value = values.get(name)
+            if value is not None and len(value) > longest[name]:
+                longest[name] = len(value)
+    return dict((name, _varchar_length(length, headroom))
+                for name, length in longest.items())
+
+
+def column_type(field, varchar_length=None):
+    """Return the MySQL type of a (flattened) schema field.
+
+    Args:
+        field: schema field
+        varchar_length: int, length of a STRING column, see
+        sample_varchar_sizes, DEFAULT_VARCHAR_LENGTH if not given
+
+    Returns:
+        String, the MySQL column type
+    """
+    if field.get('mode') == 'REPEATED' or \
+            field['type'] in ('RECORD', 'STRUCT'):
+        return 'JSON'
+    if field['type'] == 'STRING':
+        length = varchar_length or DEFAULT_VARCHAR_LENGTH
+        if length > MAX_VARCHAR_LENGTH:
+            return 'LONGTEXT'
+        return 'VARCHAR({0})'.format(length)
+    return MYSQL_TYPES.get(field['type'], 'TEXT')
+
+
+def column_types(fields, varchar_sizes=None, separator='_'):
+    """Return an OrderedDict of column name -> MySQL type of a schema, see
+    flatten_schema and column_type"""
+    varchar_sizes = varchar_sizes or {}
+    return OrderedDict(
+        (name, column_type(field, varchar_sizes.get(name)))
+        for name, field in flatten_schema(fields, separator))
+
+
+def create_table_sql(table_name, fields, varchar_sizes=None,
+                     primary_key=None, charset='utf8', separator='_'):
+    """Return the CREATE TABLE statement of a BigQuery schema.
+
+    Args:
+        table_name: String, the MySQL table
+        fields: list of schema fields as returned by get_table_schema
+        varchar_sizes: dict of column name -> VARCHAR length, see
+        sample_varchar_sizes
+        primary_key: list of column names
+        charset: String, default charset of the table
+        separator: String, see flatten_schema
+
+    Returns:
+        String, the statement
+    """
+    types = column_types(fields, varchar_sizes, separator)
+    definitions = []
+    for name, field in flatten_schema(fields, separator):
+        not_null = field.get('mode') == 'REQUIRED' or \
+            name in (primary_key or [])
+        definitions.append(u' {0} {1}{2}'.format(
+            quote_identifier(name), types[name],
+            ' NOT NULL' if not_null else ''))
+    if primary_key:
+        definitions.append(u' PRIMARY KEY ({0})'.format(
+            u', '.join(quote_identifier(name) for name in primary_key)))
+    return u'CREATE TABLE {0} ({1}) DEFAULT CHARSET={2} ;'.format(
+        quote_identifier(table_name), u','.join(definitions), charset)
+
+
+def _index_column(name, mysql_type):
+    if mysql_type.endswith(('TEXT', 'BLOB')):
+        return u'{0}({1})'.format(quote_identifier(name), INDEX_PREFIX_LENGTH)
+    return quote_identifier(name)
+
+
+def create_index_sql(table_name, fields, keys, varchar_sizes=None,
+                     unique=False, separator='_'):
+    """Return the CREATE INDEX statements of secondary indexes.
+
+    TEXT and BLOB columns are indexed on their first INDEX_PREFIX_LENGTH
+    characters, JSON columns cannot be indexed.
+
+    Args:
+        table_name: String, the MySQL table
+        fields: list of schema fields
+        keys: list of key columns, each a column name or a list of names
+        for a composite index
+        varchar_sizes, separator: see create_table_sql
+        unique: bool, create UNIQUE indexes
+
+    Returns:
+        list of String, one statement per key
+
+    Raises:
+        ValueError: on an unknown or JSON key column
+    """
+    types = column_types(fields, varchar_sizes, separator)
+    statements = []
+    for key in keys:
+        names = [key] if isinstance(key, six.string_types) else list(key)
+        for name in names:
+            if types.get(name, 'JSON') == 'JSON':
+                raise ValueError('Column {0} cannot be indexed'.format(name))
+        statements.append(u'CREATE {0}INDEX {1} ON {2} ({3}) ;'.format(
+            'UNIQUE ' if unique else '',
+            quote_identifier(u'idx_{0}_{1}'.format(table_name,
+                                                   u'_'.join(names))),
+            quote_identifier(table_name),
+            u', '.join(_index_column(name, types[name]) for name in names)))
+    return statements
@@ -1,78 +1,782 @@
+from __future__ import print_function
+import io
+import os
+import re
+import sys
+import shutil
+import tempfile
+import threading
+from time import time
+from contextlib import contextmanager
+
+import six
+from six.moves import queue
+
 import pymysql
+
+from schema_module import create_table_sql
+from schema_module import quote_identifier as _quote_identifier
+
 pymysql.install_as_MySQLdb()
 # Ensure coud_proxy is run
 # Connect to the database
 #TODO: pass DB credentias as args
 
+# Upper bound of the size of one multi-row INSERT of bulk_insert. Larger
+# statements do not load faster and hold more memory on both ends
+BULK_INSERT_MAX_BYTES = 1024 * 1024
+
+# Bytes buffered by the writer of a streamed LOAD DATA
+LOAD_BUFFER_SIZE = 256 * 1024
+
+# Characters escaped in the default LOAD DATA format
+_LOAD_DATA_SPECIALS = re.compile(u'[\\\\\t\n\r\0]')
+_LOAD_DATA_ESCAPES = {u'\\': u'\\\\', u'\t': u'\\t', u'\n': u'\\n',
+                      u'\r': u'\\r', u'\0': u'\\0'}
+
+# Placeholder for the table name in the statements of atomic_load, e.g.
+# create_sql_from_json_schema(schema, TABLE_PLACEHOLDER)
+TABLE_PLACEHOLDER = u'{table}'
+
+# Suffixes of the shadow table being loaded and of the previous generation
+# kept for rollback_table
+SHADOW_SUFFIX = u'__new'
+PREVIOUS_SUFFIX = u'__old'
+
+# Room left in max_allowed_packet for the packet header
+_PACKET_MARGIN = 1024
+
+# Pools shared by run_query, keyed by connection parameters
+_pools_lock = threading.Lock()
+_pools = {}
+
 
-def run_query(user, password, database, query):
-    ''' Runs a pymysql query. Preliminary version
+class PoolTimeoutException(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    ''' Thread-safe pool of persistent pymysql connections.
+
+    Every connection through the cloud proxy costs a TCP and an auth
+    handshake, so connections are kept open and lent out again, most
+    recently released first. ``min_size`` connections are opened up front,
+    more are opened lazily up to ``max_size``; once they are all busy,
+    callers wait for one to be released.
+
+    A connection idle for more than ``health_check_interval`` seconds is
+    pinged when it is checked out, and replaced if the server dropped it.
+
+    Args:
+        user: string, DB username
+        password: string, DB password
+        database: string, DB name
+        host: string, DB host
+        min_size: int, connections opened up front and kept open
+        max_size: int, maximum number of connections
+        timeout: float, seconds to wait for a connection, None to wait
+            forever
+        health_check_interval: float, idle seconds after which a connection
+            is pinged on checkout, 0 to ping on every checkout
+        connect: callable opening a connection, pymysql.connect by default
+        **connect_kwargs: overrides of the pymysql.connect arguments
+    '''
+
+    def __init__(self, user, password, database, host='localhost',
+                 min_size=1, max_size=5, timeout=None,
+                 health_check_interval=30, connect=None, **connect_kwargs):
+        assert 0 <= min_size <= max_size and max_size > 0, \
+            'Pool sizes must satisfy 0 <= min_size <= max_size, max_size > 0'
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connect_kwargs = dict(host=host,
+                                   user=user,
+                                   password=password,
+                                   db=database,
+                                   charset='utf8',
+                                   cursorclass=pymysql.cursors.DictCursor,
+                                   local_infile=True)
+        self.connect_kwargs.update(connect_kwargs)
+        self._connect = connect or pymysql.connect
+        # Idle connections, as (connection, released at) tuples
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._checkouts = 0
+        self._reused = 0
+        self._waits = 0
+        self._reconnects = 0
+        for _ in range(min_size):
+            with self._lock:
+                self._created += 1
+            self._idle.put((self._open(), time()))
+
+    def _open(self):
+        try:
+            return self._connect(**self.connect_kwargs)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def acquire(self):
+        ''' Check out a healthy connection, see release
+
+        Returns:
+            connection: pymysql connection
+
+        Raises:
+            PoolTimeoutException: no connection was released in time
+        '''
+        with self._lock:
+            self._checkouts += 1
+            try:
+                connection, released = self._idle.get_nowait()
+                create = False
+            except queue.Empty:
+                connection = None
+                create = self._created < self.max_size
+                if create:
+                    self._created += 1
+                else:
+                    self._waits += 1
+
+        if create:
+            return self._open()
+        if connection is None:
+            try:
+                connection, released = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise PoolTimeoutException(
+                    'No connection released within {0} seconds'.format(
+                        self.timeout))
+        return self._checked(connection, released)
+
+    def _checked(self, connection, released):
+        ''' Return an idle connection, or a new one if it is dead '''
+        if connection.open and \
+                time() - released < self.health_check_interval:
+            healthy = True
+        else:
+            try:
+                connection.ping(reconnect=False)
+                healthy = True
+            except pymysql.err.Error:
+                healthy = False
+        if healthy:
+            with self._lock:
+                self._reused += 1
+            return connection
+
+        self._close(connection)
+        with self._lock:
+            self._reconnects += 1
+            self._created += 1
+        return self._open()
+
+    def _close(self, connection):
+        with self._lock:
+            self._created -= 1
+        try:
+            connection.close()
+        except pymysql.err.Error:
+            pass
+
+    def release(self, connection, discard=False):
+        ''' Return a connection to the pool
+
+        Args:
+            connection: pymysql connection from acquire
+            discard: bool, close the connection instead, e.g. after a
+                connection error
+        '''
+        if discard or not connection.open:
+            self._close(connection)
+        else:
+            self._idle.put((connection, time()))
+
+    @contextmanager
+    def connection(self):
+        ''' Context manager lending a connection.
+
+        The connection is discarded if the block raises a connection error
+        (pymysql.err.OperationalError), returned to the pool otherwise.
+        '''
+        connection = self.acquire()
+        try:
+            yield connection
+        except pymysql.err.OperationalError:
+            self.release(connection, discard=True)
+            raise
+        except Exception:
+            self.release(connection)
+            raise
+        else:
+            self.release(connection)
+
+    @contextmanager
+    def transaction(self):
+        ''' Context manager lending a connection for one transaction.
+
+        The transaction is committed when the block exits, rolled back if
+        it raises.
+        '''
+        with self.connection() as connection:
+            try:
+                yield connection
+            except Exception:
+                if connection.open:
+                    connection.rollback()
+                raise
+            connection.commit()
+
+    def stats(self):
+        ''' Return connection reuse statistics.
+
+        Returns:
+            dict: ``max_size``, ``created`` connections, ``idle``
+            connections, ``checkouts``, ``reused`` (checkouts served by an
+            open connection), ``waits`` (checkouts that had to wait for a
+            release) and ``reconnects`` (dead connections replaced)
+        '''
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'created': self._created,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'reused': self._reused,
+                'waits': self._waits,
+                'reconnects': self._reconnects,
+            }
+
+    def close(self):
+        ''' Close every idle connection '''
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(connection)
+
+
+def get_pool(user, password, database, **kwargs):
+    ''' Return the ConnectionPool shared by every caller using the same
+    credentials, database and pool arguments
+
+    Args:
+        user: string, DB username
+        password: string, DB password
+        database: string, DB name
+        **kwargs: see ConnectionPool, used when the pool is created
+    Returns:
+        pool: ConnectionPool
+    '''
+    key = (user, password, database, tuple(sorted(kwargs.items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(user, password, database,
+                                                **kwargs)
+        return pool
+
+
+def close_pools():
+    ''' Close the idle connections of the pools shared by run_query '''
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+def run_query(user, password, database, query, pool=None):
+    ''' Runs a pymysql query on a pooled connection. Preliminary version
 
     Args:
         user: string, DB username
         password: string, DB password
         database: string, DB name
         query: string, query to be run
+        pool: ConnectionPool to borrow from, the one shared by the
+            credentials (see get_pool) if not given
     Returns:
-        connection: connect pymysql (error code contained)
+        connection: connect pymysql (error code contained), returned to the
+            pool
     Raises:
     '''
-    connection = pymysql.connect(host='localhost',
-                                 user=user,
-                                 password=password,
-                                 db=database,
-                                 charset='utf8',
-                                 cursorclass=pymysql.cursors.DictCursor,
-                                 local_infile=True)
+    pool = pool or get_pool(user, password, database)
+    with pool.connection() as connection:
+        try:
+            with connection.cursor() as cursor:
+                sql = query
+                cursor.execute(sql)
 
-    try:
-        with connection.cursor() as cursor:
-            sql = query
-            cursor.execute(sql)
-
-        connection.commit()
-    # Future: create separate error handling for pymysql errors
-    except pymysql.err.InternalError as e:
-        code, msg = e.args
-        # if code == 1050:
-        print(msg)
-        return code
-    finally:
-        connection.close()
+            connection.commit()
+        # Future: create separate error handling for pymysql errors
+        except pymysql.err.InternalError as e:
+            code, msg = e.args
+            # if code == 1050:
+            print(msg)
+            return code
     return connection
 
 
-def create_sql_from_json_schema(json_schema):
-    ''' SQL CREATE TABLE statement from json_schema
-    TODO: Expand and add more attribute datatypes
+def iter_insert_statements(connection, table, columns, rows, max_bytes,
+                           update_columns=None):
+    ''' Group rows into multi-row INSERT statements of at most max_bytes
+
+    Args:
+        connection: pymysql connection, escapes the values
+        table: string, table name
+        columns: list of column names
+        rows: iterable of sequences of values in columns order, or of dicts
+        max_bytes: int, maximum size of a statement in utf8 bytes. A single
+            row larger than that still gets a statement of its own
+        update_columns: list of column names, updated from the new row when
+            it has the key of an existing one (ON DUPLICATE KEY UPDATE)
+    Yields:
+        (statement, row count) tuples
+    '''
+    prefix = u'INSERT INTO {0} ({1}) VALUES '.format(
+        _quote_identifier(table),
+        u', '.join(_quote_identifier(column) for column in columns))
+    suffix = u''
+    if update_columns:
+        # VALUES() rather than a row alias, which needs MySQL 8.0.19
+        suffix = u' ON DUPLICATE KEY UPDATE ' + u', '.join(
+            u'{0}=VALUES({0})'.format(_quote_identifier(column))
+            for column in update_columns)
+    budget = max_bytes - len(prefix.encode('utf8')) - \
+        len(suffix.encode('utf8'))
+    escape = connection.escape
+    values = []
+    size = 0
+    for row in rows:
+        if isinstance(row, dict):
+            row = [row.get(column) for column in columns]
+        literal = u'({0})'.format(u','.join([escape(value) for value in row]))
+        # The separating comma included
+        length = len(literal.encode('utf8')) + 1
+        if values and size + length > budget:
+            yield prefix + u','.join(values) + suffix, len(values)
+            values = []
+            size = 0
+        values.append(literal)
+        size += length
+    if values:
+        yield prefix + u','.join(values) + suffix, len(values)
+
+
+def _max_statement_bytes(connection):
+    ''' Statement size fitting the max_allowed_packet of the server '''
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT @@max_allowed_packet AS max_allowed_packet')
+        row = cursor.fetchone()
+    packet = row['max_allowed_packet'] if isinstance(row, dict) else row[0]
+    return min(int(packet) - _PACKET_MARGIN, BULK_INSERT_MAX_BYTES)
+
+
+def bulk_insert(user, password, database, table, columns, rows,
+                max_statement_bytes=None, commit_every=10, pool=None,
+                update_columns=None):
+    ''' Insert rows with batched multi-row INSERT statements.
+
+    An alternative to LOAD DATA LOCAL INFILE for servers with local_infile
+    disabled. Rows are consumed lazily and grouped into statements sized in
+    bytes, so that they stay under max_allowed_packet whatever the row
+    width.
+
+    pymysql has no server-side prepared statements: values are escaped on
+    the client by the connection, which honours the SQL mode of the server.
 
     Args:
-        json_schema: string, forrmatted as JSON schema as f
-        etched with dataset.get_table_schema
+        user: string, DB username
+        password: string, DB password
+        database: string, DB name
+        table: string, table name
+        columns: list of column names
+        rows: iterable of sequences of values in columns order, or of dicts
+        max_statement_bytes: int, maximum size of a statement, by default
+            BULK_INSERT_MAX_BYTES capped by the max_allowed_packet of the
+            server
+        commit_every: int, statements per transaction
+        pool: ConnectionPool to borrow from, see run_query
+        update_columns: list of column names, see iter_insert_statements
+    Returns:
+        inserted: int, number of rows inserted
+    Raises:
+        pymysql.err.Error: the open transaction is rolled back, the batches
+            committed before stay in the table
+    '''
+    pool = pool or get_pool(user, password, database)
+    inserted = 0
+    with pool.connection() as connection:
+        if max_statement_bytes is None:
+            max_statement_bytes = _max_statement_bytes(connection)
+        try:
+            with connection.cursor() as cursor:
+                statements = iter_insert_statements(
+                    connection, table, columns, rows, max_statement_bytes,
+                    update_columns)
+                for batch, (statement, count) in enumerate(statements, 1):
+                    cursor.execute(statement)
+                    inserted += count
+                    if batch % commit_every == 0:
+                        connection.commit()
+            connection.commit()
+        except Exception:
+            if connection.open:
+                connection.rollback()
+            raise
+    return inserted
+
+
+def upsert_rows(user, password, database, table, columns, rows,
+                key_columns, **kwargs):
+    ''' Insert rows, or update the existing rows with the same key.
 
+    Rows are sent as batched INSERT ... ON DUPLICATE KEY UPDATE statements,
+    see bulk_insert. Applying the same rows twice leaves the table as
+    applying them once, so overlapping incremental loads are harmless.
+
+    Args:
+        user, password, database, table, columns, rows: see bulk_insert
+        key_columns: list of the column names of the PRIMARY or UNIQUE key
+            of the table, the other columns are updated
+        **kwargs: max_statement_bytes, commit_every and pool, see
+            bulk_insert
     Returns:
-        sql_create_statement: Str, to be passed to MySQL database engine
+        upserted: int, number of rows inserted or updated
+    '''
+    update_columns = [column for column in columns
+                      if column not in key_columns]
+    # A table of key columns only has nothing to update
+    update_columns = update_columns or list(key_columns[:1])
+    return bulk_insert(user, password, database, table, columns, rows,
+                       update_columns=update_columns, **kwargs)
+
+
+def _load_data_field(value):
+    ''' Format a value for the default LOAD DATA format '''
+    if value is None:
+        return u'\\N'
+    if isinstance(value, bool):
+        return u'1' if value else u'0'
+    if isinstance(value, bytes):
+        value = value.decode('utf8')
+    value = six.text_type(value)
+    if _LOAD_DATA_SPECIALS.search(value):
+        value = _LOAD_DATA_SPECIALS.sub(
+            lambda match: _LOAD_DATA_ESCAPES[match.group()], value)
+    return value
+
+
+def iter_load_data_lines(rows):
+    ''' Format rows as the lines of the default LOAD DATA format
+
+    Fields are separated by tabs and escaped with backslashes, NULL is
+    written as \\N, so every value round trips whatever it contains.
+
+    Args:
+        rows: iterable of sequences of values
+    Yields:
+        lines: unicode, newline terminated
+    '''
+    for row in rows:
+        yield u'\t'.join([_load_data_field(value) for value in row]) + u'\n'
+
+
+def _write_load_data(path, rows, errors, opened=None):
+    ''' Write rows into the file or pipe LOAD DATA reads from '''
+    try:
+        with io.open(path, 'wb', buffering=LOAD_BUFFER_SIZE) as data_file:
+            if opened is not None:
+                opened.set()
+            for line in iter_load_data_lines(rows):
+                data_file.write(line.encode('utf8'))
+    except Exception:
+        errors.append(sys.exc_info())
+    finally:
+        if opened is not None:
+            opened.set()
+
+
+def _release_pipe_writer(path, opened):
+    ''' Let the writer of a pipe finish even if nothing reads the pipe,
+    e.g. when the server failed the statement before reading the data.
+
+    A reader opens the pipe until the writer has opened it too, then closes
+    it, so that the writes left fail instead of blocking.
+    '''
+    reader = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    try:
+        opened.wait()
+    finally:
+        os.close(reader)
+
+
+def load_rows(user, password, database, table, rows, columns=None,
+              pool=None):
+    ''' Stream rows into a table with LOAD DATA LOCAL INFILE.
 
+    Rows are formatted by a writer thread into a named pipe that pymysql
+    sends as the local file, so decompression, transformation and loading
+    run as one pass without staging a file on disk. Memory is bounded by
+    the pipe and LOAD_BUFFER_SIZE whatever the number of rows. Where named
+    pipes are not available, the rows are staged in a temporary file.
+
+    The load runs in a transaction: if ``rows`` raises, the rows sent so
+    far are rolled back (on transactional engines such as InnoDB).
+
+    Args:
+        user: string, DB username
+        password: string, DB password
+        database: string, DB name
+        table: string, table name
+        rows: iterable of sequences of values, None for NULL
+        columns: list of column names the values map to, all the columns
+            of the table in order if not given
+        pool: ConnectionPool to borrow from, see run_query
+    Returns:
+        loaded: int, number of rows loaded
+    Raises:
+        pymysql.err.Error, or the exception raised by rows
     '''
-    attributes = []
-    sql_create_statement = 'CREATE TABLE `temps` ('
-    for j in json_schema:
-        datatype = j['type']
-        name = j['name']
-        is_null = True if j['mode'] == 'NULLABLE' else False
-        if datatype == 'STRING':
-            datatype = 'VARCHAR(10)'
-        elif datatype == 'INTEGER':
-            datatype = 'INTEGER'
-        elif datatype == 'FLOAT':
-            datatype = 'DOUBLE'
-        elif datatype == 'DATE':
-            datatype = 'DATE'
+    pool = pool or get_pool(user, password, database)
+    directory = tempfile.mkdtemp(prefix='load_data_')
+    path = os.path.join(directory, 'rows.tsv')
+    errors = []
+    writer = None
+    opened = threading.Event()
+    try:
+        if hasattr(os, 'mkfifo'):
+            os.mkfifo(path)
+            writer = threading.Thread(target=_write_load_data,
+                                      args=(path, rows, errors, opened),
+                                      name='load-data-writer')
+            writer.daemon = True
+            writer.start()
         else:
-            datatype = 'TEXT'
+            _write_load_data(path, rows, errors)
+            if errors:
+                six.reraise(*errors[0])
+
+        with pool.connection() as connection:
+            sql = (u"LOAD DATA LOCAL INFILE {0} INTO TABLE {1} "
+                   u"CHARACTER SET 'utf8' FIELDS TERMINATED BY '\\t' "
+                   u"ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'").format(
+                connection.escape(path), _quote_identifier(table))
+            if columns:
+                sql += u' ({0})'.format(u', '.join(
+                    _quote_identifier(column) for column in columns))
+            try:
+                with connection.cursor() as cursor:
+                    loaded = cursor.execute(sql)
+            except Exception:
+                if connection.open:
+                    connection.rollback()
+                raise
+            finally:
+                if writer is not None:
+                    _release_pipe_writer(path, opened)
+                    writer.join()
+            if errors:
+                connection.rollback()
+                six.reraise(*errors[0])
+            connection.commit()
+        return loaded
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def shadow_table_name(table):
+    ''' Name of the table loaded by atomic_load before it replaces table '''
+    return table + SHADOW_SUFFIX
+
+
+def previous_table_name(table):
+    ''' Name of the generation of table replaced by publish_shadow_table '''
+    return table + PREVIOUS_SUFFIX
+
+
+def _table_statement(statement, table):
+    return statement.replace(TABLE_PLACEHOLDER, table)
+
+
+def _existing_tables(cursor, tables):
+    cursor.execute(
+        u'SELECT table_name AS name FROM information_schema.tables '
+        u'WHERE table_schema = DATABASE() AND table_name IN ({0})'.format(
+            u', '.join([u'%s'] * len(tables))), list(tables))
+    return set(row['name'] for row in cursor.fetchall())
 
-        attribute_declaration = ' `%s` %s %s' % (name, datatype, '' if is_null else 'NOT NULL')
-        attributes.append(attribute_declaration)
-    sql_create_statement += (',').join(attributes)
-    sql_create_statement += ') DEFAULT CHARSET=utf8 ;'
-    return sql_create_statement
+
+def create_shadow_table(user, password, database, table, create_statement,
+                        pool=None):
+    ''' Create the empty shadow table of table, see atomic_load. A shadow
+    table left over by a failed load is dropped first.
+
+    Args:
+        user: string, DB username
+        password: string, DB password
+        database: string, DB name
+        table: string, the table the shadow table will replace
+        create_statement: string, CREATE TABLE statement with
+            TABLE_PLACEHOLDER in place of the table name
+        pool: ConnectionPool to borrow from, see run_query
+    Returns:
+        shadow: string, name of the shadow table to load
+    Raises:
+        pymysql.err.Error
+    '''
+    pool = pool or get_pool(user, password, database)
+    shadow = shadow_table_name(table)
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(u'DROP TABLE IF EXISTS {0}'.format(
+                _quote_identifier(shadow)))
+            cursor.execute(_table_statement(create_statement, shadow))
+    return shadow
+
+
+def publish_shadow_table(user, password, database, table,
+                         index_statements=(), keep_previous=False, pool=None):
+    ''' Index the loaded shadow table of table and swap it in.
+
+    The secondary indexes are built once over the loaded rows, which is
+    much cheaper than maintaining them row by row during the load. The
+    live table and the shadow table are then exchanged by a single RENAME
+    TABLE statement, atomic for the readers of table: they see the
+    previous generation until the new one is complete.
+
+    Args:
+        user: string, DB username
+        password: string, DB password
+        database: string, DB name
+        table: string, the table to replace
+        index_statements: list of CREATE INDEX statements with
+            TABLE_PLACEHOLDER in place of the table name, e.g. from
+            schema_module.create_index_sql
+        keep_previous: bool, keep the replaced generation as
+            previous_table_name(table) for rollback_table. An older kept
+            generation is dropped.
+        pool: ConnectionPool to borrow from, see run_query
+    Raises:
+        pymysql.err.Error
+    '''
+    pool = pool or get_pool(user, password, database)
+    shadow = shadow_table_name(table)
+    previous = previous_table_name(table)
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            for statement in index_statements:
+                cursor.execute(_table_statement(statement, shadow))
+            existing = _existing_tables(cursor, [table, previous])
+            if previous in existing:
+                cursor.execute(u'DROP TABLE {0}'.format(
+                    _quote_identifier(previous)))
+            if table not in existing:
+                cursor.execute(u'RENAME TABLE {0} TO {1}'.format(
+                    _quote_identifier(shadow), _quote_identifier(table)))
+                return
+            cursor.execute(u'RENAME TABLE {0} TO {1}, {2} TO {0}'.format(
+                _quote_identifier(table), _quote_identifier(previous),
+                _quote_identifier(shadow)))
+            if not keep_previous:
+                cursor.execute(u'DROP TABLE {0}'.format(
+                    _quote_identifier(previous)))
+
+
+def rollback_table(user, password, database, table, pool=None):
+    ''' Swap table with the generation kept by publish_shadow_table, in a
+    single RENAME TABLE. Rolling back twice restores the newer generation.
+
+    Args:
+        user: string, DB username
+        password: string, DB password
+        database: string, DB name
+        table: string, the table to roll back
+        pool: ConnectionPool to borrow from, see run_query
+    Raises:
+        pymysql.err.Error, e.g. if no previous generation was kept
+    '''
+    pool = pool or get_pool(user, password, database)
+    table, previous, swap = [_quote_identifier(name) for name in (
+        table, previous_table_name(table), table + u'__swap')]
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                u'RENAME TABLE {0} TO {2}, {1} TO {0}, {2} TO {1}'.format(
+                    table, previous, swap))
+
+
+def atomic_load(user, password, database, table, create_statement, rows,
+                index_statements=(), columns=None, keep_previous=False,
+                pool=None):
+    ''' Replace the content of a table without a window where it is
+    missing or partly loaded, unlike dropping and re-creating it.
+
+    The rows are loaded with load_rows into a shadow table created without
+    its secondary indexes (see create_shadow_table), which are built after
+    the load before the shadow table is swapped in (see
+    publish_shadow_table). If the load fails the shadow table is dropped
+    and table is left untouched.
+
+    Args:
+        user: string, DB username
+        password: string, DB password
+        database: string, DB name
+        table: string, the table to replace
+        create_statement: string, see create_shadow_table
+        rows: iterable of sequences of values, see load_rows
+        index_statements: list of strings, see publish_shadow_table
+        columns: list of column names, see load_rows
+        keep_previous: bool, see publish_shadow_table
+        pool: ConnectionPool to borrow from, see run_query
+    Returns:
+        loaded: int, number of rows loaded
+    Raises:
+        pymysql.err.Error, or the exception raised by rows
+    '''
+    pool = pool or get_pool(user, password, database)
+    shadow = create_shadow_table(user, password, database, table,
+                                 create_statement, pool=pool)
+    try:
+        loaded = load_rows(user, password, database, shadow, rows, columns,
+                           pool=pool)
+        publish_shadow_table(user, password, database, table,
+                             index_statements, keep_previous, pool=pool)
+    except Exception:
+        exc_info = sys.exc_info()
+        try:
+            with pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(u'DROP TABLE IF EXISTS {0}'.format(
+                        _quote_identifier(shadow)))
+        except pymysql.err.Error:
+            pass
+        six.reraise(*exc_info)
+    return loaded
+
+
+def create_sql_from_json_schema(json_schema, table_name='temps',
+                                varchar_sizes=None, primary_key=None):
+    ''' SQL CREATE TABLE statement from json_schema, see
+    schema_module.create_table_sql for the type mapping
+
+    Args:
+        json_schema: list of schema fields as fetched with
+        dataset.get_table_schema
+        table_name: String, the table to create
+        varchar_sizes: dict, column name -> VARCHAR length, as returned by
+        schema_module.sample_varchar_sizes
+        primary_key: list of column names
+
+    Returns:
+        sql_create_statement: Str, to be passed to MySQL database engine
+
+    '''
+    return create_table_sql(table_name, json_schema, varchar_sizes,
+                            primary_key)
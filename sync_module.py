@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""Incremental sync of BigQuery tables to MySQL with high-water marks.
+
+Instead of dropping and reloading the MySQL table, every run queries the
+rows past the watermark of the previous run and upserts them, so a run
+costs in proportion to the rows that changed.
+"""
+import json
+import os
+import threading
+from collections import namedtuple
+from datetime import date, datetime
+from itertools import chain
+from time import time
+
+import six
+
+from sql_module import upsert_rows
+
+# Kinds of watermark columns:
+#  - timestamp: a TIMESTAMP column, e.g. a modification time
+#  - date: a DATE column
+#  - id: an ever increasing INTEGER column
+#  - table_suffix: the _TABLE_SUFFIX of a wildcard table, e.g. gsod*
+WATERMARK_KINDS = ('timestamp', 'date', 'id', 'table_suffix')
+
+# Column holding _TABLE_SUFFIX in the result of a delta query
+TABLE_SUFFIX_COLUMN = '_table_suffix'
+
+
+class Watermark(namedtuple('Watermark', ['column', 'kind'])):
+    """The watermark column of a source table and its kind, see
+    WATERMARK_KINDS. The column of a table_suffix watermark is ignored."""
+    __slots__ = ()
+
+    def __new__(cls, column, kind='timestamp'):
+        assert kind in WATERMARK_KINDS, \
+            'kind must be one of {0}'.format(', '.join(WATERMARK_KINDS))
+        return super(Watermark, cls).__new__(cls, column, kind)
+
+    @property
+    def result_column(self):
+        """Column of the delta query result holding the watermark"""
+        return TABLE_SUFFIX_COLUMN if self.kind == 'table_suffix' \
+            else self.column
+
+
+class WatermarkStore(object):
+    """Thread-safe JSON file of the high-water mark of every synced table.
+
+    Args:
+        path: String, the state file, created on the first update
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {}
+        if os.path.exists(path):
+            with open(path, 'r') as state_file:
+                self._state = json.load(state_file)
+
+    def get(self, key):
+        """Return the watermark of a table, or None before its first sync"""
+        with self._lock:
+            entry = self._state.get(key)
+            return entry['value'] if entry else None
+
+    def set(self, key, value):
+        """Record the watermark of a table, see watermark_value"""
+        with self._lock:
+            self._state[key] = {'value': value, 'updated': time()}
+            self._save()
+
+    def reset(self, key):
+        """Forget the watermark of a table, its next sync is a full one"""
+        with self._lock:
+            if self._state.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as state_file:
+            json.dump(self._state, state_file, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+
+def watermark_value(value):
+    """Return the JSON serializable form of a watermark column value"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _string_literal(value):
+    return u"'{0}'".format(six.text_type(value).replace(u'\\', u'\\\\')
+                           .replace(u"'", u"\\'"))
+
+
+def watermark_condition(watermark, value):
+    """Return the standard SQL condition selecting the rows past a
+    watermark, to add to the WHERE clause of a custom query.
+
+    Rows at the watermark itself are selected again, except for ``id``
+    watermarks: rows written later with the same timestamp, or appended
+    to the last table of a wildcard table, are not missed, and upserting
+    them again is harmless.
+
+    Args:
+        watermark: Watermark
+        value: the watermark of the previous sync, see WatermarkStore
+
+    Returns:
+        String, e.g. ``_TABLE_SUFFIX >= '2017'``
+    """
+    if watermark.kind == 'table_suffix':
+        return u'_TABLE_SUFFIX >= {0}'.format(_string_literal(value))
+    column = u'`{0}`'.format(watermark.column)
+    if watermark.kind == 'id':
+        return u'{0} > {1}'.format(column, int(value))
+    literal_type = 'TIMESTAMP' if watermark.kind == 'timestamp' else 'DATE'
+    return u'{0} >= {1} {2}'.format(column, literal_type,
+                                    _string_literal(value))
+
+
+def delta_query(source, watermark, value=None, columns=None):
+    """Return the query of the rows of a table past a watermark, e.g. for
+    BigQueryClient.write_to_table or query_rows.
+
+    Args:
+        source: String, the source table as ``project.dataset.table``, a
+        wildcard table for table_suffix watermarks
+        watermark: Watermark
+        value: the watermark of the previous sync, None for a full sync
+        columns: list of column names, all by default
+
+    Returns:
+        String, a standard SQL query. The result of table_suffix watermarks
+        has an extra TABLE_SUFFIX_COLUMN.
+    """
+    select = u', '.join(u'`{0}`'.format(column) for column in columns) \
+        if columns else u'*'
+    if watermark.kind == 'table_suffix':
+        select += u', _TABLE_SUFFIX AS {0}'.format(TABLE_SUFFIX_COLUMN)
+    query = u'#standardSQL\nSELECT {0} FROM `{1}`'.format(select, source)
+    if value is not None:
+        query += u'\nWHERE {0}'.format(watermark_condition(watermark, value))
+    return query
+
+
+class SyncResult(namedtuple('SyncResult', ['rows', 'previous',
+                                           'watermark'])):
+    """Rows upserted by a sync, the watermark before and after it"""
+    __slots__ = ()
+
+
+def sync_table(bq_client, store, source, watermark, user, password, database,
+               table, key_columns, columns=None, state_key=None, timeout=600,
+               **kwargs):
+    """Upsert the rows of a BigQuery table past the last watermark into a
+    MySQL table.
+
+    The delta query runs with ``bq_client.query_rows``, bypassing its
+    query cache: a cached result would miss the rows that arrived since.
+    Its rows are upserted as they are read, and the new watermark, the
+    highest value read, is only recorded once every row is in. A failed run
+    is retried from the previous watermark.
+
+    Args:
+        bq_client: BigQueryClient
+        store: WatermarkStore
+        source: String, see delta_query
+        watermark: Watermark
+        user: string, DB username
+        password: string, DB password
+        database: string, DB name
+        table: string, the MySQL table, with a PRIMARY or UNIQUE key on
+        ``key_columns``
+        key_columns: list of column names, see sql_module.upsert_rows
+        columns: list of column names to sync, all by default
+        state_key: String, key of the watermark in the store,
+        ``database.table`` by default
+        timeout: float, seconds to wait for the query
+        **kwargs: see sql_module.bulk_insert
+
+    Returns:
+        SyncResult
+    """
+    state_key = state_key or u'{0}.{1}'.format(database, table)
+    previous = store.get(state_key)
+    query_columns = columns
+    if columns and watermark.kind != 'table_suffix' and \
+            watermark.column not in columns:
+        query_columns = list(columns) + [watermark.column]
+    rows = bq_client.query_rows(delta_query(source, watermark, previous,
+                                            query_columns), timeout=timeout,
+                                use_cache=False)
+    first = next(rows, None)
+    if first is None:
+        return SyncResult(0, previous, previous)
+    names = list(columns) if columns else \
+        [name for name in first if name != TABLE_SUFFIX_COLUMN]
+    highest = [None]
+
+    def tracked():
+        for row in chain([first], rows):
+            value = row[watermark.result_column]
+            if value is not None and (highest[0] is None or
+                                      value > highest[0]):
+                highest[0] = value
+            yield [row[name] for name in names]
+
+    upserted = upsert_rows(user, password, database, table, names,
+                           tracked(), key_columns, **kwargs)
+    current = previous
+    if highest[0] is not None:
+        current = watermark_value(highest[0])
+        store.set(state_key, current)
+    return SyncResult(upserted, previous, current)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+import asyncio
+import itertools
+import unittest
+
+try:
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from async_bq_module import AsyncBigQueryClient
+except ImportError:  # aiohttp is optional
+    web = None
+
+from bq_module import (
+    BigQueryTimeoutException, JobExecutingException, JobInsertException
+)
+from polling_module import FixedIntervalPolling
+
+
+class FakeBigQueryServer(object):
+    """Local fake of the BigQuery REST API.
+
+    Jobs are DONE after ``polls_until_done`` status requests.
+    """
+
+    def __init__(self, polls_until_done=2):
+        self.polls_until_done = polls_until_done
+        self.jobs = {}
+        self.polls = {}
+        self.inserted = []
+        self.headers = []
+        self.tables = {}
+        self.datasets = {}
+        self.job_counter = itertools.count()
+        self.app = web.Application()
+        self.app.router.add_post('/projects/{project}/jobs', self.insert_job)
+        self.app.router.add_get('/projects/{project}/jobs/{job}', self.get_job)
+        self.app.router.add_get('/projects/{project}/datasets/{dataset}',
+                                self.get_dataset)
+        self.app.router.add_get(
+            '/projects/{project}/datasets/{dataset}/tables/{table}',
+            self.get_table)
+
+    async def insert_job(self, request):
+        body = await request.json()
+        self.headers.append(request.headers.get('Authorization'))
+        self.inserted.append(body)
+        job_id = body.get('jobReference', {}).get('jobId') or \
+            'job_{0}'.format(next(self.job_counter))
+        job = {'jobReference': {'jobId': job_id},
+               'configuration': body['configuration'],
+               'status': {'state': 'RUNNING'}}
+        if 'fail' in body['configuration'].get('query', {}).get('query', ''):
+            job['status']['errorResult'] = {'reason': 'invalidQuery',
+                                            'message': 'Syntax error'}
+        self.jobs[job_id] = job
+        return web.json_response(job)
+
+    async def get_job(self, request):
+        job_id = request.match_info['job']
+        job = self.jobs[job_id]
+        self.polls[job_id] = self.polls.get(job_id, 0) + 1
+        if self.polls[job_id] >= self.polls_until_done:
+            job['status']['state'] = 'DONE'
+        return web.json_response(job)
+
+    async def get_dataset(self, request):
+        dataset = request.match_info['dataset']
+        if dataset not in self.datasets:
+            raise web.HTTPNotFound()
+        return web.json_response(self.datasets[dataset])
+
+    async def get_table(self, request):
+        key = (request.match_info['dataset'], request.match_info['table'])
+        if key not in self.tables:
+            raise web.HTTPNotFound()
+        return web.json_response(self.tables[key])
+
+
+@unittest.skipIf(web is None, 'aiohttp is not installed')
+class TestAsyncBigQueryClient(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.fake = FakeBigQueryServer()
+        self.server = TestServer(self.fake.app)
+        await self.server.start_server()
+
+        async def token_provider():
+            return 'token'
+
+        self.client = AsyncBigQueryClient(
+            'project', token_provider=token_provider,
+            base_url=str(self.server.make_url('')))
+        self.polling = FixedIntervalPolling(0.01)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.server.close()
+
+    async def test_write_and_wait(self):
+        """Ensure a query job is submitted and waited for"""
+        job = await self.client.write_to_table('SELECT 1', 'd', 't')
+        done = await self.client.wait_for_job(job, polling=self.polling)
+
+        self.assertEqual(done['status']['state'], 'DONE')
+        self.assertEqual(self.fake.inserted[0]['configuration']['query'][
+            'destinationTable'],
+            {'projectId': 'project', 'datasetId': 'd', 'tableId': 't'})
+        self.assertEqual(self.fake.headers, ['Bearer token'])
+
+    async def test_many_jobs_in_flight(self):
+        """Ensure many jobs are waited for concurrently on one loop"""
+        self.fake.polls_until_done = 5
+        jobs = await asyncio.gather(*[
+            self.client.write_to_table('SELECT %d' % i) for i in range(100)])
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        done = await asyncio.gather(*[
+            self.client.wait_for_job(job, polling=FixedIntervalPolling(0.05))
+            for job in jobs])
+
+        self.assertEqual(len(done), 100)
+        # Sequential waits would take at least 100 * 4 * 0.05 = 20 s
+        self.assertLess(loop.time() - start, 5)
+
+    async def test_export(self):
+        """Ensure extract jobs use the shared body builder"""
+        job = await self.client.export_data_to_uris(
+            'gs://bucket/file-*.csv', 'd', 't', job='export',
+            compression='GZIP')
+
+        self.assertEqual(job['jobReference']['jobId'], 'export')
+        self.assertEqual(
+            self.fake.inserted[0]['configuration']['extract'][
+                'destinationUris'], ['gs://bucket/file-*.csv'])
+
+    async def test_job_errors(self):
+        """Ensure insert and execution errors raise the sync exceptions"""
+        self.fake.jobs['broken'] = {'status': {
+            'state': 'DONE', 'errorResult': {'reason': 'r', 'message': 'm'}}}
+
+        with self.assertRaises(JobInsertException):
+            await self.client.write_to_table('fail')
+        with self.assertRaises(JobExecutingException):
+            await self.client.wait_for_job('broken', polling=self.polling)
+
+    async def test_timeout(self):
+        """Ensure the wait gives up at the deadline"""
+        self.fake.polls_until_done = 1000
+        job = await self.client.write_to_table('SELECT 1')
+
+        with self.assertRaises(BigQueryTimeoutException):
+            await self.client.wait_for_job(job, timeout=0.1,
+                                           polling=self.polling)
+
+    async def test_metadata(self):
+        """Ensure missing tables and datasets map like the sync client"""
+        fields = [{'name': 'state', 'type': 'STRING', 'mode': 'NULLABLE'}]
+        self.fake.tables[('d', 't')] = {'schema': {'fields': fields}}
+        self.fake.datasets['d'] = {'id': 'project:d'}
+
+        self.assertEqual(await self.client.get_table_schema('d', 't'), fields)
+        self.assertIsNone(await self.client.get_table_schema('d', 'missing'))
+        self.assertEqual(await self.client.get_dataset('d'),
+                         {'id': 'project:d'})
+        self.assertEqual(await self.client.get_dataset('missing'), {})
@@ -0,0 +1,589 @@
+#!/usr/bin/env python
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+import mock
+from googleapiclient.errors import HttpError
+
+import bq_module
+from bq_module import (
+    BigQueryClient, BigQueryTimeoutException, JobExecutingException,
+    MultipleJobsException
+)
+from cache_module import QueryResultCache
+from polling_module import FixedIntervalPolling
+
+
+class HttpResponse(dict):
+    def __init__(self, status, reason='There was an error'):
+        """
+        Args:
+            :param int status: Integer HTTP response status
+        """
+        super(HttpResponse, self).__init__(status=str(status))
+        self.status = status
+        self.reason = reason
+
+
+class FakeBatch(object):
+    """Stand-in for googleapiclient's BatchHttpRequest.
+
+    Every added request is a callable returning the response or raising an
+    exception, mirroring what the real batch hands to the callback.
+    """
+
+    instances = []
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+        FakeBatch.instances.append(self)
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request(), None)
+            except HttpError as e:
+                self.callback(request_id, None, e)
+
+
+class FakeJobs(object):
+    """Fake ``jobs()`` collection returning scripted states per job id"""
+
+    def __init__(self, states):
+        self.states = dict((job_id, list(s)) for job_id, s in states.items())
+
+    def get(self, projectId, jobId):
+        def request():
+            states = self.states[jobId]
+            state = states.pop(0) if len(states) > 1 else states[0]
+            if isinstance(state, Exception):
+                raise state
+            if isinstance(state, dict):
+                return state
+            return {'status': {'state': state},
+                    'jobReference': {'jobId': jobId}}
+        return request
+
+
+class BatchedClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        FakeBatch.instances = []
+        self.api_mock = mock.Mock()
+        self.api_mock.new_batch_http_request.side_effect = \
+            lambda callback: FakeBatch(callback)
+        self.client = BigQueryClient(self.api_mock, 'project')
+
+        self.now = [0.0]
+        for name, fake in (('sleep', self._sleep), ('time', self._time)):
+            patcher = mock.patch.object(bq_module, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _sleep(self, seconds):
+        self.now[0] += seconds
+
+    def _time(self):
+        return self.now[0]
+
+
+class TestWaitForJobs(BatchedClientTestCase):
+
+    def test_yields_in_completion_order(self):
+        """Ensure jobs are yielded as soon as each of them is done"""
+        self.api_mock.jobs.return_value = FakeJobs({
+            'slow': ['RUNNING', 'RUNNING', 'DONE'],
+            'fast': ['DONE'],
+            'medium': ['RUNNING', 'DONE'],
+        })
+
+        done = [j['jobReference']['jobId'] for j in self.client.wait_for_jobs(
+            ['slow', {'jobReference': {'jobId': 'fast'}}, 'medium'],
+            polling=FixedIntervalPolling(1))]
+
+        self.assertEqual(done, ['fast', 'medium', 'slow'])
+
+    def test_one_batch_per_tick(self):
+        """Ensure all pending jobs are checked with a single batch per tick"""
+        self.api_mock.jobs.return_value = FakeJobs({
+            'a': ['RUNNING', 'DONE'], 'b': ['RUNNING', 'DONE']})
+
+        list(self.client.wait_for_jobs(['a', 'b'],
+                                       polling=FixedIntervalPolling(1)))
+
+        self.assertEqual(len(FakeBatch.instances), 2)
+        self.assertEqual([len(b.requests) for b in FakeBatch.instances],
+                         [2, 2])
+
+    def test_batches_are_chunked(self):
+        """Ensure batches never exceed the API batch limit"""
+        job_ids = ['job%d' % i for i in range(5)]
+        self.api_mock.jobs.return_value = FakeJobs(
+            dict((job_id, ['DONE']) for job_id in job_ids))
+
+        with mock.patch.object(bq_module, 'BATCH_REQUEST_LIMIT', 2):
+            done = list(self.client.wait_for_jobs(job_ids))
+
+        self.assertEqual(len(done), 5)
+        self.assertEqual([len(b.requests) for b in FakeBatch.instances],
+                         [2, 2, 1])
+
+    def test_errors_are_aggregated(self):
+        """Ensure failures and timeouts are collected and raised at the end"""
+        self.api_mock.jobs.return_value = FakeJobs({
+            'ok': ['RUNNING', 'DONE'],
+            'failed': [{'status': {'state': 'DONE', 'errorResult': {
+                'reason': 'invalidQuery', 'message': 'Syntax error'}}}],
+            'gone': [HttpError(HttpResponse(404), b'Not found')],
+            'stuck': ['RUNNING'],
+        })
+
+        done = []
+        with self.assertRaises(MultipleJobsException) as ctx:
+            for job in self.client.wait_for_jobs(
+                    ['ok', 'failed', 'gone', 'stuck'],
+                    timeout={'stuck': 3},
+                    polling=FixedIntervalPolling(1)):
+                done.append(job['jobReference']['jobId'])
+
+        errors = ctx.exception.errors
+        self.assertEqual(done, ['ok'])
+        self.assertEqual(list(errors), ['failed', 'gone', 'stuck'])
+        self.assertIsInstance(errors['failed'], JobExecutingException)
+        self.assertIn('invalidQuery', str(errors['failed']))
+        self.assertIsInstance(errors['gone'], JobExecutingException)
+        self.assertIsInstance(errors['stuck'], BigQueryTimeoutException)
+        self.assertEqual(self.now[0], 3)
+
+
+class FakeMetadataCollection(object):
+    """Fake ``tables()``/``datasets()`` collection backed by a dict"""
+
+    def __init__(self, resources):
+        self.resources = resources
+
+    def get(self, projectId, datasetId, tableId=None):
+        key = (datasetId, tableId) if tableId else datasetId
+
+        def request():
+            if key not in self.resources:
+                raise HttpError(HttpResponse(404), b'Not found')
+            resource = self.resources[key]
+            if isinstance(resource, Exception):
+                raise resource
+            return resource
+        return request
+
+
+class TestBatchedMetadata(BatchedClientTestCase):
+
+    def test_get_table_schemas(self):
+        """Ensure schemas are fetched in one batch and 404s map to None"""
+        fields = [{'type': 'FLOAT', 'name': 'max_celsius', 'mode': 'NULLABLE'}]
+        self.api_mock.tables.return_value = FakeMetadataCollection({
+            ('my_data', 'my_table'): {'schema': {'fields': fields}}})
+
+        schemas = self.client.get_table_schemas(
+            [('my_data', 'my_table'), ('my_data', 'missing')])
+
+        self.assertEqual(schemas, {('my_data', 'my_table'): fields,
+                                   ('my_data', 'missing'): None})
+        self.assertEqual(len(FakeBatch.instances), 1)
+
+    def test_get_table_schemas_chunked(self):
+        """Ensure large lookups are split to stay within the batch limit"""
+        tables = [('d', 't%d' % i) for i in range(7)]
+        self.api_mock.tables.return_value = FakeMetadataCollection(
+            dict((t, {'schema': {'fields': []}}) for t in tables))
+
+        with mock.patch.object(bq_module, 'BATCH_REQUEST_LIMIT', 3):
+            schemas = self.client.get_table_schemas(tables)
+
+        self.assertEqual(len(schemas), 7)
+        self.assertEqual([len(b.requests) for b in FakeBatch.instances],
+                         [3, 3, 1])
+
+    def test_get_table_schemas_other_error(self):
+        """Ensure errors other than 404 are raised"""
+        self.api_mock.tables.return_value = FakeMetadataCollection({
+            ('d', 't'): HttpError(HttpResponse(500), b'Backend error')})
+
+        self.assertRaises(HttpError, self.client.get_table_schemas,
+                          [('d', 't')])
+
+    def test_get_datasets(self):
+        """Ensure datasets are fetched in one batch, missing ones are empty"""
+        self.api_mock.datasets.return_value = FakeMetadataCollection({
+            'my_data': {'id': 'project:my_data'}})
+
+        datasets = self.client.get_datasets(['my_data', 'missing'])
+
+        self.assertEqual(datasets, {'my_data': {'id': 'project:my_data'},
+                                    'missing': {}})
+        self.assertEqual(len(FakeBatch.instances), 1)
+
+
+class TestShardedExport(BatchedClientTestCase):
+
+    def setUp(self):
+        super(TestShardedExport, self).setUp()
+        self.inserted = []
+
+        def insert(projectId, body):
+            self.inserted.append(body)
+            request = mock.Mock()
+            request.execute.return_value = dict(body, status={
+                'state': 'RUNNING'})
+            return request
+        self.api_mock.jobs().insert.side_effect = insert
+
+    def export(self, num_bytes, **kwargs):
+        self.api_mock.tables.return_value = FakeMetadataCollection({
+            ('my_data', 'my_table'): {'numBytes': str(num_bytes)}})
+        job = self.client.export_sharded('gs://bucket/app1', 'my_data',
+                                         'my_table', **kwargs)
+        return job['configuration']['extract']
+
+    def test_small_table(self):
+        """Ensure a small table is exported to a single gzip wildcard URI"""
+        extract = self.export(1000)
+
+        self.assertEqual(extract['destinationUris'],
+                         ['gs://bucket/app1-*.csv.gz'])
+        self.assertEqual(extract['compression'], 'GZIP')
+
+    def test_uris_from_size(self):
+        """Ensure one wildcard URI per bytes_per_uri, up to the maximum"""
+        extract = self.export(2500, bytes_per_uri=1000,
+                              destination_format='AVRO')
+
+        self.assertEqual(extract['destinationUris'], [
+            'gs://bucket/app1-0-*.avro', 'gs://bucket/app1-1-*.avro',
+            'gs://bucket/app1-2-*.avro'])
+        self.assertEqual(extract['compression'], 'DEFLATE')
+        self.assertEqual(extract['destinationFormat'], 'AVRO')
+
+        with mock.patch.object(bq_module, 'MAX_EXPORT_URIS', 2):
+            extract = self.export(10 ** 6, bytes_per_uri=1000)
+        self.assertEqual(len(extract['destinationUris']), 2)
+
+    def test_no_compression(self):
+        """Ensure compression can be turned off"""
+        extract = self.export(1000, compression='NONE')
+
+        self.assertEqual(extract['destinationUris'],
+                         ['gs://bucket/app1-*.csv'])
+        self.assertNotIn('compression', extract)
+
+    def test_missing_table(self):
+        """Ensure a missing table is reported before any job is submitted"""
+        self.api_mock.tables.return_value = FakeMetadataCollection({})
+
+        self.assertRaises(bq_module.TableNotFoundException,
+                          self.client.export_sharded, 'gs://bucket/app1',
+                          'my_data', 'missing')
+        self.assertEqual(self.inserted, [])
+
+
+class TestConnectClient(unittest.TestCase):
+
+    def setUp(self):
+        bq_module.clear_client_cache()
+        self.addCleanup(bq_module.clear_client_cache)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.key_file = os.path.join(self.tmp_dir, 'key.json')
+        self.json_key = {'project_id': 'project', 'client_email': 'mail',
+                         'private_key': 'pkey'}
+        with open(self.key_file, 'w') as key_file:
+            json.dump(self.json_key, key_file)
+
+        self.mock_cred = mock.Mock()
+        for name, value in (
+                ('_credentials', mock.Mock(return_value=self.mock_cred)),
+                ('build', mock.Mock()),
+                ('build_from_document', mock.Mock()),
+                ('_load_discovery_document', mock.Mock(return_value=None))):
+            patcher = mock.patch.object(bq_module, name, value)
+            setattr(self, 'mock_' + name.lstrip('_'), patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_service_is_cached(self):
+        """Ensure keys, credentials and services are built once per key"""
+        first = bq_module.connect_client(self.key_file)
+        second = bq_module.connect_client(self.key_file)
+
+        self.assertIs(first.bigquery, second.bigquery)
+        self.assertEqual(first.project_id, 'project')
+        self.mock_cred.from_json_keyfile_dict.assert_called_once_with(
+            self.json_key, scopes='https://www.googleapis.com/auth/bigquery')
+        self.assertEqual(self.mock_build.call_count, 1)
+
+    def test_cache_is_per_scope(self):
+        """Ensure a different scope gets its own credentials and service"""
+        bq_module.connect_client(self.key_file)
+        bq_module.get_service(self.key_file, 'other-scope', 'storage', 'v1')
+
+        self.assertEqual(self.mock_cred.from_json_keyfile_dict.call_count, 2)
+        self.assertEqual(self.mock_build.call_count, 2)
+
+    def test_use_cache_false(self):
+        """Ensure the caches can be bypassed"""
+        self.mock_build.side_effect = lambda *args, **kwargs: mock.Mock()
+        cached = bq_module.connect_client(self.key_file)
+        uncached = bq_module.connect_client(self.key_file, use_cache=False)
+
+        self.assertEqual(self.mock_build.call_count, 2)
+        self.assertIsNot(uncached.bigquery, cached.bigquery)
+        # The uncached service does not replace the shared one
+        self.assertIs(bq_module.connect_client(self.key_file).bigquery,
+                      cached.bigquery)
+        self.assertEqual(self.mock_build.call_count, 2)
+
+    def test_local_discovery_document(self):
+        """Ensure a local discovery document avoids the network fetch"""
+        self.mock_load_discovery_document.return_value = '{}'
+
+        client = bq_module.connect_client(self.key_file)
+
+        self.assertFalse(self.mock_build.called)
+        self.mock_build_from_document.assert_called_once_with(
+            '{}', http=self.mock_cred.from_json_keyfile_dict.return_value
+            .authorize.return_value)
+        self.assertIs(client.bigquery,
+                      self.mock_build_from_document.return_value)
+
+    def test_fetched_document_is_saved(self):
+        """Ensure a fetched discovery document is written to the cache dir"""
+        cache_dir = os.path.join(self.tmp_dir, 'discovery')
+        self.mock_build.return_value._rootDesc = {'name': 'bigquery'}
+
+        bq_module.connect_client(self.key_file, discovery_cache_dir=cache_dir)
+
+        with open(os.path.join(cache_dir, 'bigquery.v2.json')) as document:
+            self.assertEqual(json.load(document), {'name': 'bigquery'})
+
+
+class TestReadRows(unittest.TestCase):
+
+    def setUp(self):
+        self.api_mock = mock.Mock()
+        self.client = BigQueryClient(self.api_mock, 'project')
+        self.fields = [
+            {'type': 'FLOAT', 'name': 'max_celsius', 'mode': 'NULLABLE'},
+            {'type': 'STRING', 'name': 'state', 'mode': 'NULLABLE'}]
+        self.pages = [
+            {'rows': [{'f': [{'v': '40.5'}, {'v': 'CA'}]}], 'pageToken': 'p1'},
+            {'rows': [{'f': [{'v': None}, {'v': 'NV'}]}]},
+        ]
+
+    def test_read_table_rows(self):
+        """Ensure table rows are paged and decoded with the table schema"""
+        self.api_mock.tables().get().execute.return_value = \
+            {'schema': {'fields': self.fields}}
+        self.api_mock.tabledata().list().execute.side_effect = self.pages
+
+        rows = list(self.client.read_table_rows('my_data', 'my_table',
+                                                page_size=1))
+
+        self.assertEqual(rows, [{'max_celsius': 40.5, 'state': 'CA'},
+                                {'max_celsius': None, 'state': 'NV'}])
+        self.api_mock.tabledata().list.assert_called_with(
+            projectId='project', datasetId='my_data', tableId='my_table',
+            maxResults=1, startIndex=None, pageToken='p1')
+
+    def test_read_missing_table(self):
+        """Ensure reading a missing table raises"""
+        self.api_mock.tables().get().execute.side_effect = HttpError(
+            HttpResponse(404), b'Not found')
+
+        self.assertRaises(bq_module.TableNotFoundException, list,
+                          self.client.read_table_rows('my_data', 'missing'))
+
+    def test_query_rows(self):
+        """Ensure query results are waited for, paged and decoded"""
+        self.api_mock.jobs().insert().execute.return_value = {
+            'jobReference': {'jobId': 'job'}, 'status': {'state': 'RUNNING'}}
+        self.api_mock.jobs().get().execute.return_value = {
+            'status': {'state': 'DONE'}}
+        for page in self.pages:
+            page['schema'] = {'fields': self.fields}
+        self.api_mock.jobs().getQueryResults().execute.side_effect = \
+            self.pages
+
+        rows = list(self.client.query_rows('SELECT 1', prefetch=False))
+
+        self.assertEqual([r['state'] for r in rows], ['CA', 'NV'])
+        self.api_mock.jobs().getQueryResults.assert_called_with(
+            projectId='project', jobId='job', maxResults=None,
+            pageToken='p1')
+
+    def test_read_table_columns(self):
+        """Ensure table pages are materialized into columns"""
+        self.api_mock.tables().get().execute.return_value = \
+            {'schema': {'fields': self.fields}}
+        self.api_mock.tabledata().list().execute.side_effect = self.pages
+
+        columns = self.client.read_table_columns('my_data', 'my_table',
+                                                 use_numpy=False)
+
+        self.assertEqual(columns['max_celsius'].values[0], 40.5)
+        self.assertEqual(list(columns['max_celsius'].mask), [0, 1])
+        self.assertEqual(columns['state'].values, ['CA', 'NV'])
+
+
+class TestQueryCache(BatchedClientTestCase):
+
+    def setUp(self):
+        super(TestQueryCache, self).setUp()
+        self.cache = QueryResultCache(validate=True)
+        self.client = BigQueryClient(self.api_mock, 'project',
+                                     query_cache=self.cache)
+        self.done_job = {
+            'jobReference': {'jobId': 'job'},
+            'status': {'state': 'DONE'},
+            'configuration': {'query': {'destinationTable': {
+                'projectId': 'project', 'datasetId': 'my_data',
+                'tableId': 'my_table'}}},
+            'statistics': {'startTime': '1000', 'query': {
+                'referencedTables': [{
+                    'projectId': 'bigquery-public-data',
+                    'datasetId': 'noaa_gsod', 'tableId': 'stations'}]}},
+        }
+        self.api_mock.jobs().insert().execute.return_value = {
+            'jobReference': {'jobId': 'job'}, 'status': {'state': 'RUNNING'}}
+        self.api_mock.jobs().get().execute.return_value = self.done_job
+        self.api_mock.jobs().insert.reset_mock()
+
+    def run_query(self, query="SELECT * FROM stations"):
+        job = self.client.write_to_table(query, 'my_data', 'my_table',
+                                         write_disposition='WRITE_TRUNCATE')
+        return self.client.wait_for_job(job)
+
+    def test_repeated_query_is_not_submitted(self):
+        """Ensure an identical query is answered from the cache"""
+        self.api_mock.tables.return_value = FakeMetadataCollection({
+            ('noaa_gsod', 'stations'): {'lastModifiedTime': '900'},
+            ('my_data', 'my_table'): {'lastModifiedTime': '1100'}})
+
+        self.run_query()
+        cached = self.run_query("SELECT *\n  FROM stations -- again")
+
+        self.assertEqual(cached, self.done_job)
+        self.assertEqual(self.api_mock.jobs().insert.call_count, 1)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_modified_source_invalidates(self):
+        """Ensure a source table modified since the job ran is re-queried"""
+        self.api_mock.tables.return_value = FakeMetadataCollection({
+            ('noaa_gsod', 'stations'): {'lastModifiedTime': '2000'},
+            ('my_data', 'my_table'): {'lastModifiedTime': '1100'}})
+
+        self.run_query()
+        self.run_query()
+
+        self.assertEqual(self.api_mock.jobs().insert.call_count, 2)
+
+    def test_missing_destination_invalidates(self):
+        """Ensure a deleted destination table is re-queried"""
+        self.api_mock.tables.return_value = FakeMetadataCollection({
+            ('noaa_gsod', 'stations'): {'lastModifiedTime': '900'}})
+
+        self.run_query()
+        self.run_query()
+
+        self.assertEqual(self.api_mock.jobs().insert.call_count, 2)
+
+    def test_append_is_not_cached(self):
+        """Ensure appending queries always run"""
+        for _ in range(2):
+            job = self.client.write_to_table('SELECT 1', 'd', 't',
+                                             write_disposition='WRITE_APPEND')
+            self.client.wait_for_job(job)
+
+        self.assertEqual(self.api_mock.jobs().insert.call_count, 2)
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestDryRun(unittest.TestCase):
+
+    def setUp(self):
+        self.api_mock = mock.Mock()
+        self.client = BigQueryClient(self.api_mock, 'project')
+        self.tables = [{'projectId': 'bigquery-public-data',
+                        'datasetId': 'noaa_gsod', 'tableId': 'gsod1990'}]
+        self.inserted = []
+
+        def insert(projectId, body):
+            self.inserted.append(body)
+            request = mock.Mock()
+            if body['configuration'].get('dryRun'):
+                request.execute.return_value = {
+                    'status': {'state': 'DONE'},
+                    'statistics': {'totalBytesProcessed': '5000',
+                                   'query': {'referencedTables': self.tables,
+                                             'schema': {'fields': [
+                                                 {'name': 'max',
+                                                  'type': 'FLOAT'}]}}}}
+            else:
+                request.execute.return_value = {
+                    'jobReference': {'jobId': 'job'},
+                    'status': {'state': 'RUNNING'}}
+            return request
+        self.api_mock.jobs().insert.side_effect = insert
+
+    def test_dry_run(self):
+        """Ensure dry runs report bytes and tables, and are memoized"""
+        estimate = self.client.dry_run('SELECT max FROM gsod1990')
+        again = self.client.dry_run('SELECT max\nFROM gsod1990')
+
+        self.assertEqual(estimate, {'totalBytesProcessed': 5000,
+                                    'referencedTables': self.tables})
+        self.assertEqual(again, estimate)
+        self.assertEqual(len(self.inserted), 1)
+        self.assertEqual(self.inserted[0], {'configuration': {
+            'query': {'query': 'SELECT max FROM gsod1990'}, 'dryRun': True}})
+
+    def test_query_schema(self):
+        """Ensure the result schema comes from a dry run"""
+        schema = self.client.query_schema('SELECT max FROM gsod1990')
+
+        self.assertEqual(schema, [{'name': 'max', 'type': 'FLOAT'}])
+        self.assertTrue(self.inserted[0]['configuration']['dryRun'])
+
+    def test_budget_refuses(self):
+        """Ensure queries over the budget are not submitted"""
+        self.assertRaises(bq_module.BytesBudgetExceededException,
+                          self.client.write_to_table, 'SELECT 1',
+                          bytes_budget=4999)
+        self.assertEqual(len(self.inserted), 1)
+
+    def test_budget_within(self):
+        """Ensure queries within budget run with maximumBytesBilled set"""
+        self.client.write_to_table('SELECT 1', bytes_budget=5000)
+
+        self.assertEqual(len(self.inserted), 2)
+        self.assertEqual(
+            self.inserted[1]['configuration']['query']['maximumBytesBilled'],
+            '5000')
+
+    def test_budget_warns(self):
+        """Ensure the warn action submits the query anyway"""
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.client.write_to_table('SELECT 1', bytes_budget=10,
+                                       budget_action='warn')
+
+        self.assertEqual(len(caught), 1)
+        self.assertIn('5000 bytes', str(caught[0].message))
+        self.assertEqual(len(self.inserted), 2)
+        self.assertNotIn('maximumBytesBilled',
+                         self.inserted[1]['configuration']['query'])
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import cache_module
+from cache_module import (
+    BlobCache, QueryResultCache, normalize_sql, query_cache_key
+)
+
+
+class TestNormalizeSql(unittest.TestCase):
+
+    def test_whitespace_and_comments(self):
+        """Ensure layout and comments do not change the normalized query"""
+        first = """#standardSQL
+            SELECT max,   state -- the hottest
+            FROM `bigquery-public-data.noaa_gsod.stations` /* all */"""
+        second = "#standardSQL\nSELECT max, state " \
+            "FROM `bigquery-public-data.noaa_gsod.stations`"
+
+        self.assertEqual(normalize_sql(first), normalize_sql(second))
+        self.assertEqual(
+            normalize_sql(first), '#standardSQL SELECT max, state FROM '
+            '`bigquery-public-data.noaa_gsod.stations`')
+
+    def test_quoted_text_is_kept(self):
+        """Ensure strings and identifiers are not altered"""
+        sql = "SELECT 'a  -- b' AS `c  #d` WHERE x = \"e  /* f */\""
+
+        self.assertEqual(normalize_sql(sql), sql)
+
+    def test_dialect_directive_matters(self):
+        """Ensure legacy and standard SQL queries never share a key"""
+        self.assertNotEqual(query_cache_key('#legacySQL\nSELECT 1'),
+                            query_cache_key('#standardSQL\nSELECT 1'))
+        self.assertNotEqual(query_cache_key('SELECT 1'),
+                            query_cache_key('#standardSQL\nSELECT 1'))
+
+    def test_key_components(self):
+        """Ensure UDF URIs and destination are part of the key"""
+        base = query_cache_key('SELECT 1', None, ('p', 'd', 't'))
+
+        self.assertEqual(base, query_cache_key('SELECT  1 ', [],
+                                               ('p', 'd', 't')))
+        self.assertNotEqual(base, query_cache_key('SELECT 1', None,
+                                                  ('p', 'd', 'other')))
+        self.assertNotEqual(base, query_cache_key('SELECT 1', ['gs://b/f.js'],
+                                                  ('p', 'd', 't')))
+
+
+class TestQueryResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = [1000.0]
+        patcher = mock.patch.object(cache_module, 'time',
+                                    lambda: self.now[0])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lru_eviction(self):
+        """Ensure the least recently used entry is evicted"""
+        cache = QueryResultCache(max_entries=2)
+        cache.put('a', {'job': 'a'})
+        cache.put('b', {'job': 'b'})
+        cache.get('a')
+        cache.put('c', {'job': 'c'})
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), {'job': 'a'})
+        self.assertEqual(cache.get('c'), {'job': 'c'})
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_ttl(self):
+        """Ensure entries expire after the time to live"""
+        cache = QueryResultCache(ttl=60)
+        cache.put('a', {'job': 'a'})
+
+        self.now[0] += 59
+        self.assertIsNotNone(cache.get('a'))
+        self.now[0] += 2
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_persisted_to_disk(self):
+        """Ensure a cache with a path survives across instances"""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'queries.json')
+
+        QueryResultCache(path=path).put('a', {'job': 'a'})
+
+        self.assertEqual(QueryResultCache(path=path).get('a'), {'job': 'a'})
+
+
+class TestBlobCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def put(self, cache, name, generation, size):
+        path = cache.partial_path('bucket', name, generation)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return cache.put('bucket', name, generation, path)
+
+    def test_get_and_put(self):
+        """Ensure content is cached per generation"""
+        cache = BlobCache(self.directory)
+        path = self.put(cache, 'a.csv', 1, 10)
+
+        self.assertEqual(cache.get('bucket', 'a.csv', 1), path)
+        self.assertIsNone(cache.get('bucket', 'a.csv', 2))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        self.put(cache, 'a.csv', 2, 10)
+        self.assertIsNone(cache.get('bucket', 'a.csv', 1))
+        self.assertFalse(os.path.exists(path))
+
+    def test_lru_eviction_by_size(self):
+        """Ensure least recently used files are evicted above the cap"""
+        cache = BlobCache(self.directory, max_bytes=25)
+        self.put(cache, 'a.csv', 1, 10)
+        self.put(cache, 'b.csv', 1, 10)
+        cache.get('bucket', 'a.csv', 1)
+        self.put(cache, 'c.csv', 1, 10)
+
+        self.assertIsNone(cache.get('bucket', 'b.csv', 1))
+        self.assertIsNotNone(cache.get('bucket', 'a.csv', 1))
+        self.assertIsNotNone(cache.get('bucket', 'c.csv', 1))
+        self.assertEqual(cache.size, 20)
+
+    def test_hits_do_not_save_the_index(self):
+        """Ensure a hit only reorders the index in memory"""
+        cache = BlobCache(self.directory, max_bytes=25)
+        self.put(cache, 'a.csv', 1, 10)
+        self.put(cache, 'b.csv', 1, 10)
+
+        with mock.patch.object(cache, '_save') as save:
+            cache.get('bucket', 'a.csv', 1)
+        self.assertFalse(save.called)
+
+        # The new order is saved with the next put
+        self.put(cache, 'c.csv', 1, 10)
+        cache = BlobCache(self.directory, max_bytes=25)
+        self.assertIsNone(cache.get('bucket', 'b.csv', 1))
+        self.assertIsNotNone(cache.get('bucket', 'a.csv', 1))
+
+    def test_persistence(self):
+        """Ensure the index survives across instances"""
+        self.put(BlobCache(self.directory), 'a.csv', 1, 10)
+
+        cache = BlobCache(self.directory)
+        self.assertIsNotNone(cache.get('bucket', 'a.csv', 1))
+        self.assertEqual(len(cache), 1)
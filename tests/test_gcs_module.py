@@ -0,0 +1,582 @@
+#!/usr/bin/env python
+import base64
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, unquote, urlparse
+
+import google_crc32c
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import storage
+
+import cache_module
+from cache_module import BlobCache
+import gcs_module
+from gcs_module import (
+    BlobNotFoundException, BucketNotFoundException,
+    ChecksumMismatchException, ExportManifestException, GCSClient,
+    connect_gcs_client, export_manifest, iter_export_shards, split_gcs_uri
+)
+from polling_module import FixedIntervalPolling
+
+
+class FakeGCSHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the subset of the GCS JSON API used by GCSClient"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        server = self.server
+        server.requests.append((url.path, query, self.headers.get('Range')))
+
+        match = re.match(r'^(?:/download)?/storage/v1/b/([^/]+)(?:/o(?:/(.+))?)?$',
+                         url.path)
+        if not match or match.group(1) not in server.buckets:
+            return self.send_json(404, {'error': {'code': 404}})
+        bucket_name, blob_name = match.group(1), match.group(2)
+        blobs = server.buckets[bucket_name]
+
+        if url.path.endswith('/o'):
+            prefix = query.get('prefix', '')
+            items = [server.metadata(bucket_name, name)
+                     for name in sorted(blobs) if name.startswith(prefix)]
+            return self.send_json(200, {'kind': 'storage#objects',
+                                        'items': items})
+        if blob_name is None:
+            return self.send_json(200, {'name': bucket_name})
+
+        blob_name = unquote(blob_name)
+        if blob_name not in blobs:
+            return self.send_json(404, {'error': {'code': 404}})
+        if query.get('alt') != 'media':
+            return self.send_json(200, server.metadata(bucket_name, blob_name))
+
+        content = blobs[blob_name]
+        byte_range = self.headers.get('Range')
+        status = 200
+        headers = {}
+        if byte_range:
+            start, end = re.match(r'bytes=(\d+)-(\d*)', byte_range).groups()
+            start = int(start)
+            end = int(end) if end else len(content) - 1
+            headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(
+                start, end, len(content))
+            content = content[start:end + 1]
+            status = 206
+        self.send_response(status)
+        headers['Content-Length'] = str(len(content))
+        headers['Content-Type'] = 'application/octet-stream'
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class FakeGCSServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Local fake GCS server running in a background thread"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           FakeGCSHandler)
+        self.buckets = {}
+        self.generations = {}
+        self.encodings = {}
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    def add_blob(self, bucket_name, blob_name, content,
+                 content_encoding=None):
+        self.buckets.setdefault(bucket_name, {})[blob_name] = content
+        key = (bucket_name, blob_name)
+        self.encodings[key] = content_encoding
+        self.generations[key] = self.generations.get(key, 0) + 1
+
+    def metadata(self, bucket_name, blob_name):
+        content = self.buckets[bucket_name][blob_name]
+        generation = self.generations[(bucket_name, blob_name)]
+        metadata = {
+            'kind': 'storage#object', 'bucket': bucket_name,
+            'name': blob_name, 'size': str(len(content)),
+            'generation': str(generation), 'metageneration': '1',
+            'etag': 'etag{0}'.format(generation),
+            'md5Hash': base64.b64encode(
+                hashlib.md5(content).digest()).decode('ascii'),
+            'crc32c': base64.b64encode(
+                google_crc32c.Checksum(content).digest()).decode('ascii'),
+        }
+        if self.encodings[(bucket_name, blob_name)]:
+            metadata['contentEncoding'] = \
+                self.encodings[(bucket_name, blob_name)]
+        return metadata
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class GCSTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGCSServer()
+        self.addCleanup(self.server.stop)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        storage_client = storage.Client(
+            project='test', credentials=AnonymousCredentials(),
+            client_options={'api_endpoint': self.server.url})
+        self.client = GCSClient(storage_client)
+
+    def media_requests(self):
+        return [r for r in self.server.requests
+                if r[1].get('alt') == 'media']
+
+
+class TestParallelDownload(GCSTestCase):
+
+    def setUp(self):
+        super(TestParallelDownload, self).setUp()
+        for i in range(3):
+            self.server.add_blob('exports', 'app1-00000000000%d.csv' % i,
+                                 ('shard %d\n' % i).encode() * 100)
+        self.server.add_blob('exports', 'other.csv', b'other')
+
+    def test_split_gcs_uri(self):
+        """Ensure GCS URIs are split into bucket and blob name"""
+        self.assertEqual(split_gcs_uri('gs://exports/dir/app1-*.csv'),
+                         ('exports', 'dir/app1-*.csv'))
+
+    def test_download_prefix_wildcard(self):
+        """Ensure wildcard shards are listed and downloaded"""
+        report = self.client.download_prefix('exports', 'app1-*.csv',
+                                              self.tmp_dir, max_workers=3)
+
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ['app1-00000000000%d.csv' % i for i in range(3)])
+        with open(os.path.join(self.tmp_dir, 'app1-000000000001.csv'),
+                  'rb') as f:
+            self.assertEqual(f.read(), b'shard 1\n' * 100)
+        self.assertEqual(report.files, 3)
+        self.assertEqual(report.bytes, 3 * 800)
+        self.assertTrue(report.throughput > 0)
+
+    def test_download_files_by_name(self):
+        """Ensure blobs given by name are downloaded"""
+        report = self.client.download_files('exports', ['other.csv'],
+                                            self.tmp_dir)
+
+        with open(os.path.join(self.tmp_dir, 'other.csv'), 'rb') as f:
+            self.assertEqual(f.read(), b'other')
+        self.assertEqual(report.bytes, 5)
+
+    def test_large_blob_ranged_reads(self):
+        """Ensure large blobs are read in parallel byte ranges"""
+        content = os.urandom(10000)
+        self.server.add_blob('exports', 'big/app1.csv', content)
+
+        report = self.client.download_files(
+            'exports', ['big/app1.csv'], self.tmp_dir, chunk_size=3000,
+            parallel_threshold=5000)
+
+        with open(os.path.join(self.tmp_dir, 'big', 'app1.csv'), 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(report.bytes, 10000)
+        self.assertEqual(sorted(r[2] for r in self.media_requests()), [
+            'bytes=0-2999', 'bytes=3000-5999', 'bytes=6000-8999',
+            'bytes=9000-9999'])
+
+
+def gzip_bytes(content):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as f:
+        f.write(content)
+    return buffer.getvalue()
+
+
+class TestStreamingReads(GCSTestCase):
+
+    def setUp(self):
+        super(TestStreamingReads, self).setUp()
+        self.rows = b''.join(b'%d,city %d\n' % (i, i) for i in range(2000))
+
+    def test_iter_chunks(self):
+        """Ensure a blob is streamed in ranged chunks"""
+        self.server.add_blob('exports', 'app1.csv', self.rows)
+
+        chunks = list(self.client.iter_chunks('exports', 'app1.csv',
+                                              chunk_size=4096))
+
+        self.assertEqual(b''.join(chunks), self.rows)
+        self.assertTrue(all(len(chunk) <= 4096 for chunk in chunks))
+        self.assertEqual(len(self.media_requests()), len(chunks))
+
+    def test_gzip_shards_are_decompressed(self):
+        """Ensure .gz blobs and gzip encoded blobs are gunzipped"""
+        half = len(self.rows) // 2
+        # Concatenated gzip members are a valid gzip stream
+        self.server.add_blob('exports', 'app1.csv.gz',
+                             gzip_bytes(self.rows[:half]) +
+                             gzip_bytes(self.rows[half:]))
+        self.server.add_blob('exports', 'encoded.csv', gzip_bytes(self.rows),
+                             content_encoding='gzip')
+
+        for name in ('app1.csv.gz', 'encoded.csv'):
+            chunks = list(self.client.iter_chunks('exports', name,
+                                                  chunk_size=1024))
+            self.assertEqual(b''.join(chunks), self.rows)
+            self.assertTrue(all(len(chunk) <= 1024 for chunk in chunks))
+
+        raw = b''.join(self.client.iter_chunks('exports', 'app1.csv.gz',
+                                               decompress=False))
+        self.assertEqual(raw[:2], b'\x1f\x8b')
+
+    def test_open_blob_text(self):
+        """Ensure a compressed shard is read line by line as text"""
+        self.server.add_blob('exports', 'app1.csv.gz', gzip_bytes(self.rows))
+
+        with self.client.open_blob('exports', 'app1.csv.gz', 'r',
+                                   chunk_size=1024) as f:
+            lines = list(f)
+
+        self.assertEqual(len(lines), 2000)
+        self.assertEqual(lines[1234], u'1234,city 1234\n')
+
+    def test_read_ahead_is_bounded(self):
+        """Ensure an idle consumer stops the prefetch after read_ahead"""
+        self.server.add_blob('exports', 'app1.csv', self.rows)
+
+        f = self.client.open_blob('exports', 'app1.csv', chunk_size=1024,
+                                  read_ahead=2)
+        self.assertEqual(f.read(10), self.rows[:10])
+        time.sleep(0.2)
+        # The chunk being read, plus the queued ones and the one blocked on
+        # a full queue
+        self.assertLessEqual(len(self.media_requests()), 4)
+        f.close()
+
+
+class TestResumableDownload(GCSTestCase):
+
+    def setUp(self):
+        super(TestResumableDownload, self).setUp()
+        self.content = os.urandom(5000)
+        self.server.add_blob('exports', 'app1.csv', self.content)
+        self.destination = os.path.join(self.tmp_dir, 'app1.csv')
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_download_file(self):
+        """Ensure a blob is downloaded and verified"""
+        path = self.client.download_file('exports', 'app1.csv',
+                                         self.destination)
+
+        self.assertEqual(path, self.destination)
+        self.assertEqual(self.read(path), self.content)
+        self.assertEqual(os.listdir(self.tmp_dir), ['app1.csv'])
+
+    def test_missing_blob(self):
+        """Ensure a missing blob is an error and writes no file"""
+        with self.assertRaises(BlobNotFoundException):
+            self.client.download_file('exports', 'missing', self.destination)
+        self.assertFalse(os.path.exists(self.destination))
+
+    def test_resume_partial_download(self):
+        """Ensure an interrupted download resumes with a byte range"""
+        with open(self.destination + '.1.partial', 'wb') as f:
+            f.write(self.content[:2000])
+
+        self.client.download_file('exports', 'app1.csv', self.destination)
+
+        self.assertEqual(self.read(self.destination), self.content)
+        self.assertEqual([r[2] for r in self.media_requests()],
+                         ['bytes=2000-'])
+
+    def test_corrupt_partial_download(self):
+        """Ensure a corrupt download is rejected and restarted next time"""
+        partial = self.destination + '.1.partial'
+        with open(partial, 'wb') as f:
+            f.write(b'x' * 2000)
+
+        with self.assertRaises(ChecksumMismatchException):
+            self.client.download_file('exports', 'app1.csv',
+                                      self.destination)
+        self.assertFalse(os.path.exists(partial))
+
+        self.client.download_file('exports', 'app1.csv', self.destination)
+        self.assertEqual(self.read(self.destination), self.content)
+
+    def test_cached_blob_is_not_downloaded(self):
+        """Ensure an unchanged blob is copied from the cache"""
+        cache = BlobCache(os.path.join(self.tmp_dir, 'cache'))
+        self.client.blob_cache = cache
+
+        self.client.download_file('exports', 'app1.csv', self.destination)
+        os.remove(self.destination)
+        self.client.download_file('exports', 'app1.csv', self.destination)
+
+        self.assertEqual(self.read(self.destination), self.content)
+        self.assertEqual(len(self.media_requests()), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # A new generation is downloaded again and replaces the old one
+        self.server.add_blob('exports', 'app1.csv', b'new content')
+        self.client.invalidate('exports', 'app1.csv')
+        self.client.download_file('exports', 'app1.csv', self.destination)
+
+        self.assertEqual(self.read(self.destination), b'new content')
+        self.assertEqual(len(self.media_requests()), 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_gzip_encoded_blob(self):
+        """Ensure gzip encoded blobs are verified raw and stored
+        decompressed"""
+        self.server.add_blob('exports', 'encoded.csv',
+                             gzip_bytes(self.content),
+                             content_encoding='gzip')
+
+        self.client.download_file('exports', 'encoded.csv', self.destination)
+
+        self.assertEqual(self.read(self.destination), self.content)
+
+
+class TestConnectGCSClient(unittest.TestCase):
+
+    def setUp(self):
+        gcs_module.clear_client_cache()
+        gcs_module.clear_storage_clients()
+        self.addCleanup(gcs_module.clear_client_cache)
+        self.addCleanup(gcs_module.clear_storage_clients)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.key_file = os.path.join(self.tmp_dir, 'key.json')
+        with open(self.key_file, 'w') as key_file:
+            json.dump({'project_id': 'project', 'client_email': 'mail',
+                       'private_key': 'pkey'}, key_file)
+
+    @mock.patch.object(gcs_module.service_account.Credentials,
+                       'from_service_account_info')
+    def test_storage_client(self, from_info):
+        """Ensure the key builds a storage client with its credentials"""
+        from_info.return_value = AnonymousCredentials()
+        blob_cache = BlobCache(self.tmp_dir)
+
+        client = connect_gcs_client(self.key_file, blob_cache=blob_cache)
+
+        self.assertIsInstance(client.gcs_client, storage.Client)
+        self.assertEqual(client.gcs_client.project, 'project')
+        self.assertIs(client.gcs_client._credentials,
+                      from_info.return_value)
+        self.assertIs(client.blob_cache, blob_cache)
+        self.assertEqual(client.bucket('exports').name, 'exports')
+        from_info.assert_called_once_with(
+            {'project_id': 'project', 'client_email': 'mail',
+             'private_key': 'pkey'}, scopes=[gcs_module.READ_ONLY_SCOPE])
+
+
+    @mock.patch.object(gcs_module.service_account.Credentials,
+                       'from_service_account_info')
+    def test_storage_client_is_shared(self, from_info):
+        """Ensure one storage client is built per key file"""
+        from_info.side_effect = lambda *args, **kwargs: AnonymousCredentials()
+
+        first = connect_gcs_client(self.key_file)
+        second = connect_gcs_client(self.key_file)
+        uncached = connect_gcs_client(self.key_file, use_cache=False)
+
+        self.assertIs(first.gcs_client, second.gcs_client)
+        self.assertIsNot(uncached.gcs_client, first.gcs_client)
+        self.assertEqual(from_info.call_count, 2)
+
+
+class TestMetadataCache(GCSTestCase):
+
+    def setUp(self):
+        super(TestMetadataCache, self).setUp()
+        for i in range(3):
+            self.server.add_blob('exports', 'f%d.csv' % i, b'content')
+        self.now = [1000.0]
+        patcher = mock.patch.object(cache_module, 'time',
+                                    lambda: self.now[0])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def metadata_requests(self):
+        # Bucket GETs are left out: recent google-cloud-storage releases
+        # fetch bucket metadata in the background for tracing
+        return [r for r in self.server.requests
+                if '/o' in r[0] and r[1].get('alt') != 'media']
+
+    def test_downloads_reuse_metadata(self):
+        """Ensure repeated downloads make no bucket or blob metadata
+        request"""
+        for _ in range(2):
+            for i in range(3):
+                self.client.download_file(
+                    'exports', 'f%d.csv' % i,
+                    os.path.join(self.tmp_dir, 'f%d.csv' % i))
+
+        self.assertEqual(len(self.metadata_requests()), 3)
+        self.assertEqual(self.client.cache_stats()['blobs'],
+                         {'hits': 3, 'misses': 3, 'entries': 3})
+
+    def test_listing_fills_the_cache(self):
+        """Ensure listed blobs need no metadata request"""
+        self.client.list_blobs('exports', 'f*.csv')
+        self.client.download_files('exports', ['f0.csv', 'f1.csv'],
+                                   self.tmp_dir)
+
+        self.assertEqual(len(self.metadata_requests()), 1)
+
+    def test_ttl(self):
+        """Ensure metadata is fetched again once expired"""
+        self.assertIsNotNone(self.client.get_bucket('exports'))
+        self.assertIsNotNone(self.client.get_bucket('exports'))
+        self.now[0] += 3600
+        self.assertEqual(self.client.get_blob('exports', 'f0.csv').size, 7)
+        self.client.get_bucket('exports')
+        self.now[0] += 3600
+        self.client.get_blob('exports', 'f0.csv')
+
+        self.assertEqual(len(self.metadata_requests()), 2)
+        self.assertEqual(self.client.cache_stats()['buckets'],
+                         {'hits': 1, 'misses': 2, 'entries': 1})
+
+    def test_missing(self):
+        """Ensure missing buckets and blobs are not cached"""
+        with self.assertRaises(BucketNotFoundException):
+            self.client.get_bucket('missing')
+        self.assertIsNone(self.client.get_blob('exports', 'missing'))
+        stats = self.client.cache_stats()
+        self.assertEqual(stats['buckets']['entries'], 0)
+        self.assertEqual(stats['blobs']['entries'], 0)
+
+    def test_references_need_no_request(self):
+        """Ensure bucket and blob references are built locally"""
+        blob = self.client.blob('exports', 'f0.csv')
+
+        self.assertEqual(blob.bucket.name, 'exports')
+        self.assertIsNone(blob.size)
+        self.assertEqual(self.server.requests, [])
+
+
+class TestExportShards(unittest.TestCase):
+
+    def test_shards_as_they_land(self):
+        """Ensure shards are yielded once, during the job, new ones only"""
+        def blob(name, created):
+            blob = mock.Mock(time_created=datetime.datetime.utcfromtimestamp(
+                created))
+            blob.name = name
+            return blob
+
+        old = blob('app1-000000000000.csv', 999)
+        first = blob('app1-000000000000.csv', 1001)
+        second = blob('app1-000000000001.csv', 1002)
+        bq_client = mock.Mock()
+        bq_client.get_job.side_effect = [
+            {'status': {'state': state},
+             'statistics': {'creationTime': '1000000'}}
+            for state in ('RUNNING', 'RUNNING', 'DONE')]
+        gcs_client = mock.Mock()
+        gcs_client.list_blobs.side_effect = [[old], [first],
+                                             [first, second]]
+
+        shards = list(iter_export_shards(
+            bq_client, gcs_client, 'job', 'gs://bucket/app1-*.csv',
+            polling=FixedIntervalPolling(0)))
+
+        self.assertEqual(shards, [first, second])
+        gcs_client.list_blobs.assert_called_with('bucket', 'app1-*.csv')
+
+    def manifest_job(self, counts):
+        return {'jobReference': {'jobId': 'job'},
+                'configuration': {'extract': {
+                    'destinationUris': ['gs://bucket/app1-1-*.csv.gz',
+                                        'gs://bucket/app1-0-*.csv.gz'],
+                    'compression': 'GZIP'}},
+                'statistics': {'creationTime': '1000000',
+                               'extract': {
+                                   'destinationUriFileCounts': counts}}}
+
+    def manifest_blob(self, name, size, created=1001):
+        blob = mock.Mock(size=size,
+                         time_created=datetime.datetime.utcfromtimestamp(
+                             created))
+        blob.name = name
+        return blob
+
+    def test_manifest(self):
+        """Ensure the manifest lists the shards of every URI with sizes"""
+        blob = self.manifest_blob
+        gcs_client = mock.Mock()
+        gcs_client.list_blobs.side_effect = [
+            [blob('app1-1-000000000000.csv.gz', 20)],
+            [blob('app1-0-000000000000.csv.gz', 10),
+             blob('app1-0-000000000001.csv.gz', 5)]]
+
+        manifest = export_manifest(gcs_client, self.manifest_job(['1', '2']))
+
+        self.assertEqual([shard.uri for shard in manifest.shards], [
+            'gs://bucket/app1-0-000000000000.csv.gz',
+            'gs://bucket/app1-0-000000000001.csv.gz',
+            'gs://bucket/app1-1-000000000000.csv.gz'])
+        self.assertEqual(manifest.total_bytes, 35)
+        self.assertEqual((manifest.destination_format, manifest.compression),
+                         ('CSV', 'GZIP'))
+
+    def test_manifest_skips_stale_shards(self):
+        """Ensure shards left by an earlier export to the prefix are not
+        listed"""
+        blob = self.manifest_blob
+        gcs_client = mock.Mock()
+        gcs_client.list_blobs.side_effect = [
+            [blob('app1-1-000000000000.csv.gz', 20)],
+            [blob('app1-0-000000000000.csv.gz', 10),
+             blob('app1-0-000000000001.csv.gz', 5, created=999)]]
+
+        manifest = export_manifest(gcs_client, self.manifest_job(['1', '1']))
+
+        self.assertEqual([shard.name for shard in manifest.shards], [
+            'app1-0-000000000000.csv.gz', 'app1-1-000000000000.csv.gz'])
+
+    def test_manifest_checks_file_counts(self):
+        """Ensure a shard count differing from the job's is an error"""
+        gcs_client = mock.Mock()
+        gcs_client.list_blobs.side_effect = [
+            [self.manifest_blob('app1-1-000000000000.csv.gz', 20)], []]
+
+        with self.assertRaises(ExportManifestException):
+            export_manifest(gcs_client, self.manifest_job(['1', '2']))
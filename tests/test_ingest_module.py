@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta, tzinfo
+from decimal import Decimal
+
+try:
+    import fastavro
+except ImportError:  # fastavro is optional
+    fastavro = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional
+    pyarrow = None
+
+from ingest_module import (
+    AvroDecoder, CsvDecoder, NdjsonDecoder, iter_ndjson_batches,
+    iter_ndjson_rows, iter_parallel_batches, iter_parallel_rows,
+    ndjson_to_csv, read_avro_rows, read_export_rows, read_ndjson_rows
+)
+
+CITIES_SCHEMA = [
+    {'name': 'id', 'type': 'INTEGER'},
+    {'name': 'country_id', 'type': 'INTEGER'},
+    {'name': 'region_id', 'type': 'INTEGER'},
+    {'name': 'name', 'type': 'STRING'},
+    {'name': 'iso_code', 'type': 'STRING'},
+]
+
+LINES = [
+    b'{"id":"1","country_id":"250","region_id":"388","name":"Abancourt",'
+    b'"iso_code":"aco"}\n',
+    # Keys in another order, region_id missing
+    b'{"iso_code":"awr","name":"Aber Wrac\'h","country_id":"250","id":"4"}\n',
+    b'\n',
+]
+
+
+class TestNdjson(unittest.TestCase):
+
+    def test_projection_and_types(self):
+        """Ensure rows follow the schema order with typed values"""
+        rows = list(iter_ndjson_rows(LINES, CITIES_SCHEMA))
+
+        self.assertEqual(rows, [(1, 250, 388, u'Abancourt', u'aco'),
+                                (4, 250, None, u"Aber Wrac'h", u'awr')])
+
+    def test_batches(self):
+        """Ensure lines are decoded in batches of batch_size"""
+        lines = [json.dumps({'id': str(i)}) + '\n' for i in range(10)]
+
+        batches = list(iter_ndjson_batches(lines, CITIES_SCHEMA[:1],
+                                           batch_size=4))
+
+        self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+        self.assertEqual(batches[2], [(8,), (9,)])
+
+    def test_field_names_and_export_types(self):
+        """Ensure plain names keep values and export formats are parsed"""
+        line = json.dumps({'a': [1, 2], 'ts': '2017-10-09 12:30:00 UTC',
+                           'ok': True, 'flag': 'false'})
+        schema = ['a', {'name': 'ts', 'type': 'TIMESTAMP'},
+                  {'name': 'ok', 'type': 'BOOLEAN'},
+                  {'name': 'flag', 'type': 'BOOLEAN'}]
+
+        row, = iter_ndjson_rows([line], schema)
+
+        self.assertEqual(row, ([1, 2], datetime(2017, 10, 9, 12, 30), True,
+                               False))
+
+
+class TestFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, 'cities.gz')
+        with gzip.open(self.path, 'wb') as f:
+            f.writelines(LINES)
+
+    def test_read_gzip(self):
+        """Ensure gzip files are detected and streamed"""
+        rows = list(read_ndjson_rows(self.path, CITIES_SCHEMA))
+
+        self.assertEqual(rows[0], (1, 250, 388, u'Abancourt', u'aco'))
+
+    def test_csv_with_header(self):
+        """Ensure the CSV has a header row and the schema column order"""
+        csv_path = os.path.join(self.tmp_dir, 'city.csv')
+
+        written = ndjson_to_csv(self.path, csv_path, CITIES_SCHEMA)
+
+        self.assertEqual(written, 2)
+        with io.open(csv_path, newline='') as f:
+            self.assertEqual(f.read().splitlines(), [
+                'id,country_id,region_id,name,iso_code',
+                '1,250,388,Abancourt,aco',
+                "4,250,,Aber Wrac'h,awr"])
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.paths = []
+        for shard in range(4):
+            path = os.path.join(self.tmp_dir, 'shard-%d.json.gz' % shard)
+            with gzip.open(path, 'wb') as f:
+                for i in range(500):
+                    f.write(json.dumps({'id': str(shard * 1000 + i),
+                                        'name': 'city'}).encode() + b'\n')
+            self.paths.append(path)
+
+    def test_per_file_order(self):
+        """Ensure every shard is decoded and keeps its order"""
+        decoder = NdjsonDecoder(CITIES_SCHEMA[:1], batch_size=50)
+        by_path = {}
+        for path, batch in iter_parallel_batches(self.paths, decoder,
+                                                 processes=2, queue_size=2):
+            by_path.setdefault(path, []).extend(row[0] for row in batch)
+
+        self.assertEqual(sorted(by_path), sorted(self.paths))
+        for shard, path in enumerate(self.paths):
+            self.assertEqual(by_path[path],
+                             list(range(shard * 1000, shard * 1000 + 500)))
+
+    def test_csv_files(self):
+        """Ensure CSV files are decoded without their header"""
+        path = os.path.join(self.tmp_dir, 'countries.csv')
+        with open(path, 'w') as f:
+            f.write('id,name\n4,"Afghanistan"\n8,Albania\n')
+
+        rows = list(iter_parallel_rows([path], CsvDecoder()))
+
+        self.assertEqual(rows, [('4', 'Afghanistan'), ('8', 'Albania')])
+
+    def test_worker_error(self):
+        """Ensure a worker exception reaches the consumer"""
+        path = os.path.join(self.tmp_dir, 'broken.json')
+        with open(path, 'w') as f:
+            f.write('{"id": \n')
+
+        with self.assertRaises(ValueError):
+            list(iter_parallel_rows(self.paths + [path],
+                                    NdjsonDecoder(CITIES_SCHEMA[:1])))
+
+    def test_early_exit(self):
+        """Ensure the workers are stopped if the consumer stops"""
+        batches = iter_parallel_batches(
+            self.paths, NdjsonDecoder(CITIES_SCHEMA[:1], batch_size=10),
+            processes=2, queue_size=1)
+
+        next(batches)
+        batches.close()
+
+
+# Schema of a BigQuery table and the Avro schema BigQuery exports it with
+TYPED_SCHEMA = [
+    {'name': 'id', 'type': 'INTEGER', 'mode': 'REQUIRED'},
+    {'name': 'celsius', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+    {'name': 'price', 'type': 'NUMERIC', 'mode': 'NULLABLE'},
+    {'name': 'seen', 'type': 'TIMESTAMP', 'mode': 'NULLABLE'},
+    {'name': 'day', 'type': 'DATE', 'mode': 'NULLABLE'},
+    {'name': 'name', 'type': 'STRING', 'mode': 'NULLABLE'},
+    {'name': 'tags', 'type': 'STRING', 'mode': 'REPEATED'},
+    {'name': 'station', 'type': 'RECORD', 'mode': 'NULLABLE', 'fields': [
+        {'name': 'usaf', 'type': 'STRING', 'mode': 'NULLABLE'}]},
+]
+
+AVRO_SCHEMA = {'type': 'record', 'name': 'Root', 'fields': [
+    {'name': 'id', 'type': 'long'},
+    {'name': 'celsius', 'type': ['null', 'double']},
+    {'name': 'price', 'type': ['null', {
+        'type': 'bytes', 'logicalType': 'decimal', 'precision': 38,
+        'scale': 9}]},
+    {'name': 'seen', 'type': ['null', {'type': 'long',
+                                       'logicalType': 'timestamp-micros'}]},
+    {'name': 'day', 'type': ['null', 'string']},
+    {'name': 'name', 'type': ['null', 'string']},
+    {'name': 'tags', 'type': {'type': 'array', 'items': 'string'}},
+    {'name': 'station', 'type': ['null', {
+        'type': 'record', 'name': 'station', 'fields': [
+            {'name': 'usaf', 'type': ['null', 'string']}]}]},
+]}
+
+TYPED_ROWS = [
+    (1, -3.5, Decimal('1.250000000'), datetime(2017, 10, 9, 12, 30),
+     date(2017, 10, 9), u'', '["a", "b"]', u'722950'),
+    (2, None, None, None, None, None, '[]', None),
+]
+
+
+class UTC(tzinfo):
+
+    def utcoffset(self, dt):
+        return timedelta(0)
+
+    def dst(self, dt):
+        return timedelta(0)
+
+
+class TypedTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.records = [
+            {'id': 1, 'celsius': -3.5, 'price': Decimal('1.25'),
+             'seen': datetime(2017, 10, 9, 12, 30, tzinfo=UTC()),
+             'day': '2017-10-09', 'name': u'', 'tags': ['a', 'b'],
+             'station': {'usaf': u'722950'}},
+            {'id': 2, 'celsius': None, 'price': None, 'seen': None,
+             'day': None, 'name': None, 'tags': [], 'station': None}]
+
+
+@unittest.skipIf(fastavro is None, 'fastavro is not installed')
+class TestAvro(TypedTestCase):
+
+    def setUp(self):
+        super(TestAvro, self).setUp()
+        self.path = os.path.join(self.tmp_dir, 'app1-000000000000.avro')
+        with open(self.path, 'wb') as f:
+            fastavro.writer(f, fastavro.parse_schema(AVRO_SCHEMA),
+                            self.records, codec='deflate')
+
+    def test_typed_rows(self):
+        """Ensure values keep their types, NULL and empty strings differ"""
+        rows = list(read_export_rows(self.path, 'AVRO', TYPED_SCHEMA))
+
+        self.assertEqual(rows, TYPED_ROWS)
+
+    def test_writer_schema(self):
+        """Ensure the Avro schema gives the columns without fields"""
+        rows = list(read_avro_rows(self.path))
+
+        self.assertEqual(rows[1][:2], (2, None))
+        self.assertEqual(len(rows[1]), 8)
+
+    def test_parallel(self):
+        """Ensure Avro shards are decoded by worker processes"""
+        rows = list(iter_parallel_rows([self.path, self.path],
+                                       AvroDecoder(TYPED_SCHEMA)))
+
+        self.assertEqual(rows, TYPED_ROWS * 2)
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class TestParquet(TypedTestCase):
+
+    def test_typed_rows(self):
+        """Ensure Parquet columns are read typed and flattened"""
+        path = os.path.join(self.tmp_dir, 'app1-000000000000.parquet')
+        self.records[0]['day'] = date(2017, 10, 9)
+        table = pyarrow.Table.from_pylist(self.records, schema=pyarrow.schema([
+            ('id', pyarrow.int64()),
+            ('celsius', pyarrow.float64()),
+            ('price', pyarrow.decimal128(38, 9)),
+            ('seen', pyarrow.timestamp('us', tz='UTC')),
+            ('day', pyarrow.date32()),
+            ('name', pyarrow.string()),
+            ('tags', pyarrow.list_(pyarrow.string())),
+            ('station', pyarrow.struct([('usaf', pyarrow.string())]))]))
+        pyarrow.parquet.write_table(table, path)
+
+        rows = list(read_export_rows(path, 'PARQUET', TYPED_SCHEMA))
+
+        self.assertEqual(rows, TYPED_ROWS)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+import threading
+import unittest
+
+from pipeline_module import Pipeline, PipelineException
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_dependencies(self):
+        """Ensure stages get the results of their dependencies in order"""
+        pipeline = Pipeline()
+        pipeline.add('a', lambda: 2)
+        pipeline.add('b', lambda: 3)
+        pipeline.add('c', lambda a, b: a * 10 + b, requires=['a', 'b'])
+
+        results = pipeline.run()
+
+        self.assertEqual(results, {'a': 2, 'b': 3, 'c': 23})
+        self.assertEqual(sorted(pipeline.timings), ['a', 'b', 'c'])
+        self.assertIn('c', pipeline.report())
+
+    def test_independent_stages_overlap(self):
+        """Ensure independent stages run concurrently"""
+        barrier = threading.Event()
+        pipeline = Pipeline()
+        pipeline.add('wait', lambda: barrier.wait(5))
+        pipeline.add('release', barrier.set)
+
+        results = pipeline.run()
+
+        self.assertTrue(results['wait'])
+
+    def test_streaming(self):
+        """Ensure dependents consume items while the stage produces them"""
+        consumed = []
+
+        def produce():
+            for i in range(10):
+                # The channel holds 2 items, so the consumer must keep up
+                yield i
+
+        def consume(items):
+            for item in items:
+                consumed.append(item)
+            return len(consumed)
+
+        pipeline = Pipeline(channel_size=2)
+        pipeline.add('produce', produce, stream=True)
+        pipeline.add('double', lambda items: (i * 2 for i in items),
+                     requires=['produce'], stream=True)
+        pipeline.add('consume', consume, requires=['double'])
+
+        results = pipeline.run()
+
+        self.assertEqual(consumed, [i * 2 for i in range(10)])
+        self.assertEqual(results['produce'], 10)
+        self.assertEqual(pipeline.timings['double'].items, 10)
+
+    def test_failure(self):
+        """Ensure a failure skips its dependents and is reported"""
+        ran = []
+
+        def fail():
+            raise ValueError('boom')
+
+        def produce():
+            yield 1
+            raise IOError('lost')
+
+        pipeline = Pipeline()
+        pipeline.add('fail', fail)
+        pipeline.add('skipped', lambda _: ran.append(1), requires=['fail'])
+        pipeline.add('produce', produce, stream=True)
+        pipeline.add('consume', lambda items: list(items),
+                     requires=['produce'])
+        pipeline.add('ok', lambda: 1)
+
+        with self.assertRaises(PipelineException) as context:
+            pipeline.run()
+
+        self.assertEqual(sorted(context.exception.errors),
+                         ['fail', 'produce'])
+        self.assertEqual(ran, [])
+
+    def test_consumer_failure_stops_producer(self):
+        """Ensure a producer does not block once its consumer failed"""
+        def produce():
+            for i in range(1000):
+                yield i
+
+        def consume(items):
+            next(iter(items))
+            raise ValueError('boom')
+
+        pipeline = Pipeline(channel_size=1)
+        pipeline.add('produce', produce, stream=True)
+        pipeline.add('consume', consume, requires=['produce'])
+
+        with self.assertRaises(PipelineException) as context:
+            pipeline.run()
+
+        self.assertEqual(list(context.exception.errors), ['consume'])
+
+    def test_unknown_dependency(self):
+        """Ensure dependencies must be declared first"""
+        with self.assertRaises(ValueError):
+            Pipeline().add('b', lambda a: a, requires=['a'])
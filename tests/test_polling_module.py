@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+import itertools
+import random
+import unittest
+
+import mock
+
+import bq_module
+from bq_module import BigQueryClient, BigQueryTimeoutException
+from polling_module import (
+    ExponentialBackoffPolling, FixedIntervalPolling, PollingStrategy,
+    get_polling_strategy, clip_to_deadline
+)
+
+
+class FakeClock(object):
+    """Virtual clock replacing bq_module.sleep and bq_module.time"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestPollingStrategies(unittest.TestCase):
+
+    def test_strategy_is_abstract(self):
+        """Ensure a strategy without delays cannot be instantiated"""
+        class NoDelays(PollingStrategy):
+            pass
+
+        self.assertRaises(TypeError, PollingStrategy)
+        self.assertRaises(TypeError, NoDelays)
+
+    def test_fixed_interval_immediate(self):
+        """Ensure the fixed strategy checks immediately, then every interval"""
+        delays = list(itertools.islice(FixedIntervalPolling(3).delays(), 3))
+        self.assertEqual(delays, [0, 3, 3])
+
+    def test_backoff_grows_up_to_cap(self):
+        """Ensure backoff delays grow geometrically and are capped"""
+        polling = ExponentialBackoffPolling(initial=1, multiplier=2,
+                                            maximum=5, jitter=0)
+        delays = list(itertools.islice(polling.delays(), 6))
+        self.assertEqual(delays, [0, 1, 2, 4, 5, 5])
+
+    def test_backoff_jitter_bounds(self):
+        """Ensure jittered delays stay within the configured bounds"""
+        polling = ExponentialBackoffPolling(initial=1, multiplier=1,
+                                            jitter=0.2, rng=random.Random(7))
+        delays = list(itertools.islice(polling.delays(), 50))[1:]
+        self.assertTrue(all(0.8 <= d <= 1.2 for d in delays))
+        self.assertTrue(len(set(delays)) > 1)
+
+    def test_get_polling_strategy(self):
+        """Ensure explicit strategies win over the legacy interval"""
+        polling = FixedIntervalPolling(1)
+        self.assertIs(get_polling_strategy(polling, 5), polling)
+        self.assertEqual(get_polling_strategy(None, 5).interval, 5)
+        self.assertIsInstance(get_polling_strategy(),
+                              ExponentialBackoffPolling)
+
+    def test_clip_to_deadline(self):
+        """Ensure delays never pass the deadline and never go negative"""
+        self.assertEqual(clip_to_deadline(5, 10, 12), 2)
+        self.assertEqual(clip_to_deadline(5, 13, 12), 0)
+        self.assertEqual(clip_to_deadline(5, 10, None), 5)
+
+
+class TestWaitForJobPolling(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher_sleep = mock.patch.object(bq_module, 'sleep', self.clock.sleep)
+        patcher_time = mock.patch.object(bq_module, 'time', self.clock.time)
+        patcher_sleep.start()
+        patcher_time.start()
+        self.addCleanup(patcher_sleep.stop)
+        self.addCleanup(patcher_time.stop)
+
+        self.api_mock = mock.Mock()
+        self.client = BigQueryClient(self.api_mock, 'project')
+
+    def test_done_job_detected_without_sleeping(self):
+        """Ensure an already finished job costs a single immediate check"""
+        self.api_mock.jobs().get().execute.return_value = {
+            'status': {'state': u'DONE'}}
+
+        self.client.wait_for_job('testJob')
+
+        self.assertEqual(self.clock.sleeps, [0])
+        self.assertEqual(self.api_mock.jobs().get().execute.call_count, 1)
+
+    def test_timeout_is_not_overshot(self):
+        """Ensure the final sleep is clipped to the deadline"""
+        self.api_mock.jobs().get().execute.return_value = {
+            'status': {'state': u'RUNNING'}}
+
+        self.assertRaises(BigQueryTimeoutException, self.client.wait_for_job,
+                          'testJob', timeout=7,
+                          polling=FixedIntervalPolling(3))
+
+        self.assertEqual(self.clock.sleeps, [0, 3, 3, 1])
+        self.assertEqual(self.clock.now, 1007.0)
+
+    def test_strategy_per_call(self):
+        """Ensure the strategy passed in is the one driving the sleeps"""
+        responses = [{'status': {'state': u'RUNNING'}}] * 3 + \
+            [{'status': {'state': u'DONE'}}]
+        self.api_mock.jobs().get().execute.side_effect = responses
+
+        polling = ExponentialBackoffPolling(initial=1, jitter=0)
+        self.client.wait_for_job({'jobReference': {'jobId': 'testJob'}},
+                                 polling=polling)
+
+        self.assertEqual(self.clock.sleeps, [0, 1, 2, 4])
+        self.api_mock.jobs().get.assert_called_with(projectId='project',
+                                                    jobId='testJob')
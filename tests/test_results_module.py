@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+import base64
+import threading
+import unittest
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from results_module import decode_rows, decode_columns, iter_pages
+
+try:
+    import numpy
+except ImportError:  # numpy is optional
+    numpy = None
+
+
+class TestDecodeRows(unittest.TestCase):
+
+    def test_scalar_types(self):
+        """Ensure every scalar type is converted from its JSON string"""
+        fields = [
+            {'name': 'max_celsius', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+            {'name': 'count', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+            {'name': 'state', 'type': 'STRING', 'mode': 'NULLABLE'},
+            {'name': 'ok', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+            {'name': 'price', 'type': 'NUMERIC', 'mode': 'NULLABLE'},
+            {'name': 'ts', 'type': 'TIMESTAMP', 'mode': 'NULLABLE'},
+            {'name': 'dt', 'type': 'DATETIME', 'mode': 'NULLABLE'},
+            {'name': 'day', 'type': 'DATE', 'mode': 'NULLABLE'},
+            {'name': 'at', 'type': 'TIME', 'mode': 'NULLABLE'},
+            {'name': 'raw', 'type': 'BYTES', 'mode': 'NULLABLE'},
+        ]
+        row = {'f': [{'v': '37.5'}, {'v': '12'}, {'v': 'CA'}, {'v': 'true'},
+                     {'v': '1.10'}, {'v': '1.5E9'},
+                     {'v': '2017-10-09T12:30:00.250000'}, {'v': '2017-10-09'},
+                     {'v': '12:30:00'},
+                     {'v': base64.b64encode(b'\x00\x01').decode()}]}
+
+        decoded = decode_rows([row], fields)[0]
+
+        self.assertEqual(decoded, {
+            'max_celsius': 37.5, 'count': 12, 'state': u'CA', 'ok': True,
+            'price': Decimal('1.10'), 'ts': datetime(2017, 7, 14, 2, 40),
+            'dt': datetime(2017, 10, 9, 12, 30, 0, 250000),
+            'day': date(2017, 10, 9), 'at': time(12, 30), 'raw': b'\x00\x01'})
+
+    def test_nulls_records_and_repeated(self):
+        """Ensure NULLs, nested records and repeated fields are decoded"""
+        fields = [
+            {'name': 'missing', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+            {'name': 'station', 'type': 'RECORD', 'mode': 'NULLABLE',
+             'fields': [{'name': 'usaf', 'type': 'STRING'},
+                        {'name': 'elev', 'type': 'FLOAT'}]},
+            {'name': 'temps', 'type': 'INTEGER', 'mode': 'REPEATED'},
+        ]
+        row = {'f': [{'v': None},
+                     {'v': {'f': [{'v': '007018'}, {'v': '7018.0'}]}},
+                     {'v': [{'v': '1'}, {'v': '2'}]}]}
+
+        self.assertEqual(decode_rows([row], fields), [{
+            'missing': None,
+            'station': {'usaf': u'007018', 'elev': 7018.0},
+            'temps': [1, 2]}])
+
+
+class TestIterPages(unittest.TestCase):
+
+    def setUp(self):
+        self.fetched = []
+
+        def fetch_page(page_token):
+            index = int(page_token or 0)
+            self.fetched.append(index)
+            next_token = str(index + 1) if index < 4 else None
+            return ['row%d' % index], next_token
+        self.fetch_page = fetch_page
+
+    def test_pages_in_order(self):
+        """Ensure all pages are returned in order, with and without prefetch"""
+        for prefetch in (True, False):
+            self.assertEqual(list(iter_pages(self.fetch_page, prefetch)),
+                             [['row%d' % i] for i in range(5)])
+
+    def test_prefetch_is_bounded(self):
+        """Ensure the prefetch thread stays at most two pages ahead"""
+        pages = iter_pages(self.fetch_page)
+        next(pages)
+        threading.Event().wait(0.2)
+
+        # One page queued and one fetched, waiting for room in the queue
+        self.assertEqual(self.fetched, [0, 1, 2])
+        pages.close()
+
+    def test_errors_are_reraised(self):
+        """Ensure fetch errors surface in the consuming thread"""
+        def fetch_page(page_token):
+            if page_token:
+                raise IOError('connection reset')
+            return ['row'], '1'
+
+        pages = iter_pages(fetch_page)
+        self.assertEqual(next(pages), ['row'])
+        self.assertRaises(IOError, next, pages)
+
+
+class TestDecodeColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.fields = [
+            {'name': 'max_celsius', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+            {'name': 'count', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+            {'name': 'ok', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+            {'name': 'state', 'type': 'STRING', 'mode': 'NULLABLE'},
+        ]
+        self.pages = [
+            [{'f': [{'v': '40.5'}, {'v': '3'}, {'v': 'true'}, {'v': 'CA'}]},
+             {'f': [{'v': None}, {'v': None}, {'v': None}, {'v': None}]}],
+            [],
+            [{'f': [{'v': '-2.25'}, {'v': '7'}, {'v': 'false'}, {'v': 'NV'}]}],
+        ]
+
+    def test_array_columns(self):
+        """Ensure array.array columns with a null mask are built"""
+        columns = decode_columns(self.pages, self.fields, use_numpy=False)
+
+        self.assertEqual(list(columns), ['max_celsius', 'count', 'ok',
+                                         'state'])
+        self.assertEqual(columns['max_celsius'].values[0], 40.5)
+        self.assertEqual(columns['max_celsius'].values[2], -2.25)
+        self.assertEqual(list(columns['count'].values), [3, 0, 7])
+        self.assertEqual(list(columns['ok'].values), [1, 0, 0])
+        self.assertEqual(columns['state'].values, ['CA', None, 'NV'])
+        for column in columns.values():
+            self.assertEqual(list(column.mask), [0, 1, 0])
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy_columns(self):
+        """Ensure typed numpy columns with a null mask are built"""
+        columns = decode_columns(self.pages, self.fields)
+
+        self.assertEqual(columns['max_celsius'].values.dtype, numpy.float64)
+        self.assertEqual(columns['count'].values.dtype, numpy.int64)
+        self.assertEqual(columns['ok'].values.tolist(), [True, False, False])
+        self.assertEqual(columns['count'].values.tolist(), [3, 0, 7])
+        self.assertTrue(numpy.isnan(columns['max_celsius'].values[1]))
+        self.assertEqual(columns['state'].values.tolist(), ['CA', None, 'NV'])
+        for column in columns.values():
+            self.assertEqual(column.mask.tolist(), [False, True, False])
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy_time_columns(self):
+        """Ensure time types become datetime64 columns"""
+        fields = [{'name': 'ts', 'type': 'TIMESTAMP'},
+                  {'name': 'day', 'type': 'DATE'},
+                  {'name': 'dt', 'type': 'DATETIME'}]
+        pages = [[{'f': [{'v': '1.5E9'}, {'v': '2017-10-09'},
+                         {'v': '2017-10-09 12:30:00'}]}]]
+
+        columns = decode_columns(pages, fields)
+
+        self.assertEqual(str(columns['ts'].values[0]),
+                         '2017-07-14T02:40:00.000000')
+        self.assertEqual(str(columns['day'].values[0]), '2017-10-09')
+        self.assertEqual(str(columns['dt'].values[0]),
+                         '2017-10-09T12:30:00.000000')
+
+    def test_empty_result(self):
+        """Ensure an empty result still has every column"""
+        columns = decode_columns([[]], self.fields, use_numpy=False)
+
+        self.assertEqual(len(columns['count'].values), 0)
+        self.assertEqual(len(columns['state'].mask), 0)
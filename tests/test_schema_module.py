@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+import unittest
+
+from schema_module import (
+    column_types, create_index_sql, create_table_sql, flatten_schema,
+    sample_varchar_sizes
+)
+from sql_module import create_sql_from_json_schema
+
+SCHEMA = [
+    {'name': 'id', 'type': 'INTEGER', 'mode': 'REQUIRED'},
+    {'name': 'name', 'type': 'STRING', 'mode': 'NULLABLE'},
+    {'name': 'price', 'type': 'NUMERIC', 'mode': 'NULLABLE'},
+    {'name': 'active', 'type': 'BOOLEAN', 'mode': 'NULLABLE'},
+    {'name': 'seen', 'type': 'TIMESTAMP', 'mode': 'NULLABLE'},
+    {'name': 'local', 'type': 'DATETIME', 'mode': 'NULLABLE'},
+    {'name': 'raw', 'type': 'BYTES', 'mode': 'NULLABLE'},
+    {'name': 'tags', 'type': 'STRING', 'mode': 'REPEATED'},
+    {'name': 'address', 'type': 'RECORD', 'mode': 'NULLABLE', 'fields': [
+        {'name': 'city', 'type': 'STRING', 'mode': 'REQUIRED'},
+        {'name': 'geo', 'type': 'RECORD', 'mode': 'REQUIRED', 'fields': [
+            {'name': 'lat', 'type': 'FLOAT', 'mode': 'REQUIRED'}]}]},
+]
+
+
+class TestColumnTypes(unittest.TestCase):
+
+    def test_types(self):
+        """Ensure every BigQuery type has its MySQL counterpart"""
+        self.assertEqual(list(column_types(SCHEMA).items()), [
+            ('id', 'BIGINT'),
+            ('name', 'VARCHAR(255)'),
+            ('price', 'DECIMAL(38, 9)'),
+            ('active', 'TINYINT(1)'),
+            ('seen', 'DATETIME(6)'),
+            ('local', 'DATETIME(6)'),
+            ('raw', 'LONGBLOB'),
+            ('tags', 'JSON'),
+            ('address_city', 'VARCHAR(255)'),
+            ('address_geo_lat', 'DOUBLE')])
+
+    def test_flattened_modes(self):
+        """Ensure columns of a NULLABLE record are NULLABLE"""
+        modes = dict((name, field['mode'])
+                     for name, field in flatten_schema(SCHEMA))
+
+        self.assertEqual(modes['address_city'], 'NULLABLE')
+        self.assertEqual(modes['address_geo_lat'], 'NULLABLE')
+
+    def test_sampled_sizes(self):
+        """Ensure VARCHARs are sized from the longest sampled values"""
+        rows = [{'name': u'Abbeville', 'address': {'city': u'Paris'}},
+                {'name': None, 'address': None},
+                {'name': u'x' * 300, 'address': {'city': u'Saint-Malo'}}]
+
+        sizes = sample_varchar_sizes(rows, SCHEMA)
+
+        self.assertEqual(sizes, {'name': 512, 'address_city': 16})
+        self.assertEqual(column_types(SCHEMA, sizes)['name'], 'VARCHAR(512)')
+
+    def test_long_strings(self):
+        """Ensure strings too long for a VARCHAR become LONGTEXT"""
+        types = column_types(SCHEMA, {'name': 20000})
+
+        self.assertEqual(types['name'], 'LONGTEXT')
+
+
+class TestDdl(unittest.TestCase):
+
+    def test_create_table(self):
+        """Ensure the table name, NOT NULL and the primary key are set"""
+        schema = [{'name': 'id', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+                  {'name': 'state', 'type': 'STRING', 'mode': 'REQUIRED'}]
+
+        sql = create_table_sql('weather', schema, {'state': 16}, ['id'])
+
+        self.assertEqual(
+            sql, u'CREATE TABLE `weather` ( `id` BIGINT NOT NULL,'
+            u' `state` VARCHAR(16) NOT NULL, PRIMARY KEY (`id`))'
+            u' DEFAULT CHARSET=utf8 ;')
+
+    def test_sql_module_default_table(self):
+        """Ensure create_sql_from_json_schema still creates temps"""
+        sql = create_sql_from_json_schema(SCHEMA[:2])
+
+        self.assertTrue(sql.startswith(u'CREATE TABLE `temps` ('))
+
+    def test_indexes(self):
+        """Ensure single and composite indexes, with TEXT prefixes"""
+        statements = create_index_sql(
+            'places', SCHEMA, ['name', ('address_city', 'id')],
+            {'name': 20000})
+
+        self.assertEqual(statements, [
+            u'CREATE INDEX `idx_places_name` ON `places` (`name`(255)) ;',
+            u'CREATE INDEX `idx_places_address_city_id` ON `places`'
+            u' (`address_city`, `id`) ;'])
+
+    def test_unindexable_column(self):
+        """Ensure JSON and unknown columns are refused"""
+        with self.assertRaises(ValueError):
+            create_index_sql('places', SCHEMA, ['tags'])
+        with self.assertRaises(ValueError):
+            create_index_sql('places', SCHEMA, ['missing'])
@@ -0,0 +1,464 @@
+#!/usr/bin/env python
+import re
+import threading
+import unittest
+
+import mock
+import pymysql
+
+import sql_module
+from sql_module import (
+    ConnectionPool, PoolTimeoutException, bulk_insert, close_pools, get_pool,
+    atomic_load, iter_insert_statements, iter_load_data_lines, load_rows,
+    rollback_table, run_query, upsert_rows
+)
+
+
+class FakeCursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, query, args=None):
+        if not self.connection.open:
+            raise pymysql.err.OperationalError(2013, 'Lost connection')
+        if self.connection.error:
+            raise self.connection.error
+        self.connection.executed.append((query, args))
+        if query.startswith('LOAD DATA LOCAL INFILE'):
+            # Read the local file like pymysql does
+            path = re.match(r"LOAD DATA LOCAL INFILE '([^']*)'", query).group(1)
+            with open(path, 'rb') as data_file:
+                self.connection.loaded.append(data_file.read())
+            return self.connection.loaded[-1].count(b'\n')
+        if 'max_allowed_packet' in query:
+            self.result = {'max_allowed_packet': self.connection.packet}
+        self._execute_ddl(query, args)
+
+    def _execute_ddl(self, query, args):
+        # Track the tables created, dropped and renamed
+        tables = self.connection.tables
+        match = re.match(r'(CREATE|DROP) TABLE (?:IF EXISTS )?`([^`]*)`',
+                         query)
+        if match and match.group(1) == 'CREATE':
+            tables.add(match.group(2))
+        elif match:
+            if 'IF EXISTS' not in query and match.group(2) not in tables:
+                raise pymysql.err.InternalError(1051, 'Unknown table')
+            tables.discard(match.group(2))
+        elif query.startswith('RENAME TABLE'):
+            for old, new in re.findall(r'`([^`]*)` TO `([^`]*)`', query):
+                if old not in tables or new in tables:
+                    raise pymysql.err.InternalError(1050, 'Cannot rename')
+                tables.remove(old)
+                tables.add(new)
+        elif 'information_schema.tables' in query:
+            self.rows = [{'name': name} for name in args if name in tables]
+
+    def fetchone(self):
+        return self.result
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection(object):
+    """Fake pymysql connection recording statements and transactions"""
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.open = True
+        self.alive = True
+        self.error = None
+        self.pings = 0
+        self.executed = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.packet = 4 * 1024 * 1024
+        self.loaded = []
+        self.tables = set()
+
+    def escape(self, value):
+        return pymysql.converters.escape_item(value, 'utf8')
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def ping(self, reconnect=True):
+        self.pings += 1
+        if not self.alive:
+            raise pymysql.err.OperationalError(2006, 'Gone away')
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        if not self.open:
+            raise pymysql.err.Error('Already closed')
+        self.open = False
+
+
+class PoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+        self.now = [1000.0]
+        patcher = mock.patch.object(sql_module, 'time', lambda: self.now[0])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connect(self, **kwargs):
+        connection = FakeConnection(**kwargs)
+        self.created.append(connection)
+        return connection
+
+    def pool(self, **kwargs):
+        return ConnectionPool('user', 'password', 'db', connect=self.connect,
+                              **kwargs)
+
+
+class TestConnectionPool(PoolTestCase):
+
+    def test_min_size_and_reuse(self):
+        """Ensure min_size connections are opened and reused"""
+        pool = self.pool(min_size=2, max_size=4)
+        self.assertEqual(len(self.created), 2)
+        self.assertEqual(self.created[0].kwargs['db'], 'db')
+        self.assertTrue(self.created[0].kwargs['local_infile'])
+
+        for _ in range(5):
+            with pool.connection():
+                pass
+
+        stats = pool.stats()
+        self.assertEqual(len(self.created), 2)
+        self.assertEqual(stats['checkouts'], 5)
+        self.assertEqual(stats['reused'], 5)
+        self.assertEqual(stats['idle'], 2)
+
+    def test_max_size_and_timeout(self):
+        """Ensure no more than max_size connections are opened"""
+        pool = self.pool(min_size=0, max_size=2, timeout=0.05)
+        first, second = pool.acquire(), pool.acquire()
+
+        with self.assertRaises(PoolTimeoutException):
+            pool.acquire()
+
+        threading.Timer(0.05, pool.release, [first]).start()
+        pool.timeout = 5
+        self.assertIs(pool.acquire(), first)
+        self.assertEqual(len(self.created), 2)
+        self.assertEqual(pool.stats()['waits'], 2)
+
+    def test_health_check_on_checkout(self):
+        """Ensure connections idle for long are pinged and replaced if dead"""
+        pool = self.pool(min_size=1, health_check_interval=30)
+        connection = self.created[0]
+
+        with pool.connection():
+            pass
+        self.assertEqual(connection.pings, 0)
+
+        self.now[0] += 60
+        connection.alive = False
+        with pool.connection() as replacement:
+            self.assertIsNot(replacement, connection)
+
+        self.assertEqual(connection.pings, 1)
+        self.assertFalse(connection.open)
+        stats = pool.stats()
+        self.assertEqual(stats['reconnects'], 1)
+        self.assertEqual(stats['created'], 1)
+
+    def test_connection_errors_discard(self):
+        """Ensure a connection failing with an OperationalError is closed"""
+        pool = self.pool(min_size=1)
+
+        with self.assertRaises(pymysql.err.OperationalError):
+            with pool.connection() as connection:
+                connection.open = False
+                connection.cursor().execute('SELECT 1')
+
+        self.assertEqual(pool.stats()['created'], 0)
+        with pool.connection() as connection:
+            self.assertIs(connection, self.created[1])
+
+    def test_transaction(self):
+        """Ensure transactions commit on success and roll back on error"""
+        pool = self.pool(min_size=1)
+        connection = self.created[0]
+
+        with pool.transaction() as c:
+            c.cursor().execute('INSERT 1')
+        with self.assertRaises(ValueError):
+            with pool.transaction() as c:
+                c.cursor().execute('INSERT 2')
+                raise ValueError()
+
+        self.assertEqual((connection.commits, connection.rollbacks), (1, 1))
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_close(self):
+        """Ensure idle connections are closed"""
+        pool = self.pool(min_size=2)
+        pool.close()
+
+        self.assertFalse(any(c.open for c in self.created))
+        self.assertEqual(pool.stats()['created'], 0)
+
+
+class TestRunQuery(PoolTestCase):
+
+    def setUp(self):
+        super(TestRunQuery, self).setUp()
+        patcher = mock.patch.object(sql_module.pymysql, 'connect',
+                                    self.connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(close_pools)
+
+    def test_statements_share_a_connection(self):
+        """Ensure successive statements reuse one pooled connection"""
+        for sql in ('CREATE TABLE t (a INT)', 'DROP TABLE t',
+                    'CREATE TABLE t (a INT)'):
+            run_query('user', 'password', 'db', sql)
+
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual(len(self.created[0].executed), 3)
+        self.assertEqual(self.created[0].commits, 3)
+        pool = get_pool('user', 'password', 'db')
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_error_code(self):
+        """Ensure InternalError codes are still returned"""
+        run_query('user', 'password', 'db', 'SELECT 1')
+        self.created[0].error = pymysql.err.InternalError(
+            1050, "Table 't' already exists")
+
+        self.assertEqual(run_query('user', 'password', 'db', 'CREATE t'),
+                         1050)
+        self.assertEqual(len(self.created), 1)
+
+
+class TestBulkInsert(PoolTestCase):
+
+    def setUp(self):
+        super(TestBulkInsert, self).setUp()
+        self.pool = self.pool(min_size=1)
+        self.connection = self.created[0]
+        self.rows = [(i, u'city \'%d\'' % i, None) for i in range(100)]
+
+    def inserts(self):
+        return [q for q, _ in self.connection.executed if
+                q.startswith('INSERT')]
+
+    def test_statements_are_sized_in_bytes(self):
+        """Ensure statements stay under the byte limit and keep every row"""
+        statements = list(iter_insert_statements(
+            self.connection, 'cities', ['id', 'name', 'iso_code'], self.rows,
+            max_bytes=500))
+
+        self.assertTrue(len(statements) > 1)
+        self.assertTrue(all(len(s.encode('utf8')) <= 500
+                            for s, _ in statements))
+        self.assertEqual(sum(count for _, count in statements), 100)
+        self.assertTrue(statements[0][0].startswith(
+            "INSERT INTO `cities` (`id`, `name`, `iso_code`) VALUES "
+            "(0,'city \\'0\\'',NULL),(1,"))
+
+    def test_dict_rows(self):
+        """Ensure dict rows are ordered by columns"""
+        (statement, count), = iter_insert_statements(
+            self.connection, 't', ['b', 'a'], [{'a': 1, 'b': u'x'}], 1000)
+
+        self.assertEqual(statement, "INSERT INTO `t` (`b`, `a`) VALUES "
+                                    "('x',1)")
+
+    def test_upsert(self):
+        """Ensure upserts update the non key columns within the size limit"""
+        upserted = upsert_rows('user', 'password', 'db', 'cities',
+                               ['id', 'name', 'iso_code'], self.rows, ['id'],
+                               max_statement_bytes=500, pool=self.pool)
+
+        self.assertEqual(upserted, 100)
+        inserts = self.inserts()
+        self.assertTrue(len(inserts) > 1)
+        self.assertTrue(all(len(s.encode('utf8')) <= 500 for s in inserts))
+        self.assertTrue(all(s.endswith(
+            ' ON DUPLICATE KEY UPDATE `name`=VALUES(`name`), '
+            '`iso_code`=VALUES(`iso_code`)') for s in inserts))
+
+    def test_commit_every(self):
+        """Ensure a commit is issued every commit_every statements"""
+        inserted = bulk_insert(None, None, None, 'cities',
+                               ['id', 'name', 'iso_code'], iter(self.rows),
+                               max_statement_bytes=200, commit_every=3,
+                               pool=self.pool)
+
+        self.assertEqual(inserted, 100)
+        statements = len(self.inserts())
+        self.assertTrue(statements > 6)
+        self.assertEqual(self.connection.commits, statements // 3 + 1)
+
+    def test_size_from_max_allowed_packet(self):
+        """Ensure the statement size is capped by max_allowed_packet"""
+        self.connection.packet = 1024 + 300
+
+        bulk_insert(None, None, None, 'cities', ['id', 'name', 'iso_code'],
+                    self.rows, pool=self.pool)
+
+        self.assertTrue(all(len(q) <= 300 for q in self.inserts()))
+
+    def test_rollback_on_error(self):
+        """Ensure the open transaction is rolled back on error"""
+        def rows():
+            yield (1, u'a', None)
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            bulk_insert(None, None, None, 'cities', ['id', 'name', 'iso'],
+                        rows(), max_statement_bytes=1000, pool=self.pool)
+        self.assertEqual(self.connection.rollbacks, 1)
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+
+class TestLoadRows(PoolTestCase):
+
+    def setUp(self):
+        super(TestLoadRows, self).setUp()
+        self.pool = self.pool(min_size=1)
+        self.connection = self.created[0]
+
+    def test_load_data_format(self):
+        """Ensure values are escaped for the default LOAD DATA format"""
+        lines = list(iter_load_data_lines([
+            (1, u'tab\there', None),
+            (True, b'new\nline', u'back\\slash \u00e9')]))
+
+        self.assertEqual(lines, [u'1\ttab\\there\t\\N\n',
+                                 u'1\tnew\\nline\tback\\\\slash \u00e9\n'])
+
+    def test_streams_rows(self):
+        """Ensure rows are streamed to LOAD DATA and committed"""
+        rows = ((i, u'city %d' % i) for i in range(50000))
+
+        loaded = load_rows(None, None, None, 'cities', rows,
+                           columns=['id', 'name'], pool=self.pool)
+
+        self.assertEqual(loaded, 50000)
+        data = self.connection.loaded[0].decode('utf8').splitlines()
+        self.assertEqual(data[1234], u'1234\tcity 1234')
+        query = self.connection.executed[0][0]
+        self.assertTrue(query.endswith(
+            "INTO TABLE `cities` CHARACTER SET 'utf8' "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+            "LINES TERMINATED BY '\\n' (`id`, `name`)"))
+        self.assertEqual(self.connection.commits, 1)
+
+    def test_rows_error_rolls_back(self):
+        """Ensure a failing row generator rolls the load back"""
+        def rows():
+            yield (1, u'a')
+            raise ValueError('bad row')
+
+        with self.assertRaises(ValueError):
+            load_rows(None, None, None, 'cities', rows(), pool=self.pool)
+        self.assertEqual(self.connection.rollbacks, 1)
+        self.assertEqual(self.connection.commits, 0)
+
+    def test_statement_error_releases_writer(self):
+        """Ensure the writer does not hang if the server rejects the load"""
+        self.connection.error = pymysql.err.ProgrammingError(
+            1146, "Table 'db.missing' doesn't exist")
+
+        with self.assertRaises(pymysql.err.ProgrammingError):
+            load_rows(None, None, None, 'missing', [(1,)] * 100000,
+                      pool=self.pool)
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+
+class TestAtomicLoad(PoolTestCase):
+
+    create = u'CREATE TABLE `{table}` (id INTEGER, name VARCHAR(10)) ;'
+    index = u'CREATE INDEX `idx_{table}_name` ON `{table}` (`name`) ;'
+
+    def setUp(self):
+        super(TestAtomicLoad, self).setUp()
+        self.pool = self.pool(min_size=1)
+        self.connection = self.created[0]
+
+    def load(self, rows, **kwargs):
+        return atomic_load(None, None, None, 'cities', self.create, rows,
+                           index_statements=[self.index], pool=self.pool,
+                           **kwargs)
+
+    def statements(self):
+        return ['LOAD DATA' if query.startswith('LOAD DATA')
+                else query.split(' (')[0]
+                for query, _ in self.connection.executed
+                if 'information_schema' not in query]
+
+    def test_first_load(self):
+        """Ensure the shadow table is renamed when there is no live table"""
+        self.assertEqual(self.load([(1, u'a'), (2, u'b')]), 2)
+
+        self.assertEqual(self.connection.tables, set(['cities']))
+        self.assertEqual(self.statements()[-1],
+                         'RENAME TABLE `cities__new` TO `cities`')
+
+    def test_swap(self):
+        """Ensure indexes are built after the load and the live table is
+        replaced by a single RENAME"""
+        self.connection.tables.update(['cities', 'cities__new'])
+
+        self.load([(1, u'a')])
+
+        self.assertEqual(self.statements(), [
+            'DROP TABLE IF EXISTS `cities__new`',
+            'CREATE TABLE `cities__new`',
+            'LOAD DATA',
+            'CREATE INDEX `idx_cities__new_name` ON `cities__new`',
+            'RENAME TABLE `cities` TO `cities__old`, '
+            '`cities__new` TO `cities`',
+            'DROP TABLE `cities__old`'])
+        self.assertEqual(self.connection.tables, set(['cities']))
+
+    def test_keep_previous_and_rollback(self):
+        """Ensure the previous generation can be kept and swapped back"""
+        self.connection.tables.update(['cities', 'cities__old'])
+
+        self.load([(1, u'a')], keep_previous=True)
+        self.assertEqual(self.connection.tables,
+                         set(['cities', 'cities__old']))
+        self.assertIn('DROP TABLE `cities__old`', self.statements())
+
+        del self.connection.executed[:]
+        rollback_table(None, None, None, 'cities', pool=self.pool)
+        self.assertEqual(self.statements(), [
+            'RENAME TABLE `cities` TO `cities__swap`, '
+            '`cities__old` TO `cities`, `cities__swap` TO `cities__old`'])
+        self.assertEqual(self.connection.tables,
+                         set(['cities', 'cities__old']))
+
+    def test_failed_load_keeps_live_table(self):
+        """Ensure a failed load drops the shadow table only"""
+        def rows():
+            yield (1, u'a')
+            raise ValueError('bad row')
+
+        self.connection.tables.add('cities')
+
+        with self.assertRaises(ValueError):
+            self.load(rows())
+        self.assertEqual(self.connection.tables, set(['cities']))
+        self.assertFalse([query for query in self.statements()
+                          if query.startswith('RENAME')])
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import mock
+
+import sync_module
+from bq_module import BigQueryClient
+from cache_module import QueryResultCache, query_cache_key
+from sync_module import (
+    Watermark, WatermarkStore, delta_query, sync_table, watermark_condition
+)
+
+
+class TestDeltaQuery(unittest.TestCase):
+
+    def test_full_sync(self):
+        """Ensure there is no filter without a previous watermark"""
+        query = delta_query('project.my_data.my_table',
+                            Watermark('updated'), columns=['id', 'updated'])
+
+        self.assertEqual(query, '#standardSQL\nSELECT `id`, `updated` '
+                                'FROM `project.my_data.my_table`')
+
+    def test_conditions(self):
+        """Ensure every kind of watermark has its condition"""
+        self.assertEqual(
+            watermark_condition(Watermark('updated'), '2017-10-09 12:30:00'),
+            "`updated` >= TIMESTAMP '2017-10-09 12:30:00'")
+        self.assertEqual(watermark_condition(Watermark('day', 'date'),
+                                             '2017-10-09'),
+                         "`day` >= DATE '2017-10-09'")
+        self.assertEqual(watermark_condition(Watermark('id', 'id'), 42),
+                         '`id` > 42')
+        self.assertEqual(
+            watermark_condition(Watermark(None, 'table_suffix'), "19'90"),
+            "_TABLE_SUFFIX >= '19\\'90'")
+
+    def test_table_suffix(self):
+        """Ensure wildcard tables select their suffix"""
+        query = delta_query('bigquery-public-data.noaa_gsod.gsod*',
+                            Watermark(None, 'table_suffix'), '2016')
+
+        self.assertEqual(
+            query, '#standardSQL\nSELECT *, _TABLE_SUFFIX AS _table_suffix '
+                   'FROM `bigquery-public-data.noaa_gsod.gsod*`\n'
+                   "WHERE _TABLE_SUFFIX >= '2016'")
+
+    def test_unknown_kind(self):
+        """Ensure watermark kinds are checked"""
+        self.assertRaises(AssertionError, Watermark, 'updated', 'version')
+
+
+class TestSync(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, 'watermarks.json')
+        self.store = WatermarkStore(self.path)
+        self.bq_client = mock.Mock()
+        self.upserted = []
+
+        def upsert_rows(user, password, database, table, columns, rows,
+                        key_columns, **kwargs):
+            self.upserted.append((table, columns, list(rows), key_columns))
+            return len(self.upserted[-1][2])
+        patcher = mock.patch.object(sync_module, 'upsert_rows', upsert_rows)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sync(self, rows, watermark=Watermark('updated'), **kwargs):
+        self.bq_client.query_rows.return_value = iter(rows)
+        return sync_table(self.bq_client, self.store,
+                          'project.my_data.my_table', watermark, 'user',
+                          'password', 'demo', 'temps', ['id'], **kwargs)
+
+    def test_watermark_advances(self):
+        """Ensure the highest value is stored and filters the next run"""
+        result = self.sync([
+            {'id': 1, 'updated': datetime(2017, 10, 9, 12, 30)},
+            {'id': 2, 'updated': datetime(2017, 10, 10, 8, 0)}])
+
+        self.assertEqual(result.rows, 2)
+        self.assertEqual(result.previous, None)
+        self.assertEqual(result.watermark, '2017-10-10 08:00:00.000000')
+        self.assertEqual(self.upserted[0][1:], (
+            ['id', 'updated'],
+            [[1, datetime(2017, 10, 9, 12, 30)],
+             [2, datetime(2017, 10, 10, 8, 0)]],
+            ['id']))
+        # Persisted across runs
+        self.assertEqual(WatermarkStore(self.path).get('demo.temps'),
+                         result.watermark)
+
+        result = self.sync([])
+
+        self.assertEqual(result, (0, '2017-10-10 08:00:00.000000',
+                                  '2017-10-10 08:00:00.000000'))
+        query = self.bq_client.query_rows.call_args[0][0]
+        self.assertTrue(query.endswith(
+            "WHERE `updated` >= TIMESTAMP '2017-10-10 08:00:00.000000'"))
+
+    def test_table_suffix_is_not_loaded(self):
+        """Ensure the suffix gives the watermark but is not a column"""
+        result = self.sync([{'id': 1, 'max': 50.0, '_table_suffix': '1990'},
+                            {'id': 2, 'max': 51.0, '_table_suffix': '1991'}],
+                           watermark=Watermark(None, 'table_suffix'))
+
+        self.assertEqual(result.watermark, '1991')
+        self.assertEqual(self.upserted[0][1], ['id', 'max'])
+
+    def test_watermark_column_is_queried(self):
+        """Ensure the watermark column is read even if not synced"""
+        self.sync([{'id': 1, 'updated': datetime(2017, 10, 9)}],
+                  columns=['id'])
+
+        query = self.bq_client.query_rows.call_args[0][0]
+        self.assertIn('SELECT `id`, `updated`', query)
+        self.assertEqual(self.upserted[0][1:3], (['id'], [[1]]))
+
+    def test_failed_load_keeps_watermark(self):
+        """Ensure the watermark only moves once the rows are in"""
+        self.store.set('demo.temps', '2017-01-01 00:00:00.000000')
+        with mock.patch.object(sync_module, 'upsert_rows',
+                               side_effect=IOError('lost')):
+            self.assertRaises(IOError, self.sync, [
+                {'id': 1, 'updated': datetime(2017, 10, 9)}])
+
+        self.assertEqual(self.store.get('demo.temps'),
+                         '2017-01-01 00:00:00.000000')
+
+    def test_query_cache_is_bypassed(self):
+        """Ensure a cached result of the same delta query is not reused"""
+        cache = QueryResultCache()
+        api_mock = mock.Mock()
+        api_mock.jobs().insert().execute.return_value = {
+            'jobReference': {'jobId': 'new'}, 'status': {'state': 'RUNNING'}}
+        bq_client = BigQueryClient(api_mock, 'project', query_cache=cache)
+        cache.put(query_cache_key(delta_query('project.my_data.my_table',
+                                              Watermark('updated'))),
+                  {'jobReference': {'jobId': 'old'},
+                   'status': {'state': 'DONE'}})
+
+        with mock.patch.object(BigQueryClient, 'read_query_rows',
+                               return_value=iter([])) as read_query_rows:
+            sync_table(bq_client, self.store, 'project.my_data.my_table',
+                       Watermark('updated'), 'user', 'password', 'demo',
+                       'temps', ['id'])
+
+        job = read_query_rows.call_args[0][0]
+        self.assertEqual(job['jobReference']['jobId'], 'new')
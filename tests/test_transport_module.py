@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+import json
+import threading
+import time
+import unittest
+from multiprocessing.pool import ThreadPool
+
+import httplib2
+import mock
+
+import bq_module
+from bq_module import BigQueryClient
+from transport_module import HttpPool
+
+
+class FakeHttp(object):
+    """Fake transport failing loudly if two threads use it at once"""
+
+    def __init__(self, delay=0.005):
+        self.delay = delay
+        self.busy = threading.Lock()
+        self.closed = False
+        self.requests = []
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        if not self.busy.acquire(False):
+            raise AssertionError('Http used concurrently')
+        try:
+            self.requests.append((uri, method))
+            time.sleep(self.delay)
+            job_id = uri.split('?')[0].rsplit('/', 1)[-1]
+            content = json.dumps({'status': {'state': 'DONE'},
+                                  'jobReference': {'jobId': job_id}})
+            return httplib2.Response({'status': 200}), content.encode()
+        finally:
+            self.busy.release()
+
+    def close(self):
+        self.closed = True
+
+
+class TestHttpPool(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+
+        def factory():
+            http = FakeHttp()
+            self.created.append(http)
+            return http
+        self.pool = HttpPool(factory, size=3)
+
+    def test_reuses_idle_transport(self):
+        """Ensure sequential requests share one transport"""
+        for _ in range(5):
+            self.pool.request('http://host/a')
+
+        self.assertEqual(len(self.created), 1)
+        stats = self.pool.stats()
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['reused'], 4)
+        self.assertEqual(stats['created'], 1)
+
+    def test_concurrency_bounded_by_size(self):
+        """Ensure concurrent requests never share a transport nor exceed
+        the pool size"""
+        workers = ThreadPool(10)
+        try:
+            workers.map(lambda i: self.pool.request('http://host/%d' % i),
+                        range(50))
+        finally:
+            workers.close()
+            workers.join()
+
+        stats = self.pool.stats()
+        self.assertEqual(len(self.created), 3)
+        self.assertEqual(stats['requests'], 50)
+        self.assertEqual(stats['reused'], 47)
+        self.assertEqual(stats['idle'], 3)
+        self.assertTrue(stats['waits'] > 0)
+
+    def test_failed_factory_frees_slot(self):
+        """Ensure a transport that could not be created does not leak"""
+        pool = HttpPool(mock.Mock(side_effect=[IOError(), FakeHttp()]), 1)
+
+        self.assertRaises(IOError, pool.request, 'http://host/a')
+        pool.request('http://host/a')
+        self.assertEqual(pool.stats()['created'], 1)
+
+    def test_close(self):
+        """Ensure idle transports are closed"""
+        self.pool.request('http://host/a')
+        self.pool.close()
+
+        self.assertTrue(self.created[0].closed)
+        self.assertEqual(self.pool.stats()['created'], 0)
+
+
+class TestPooledClient(unittest.TestCase):
+
+    def test_parallel_wait_for_job(self):
+        """Ensure one client can poll many jobs from a thread pool"""
+        pool = HttpPool(FakeHttp, size=4)
+        service = bq_module.build_from_document(
+            bq_module._load_discovery_document('bigquery', 'v2'), http=pool)
+        client = BigQueryClient(service, 'project')
+
+        workers = ThreadPool(8)
+        try:
+            jobs = workers.map(client.wait_for_job,
+                               ['job%d' % i for i in range(20)])
+        finally:
+            workers.close()
+            workers.join()
+
+        self.assertEqual([j['jobReference']['jobId'] for j in jobs],
+                         ['job%d' % i for i in range(20)])
+        stats = client.transport_stats()
+        self.assertEqual(stats['requests'], 20)
+        self.assertTrue(stats['created'] <= 4)
+
+    def test_unpooled_client_has_no_stats(self):
+        """Ensure transport_stats is None without a pool"""
+        self.assertIsNone(BigQueryClient(mock.Mock(), 'p').transport_stats())
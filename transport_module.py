@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+import threading
+
+from six.moves import queue
+
+
+class HttpPool(object):
+    """Thread-safe, ``httplib2.Http`` compatible pool of HTTP transports.
+
+    ``httplib2.Http`` is not thread-safe and keeps a single connection per
+    host. An HttpPool hands every request to an idle ``Http`` of its own, so
+    one service object (and one BigQueryClient) can be shared by many
+    threads. Transports are created lazily up to ``size``; once they are all
+    busy, requests wait for one to be released. Idle transports are reused
+    most recently released first, which keeps their keep-alive connections
+    warm.
+
+    Args:
+        factory: callable returning a new (authorized) ``Http`` object
+        size: int, maximum number of transports, i.e. of concurrent requests
+        credentials: optional credentials, exposed for googleapiclient which
+            refreshes them on 401 responses in batch requests
+    """
+
+    def __init__(self, factory, size=10, credentials=None):
+        assert size > 0, 'Pool size must be positive'
+        self.factory = factory
+        self.size = size
+        self.credentials = credentials
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._requests = 0
+        self._reused = 0
+        self._waits = 0
+
+    def request(self, *args, **kwargs):
+        """Perform a request with an idle transport, same signature as
+        ``httplib2.Http.request``"""
+        http = self._checkout()
+        try:
+            return http.request(*args, **kwargs)
+        finally:
+            self._idle.put(http)
+
+    def _checkout(self):
+        with self._lock:
+            self._requests += 1
+            try:
+                http = self._idle.get_nowait()
+                self._reused += 1
+                return http
+            except queue.Empty:
+                pass
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                self._waits += 1
+                create = False
+
+        if create:
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        http = self._idle.get()
+        with self._lock:
+            self._reused += 1
+        return http
+
+    def stats(self):
+        """Return connection reuse statistics.
+
+        Returns:
+            dict: ``size``, ``created`` transports, ``idle`` transports,
+            ``requests`` served, ``reused`` (requests served by an already
+            created transport) and ``waits`` (requests that had to wait for a
+            transport to be released)
+        """
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'idle': self._idle.qsize(),
+                'requests': self._requests,
+                'reused': self._reused,
+                'waits': self._waits,
+            }
+
+    def close(self):
+        """Close the connections of every idle transport"""
+        while True:
+            try:
+                http = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self._created -= 1
+            close = getattr(http, 'close', None)
+            if close:
+                close()